@@ -1,8 +1,9 @@
-from quart import Quart, request, render_template, jsonify, redirect, url_for, websocket
+from quart import Quart, Response, request, render_template, jsonify, redirect, url_for, websocket
 from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.events import EVENT_JOB_SUBMITTED
 from functools import wraps
 import logging
 import os
@@ -21,11 +22,26 @@ from translations import get_translation
 from language_manager import language_manager
 import ssh
 import group_run
+import ssh_pool
+from ssh_executor import executor as ssh_executor
+from ssh_bridge import (
+    handle_terminal_message, open_terminal, pump_terminal, pump_terminal_frames, run_until_first_done, terminal_backend, terminal_size
+)
+from telegram_client import outbox
+from broadcaster import broadcaster
+import output_capture
+from inventory import inventory, account_tags
+from config_store import store as config_store
+from scheduler_store import SQLiteJobStore, SCHEDULER_MISFIRE_GRACE_TIME
+from run_history import history as run_history
+from run_manager import manager as run_manager, RunCancelled
+from fanout import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from targets import resolver as target_resolver, TargetError
+import metrics
 import asyncssh
 from aiohttp import web, WSMsgType
 from aiohttp.web import middleware
 from aiohttp_cors import setup as setup_cors, ResourceOptions
-import paramiko
 import secrets
 
 # 忽略 cryptography 的弃用警告
@@ -45,35 +61,47 @@ async def add_cors_headers(response):
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
-ACCOUNTS_JSON = os.getenv('ACCOUNTS_JSON')
-AUTO_CONNECT_INTERVAL = os.getenv('AUTO_CONNECT_INTERVAL', '24')
+# 以下运行时设置保存在配置数据库中，环境变量只作为首次启动时的默认值
+AUTO_CONNECT_INTERVAL = config_store.get_setting('auto_connect_interval', os.getenv('AUTO_CONNECT_INTERVAL', '24'))
 RENDER_APP_URL = os.getenv('RENDER_APP_URL')
-RESET_INTERVAL_VARIATION = 10  # 默认为10分钟
+RESET_INTERVAL_VARIATION = config_store.get_setting('reset_interval_variation', 10)  # 默认为10分钟
 FEEDBACK_GROUP_LINK = "https://t.me/+WIX6H-944HQzZmQ9"
-CUSTOM_COMMAND = os.getenv('CUSTOM_COMMAND') or DEFAULT_COMMAND
-CRON_TASKS_JSON = os.getenv('CRON_TASKS_JSON')
-TIME_MODE = os.getenv('TIME_MODE', 'hour')  # 新增：默认为小时模式
+CUSTOM_COMMAND = config_store.get_setting('custom_command', os.getenv('CUSTOM_COMMAND') or DEFAULT_COMMAND)
+TIME_MODE = config_store.get_setting('time_mode', os.getenv('TIME_MODE', 'hour'))  # 新增：默认为小时模式
 LANGUAGE = os.getenv('LANGUAGE', 'zh')
 DEFAULT_PASSWORD = secrets.token_urlsafe(32)  # 生成一个随机的默认密码
 LOGIN_PASSWORD = os.getenv('CONTROL_PANEL_PASSWORD')
 
-host_execute_lock = asyncio.Lock()
-is_executing_host = False
 next_execute_time = None
 startup_complete = False
 welcome_message_sent = False
 
-scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
+# 任务保存在 SQLite 中，重启后按原有的执行时间和暂停状态继续调度；
+# 错过的多次执行合并为一次，超过宽限时间的直接跳过
+scheduler = AsyncIOScheduler(
+    timezone="Asia/Shanghai",
+    jobstores={'default': SQLiteJobStore()},
+    job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': SCHEDULER_MISFIRE_GRACE_TIME}
+)
+
+def record_scheduler_lag(event):
+    # 计划执行时间与实际开始执行之间的延迟（合并执行时取最近一次计划时间）
+    lag = datetime.datetime.now(pytz.UTC) - max(event.scheduled_run_times)
+    metrics.SCHEDULER_LAG_SECONDS.labels(event.job_id).observe(max(lag.total_seconds(), 0))
+
+scheduler.add_listener(record_scheduler_lag, EVENT_JOB_SUBMITTED)
 
 # 全局变量
 BOT_ACTIVE = True
 application = None
 websocket_connections = {}
-active_websockets = set()
+
+metrics.WEBSOCKET_CLIENTS.labels('output').set_function(lambda: len(broadcaster))
+metrics.EXECUTOR_QUEUE_DEPTH.set_function(lambda: ssh_executor.stats()['queued'])
+metrics.EXECUTOR_ACTIVE.set_function(lambda: ssh_executor.stats()['active'])
 
 def get_accounts():
-    ACCOUNTS_JSON = os.getenv('ACCOUNTS_JSON')
-    return json.loads(ACCOUNTS_JSON) if ACCOUNTS_JSON else []
+    return inventory.accounts()
 
 async def run_bot_and_server():
     # 启动 Telegram bot
@@ -187,7 +215,9 @@ async def set_cron(update: Update, context) -> None:
     if interval == 0:
         # 关闭循环
         AUTO_CONNECT_INTERVAL = '0'
-        scheduler.remove_job('main_execution')
+        config_store.set_setting('auto_connect_interval', AUTO_CONNECT_INTERVAL)
+        if scheduler.get_job('main_execution'):
+            scheduler.remove_job('main_execution')
         next_execute_time = None
         await update.message.reply_text(get_translation('cron_disabled'))
         return
@@ -212,15 +242,12 @@ async def set_cron(update: Update, context) -> None:
             return
 
     AUTO_CONNECT_INTERVAL = str(interval)
+    config_store.set_setting('auto_connect_interval', AUTO_CONNECT_INTERVAL)
     
     # 只更新主要的定时执行任务，不影响其他任务
-    main_job = scheduler.get_job('main_execution')
-    if main_job:
-        scheduler.remove_job('main_execution')
-    
     now = get_beijing_time()
     next_execute_time = calculate_next_execute_time(now, interval)
-    scheduler.add_job(scheduled_execute_host, 'date', run_date=next_execute_time, args=[context.bot], id='main_execution')
+    schedule_main_execution(next_execute_time)
     
     await update.message.reply_text(
         get_translation('cron_set', time_mode=TIME_MODE).format(
@@ -275,6 +302,7 @@ async def set_vartime(update: Update, context) -> None:
             return
 
     RESET_INTERVAL_VARIATION = new_variation
+    config_store.set_setting('reset_interval_variation', RESET_INTERVAL_VARIATION)
     await update.message.reply_text(get_translation('variation_set', time_mode=TIME_MODE).format(
         variation=RESET_INTERVAL_VARIATION,
         variation_unit=get_translation('minutes') if TIME_MODE == 'hour' else get_translation('seconds')
@@ -282,8 +310,7 @@ async def set_vartime(update: Update, context) -> None:
 
     now = get_beijing_time()
     next_execute_time = calculate_next_execute_time(now, int(AUTO_CONNECT_INTERVAL))
-    scheduler.remove_all_jobs()
-    scheduler.add_job(scheduled_execute_host, 'date', run_date=next_execute_time, args=[context.bot])
+    schedule_main_execution(next_execute_time)
     await update.message.reply_text(
         get_translation('next_execution_updated', time_mode=TIME_MODE).format(
             interval=AUTO_CONNECT_INTERVAL,
@@ -304,6 +331,7 @@ async def set_command(update: Update, context) -> None:
         return
 
     CUSTOM_COMMAND = ' '.join(context.args)
+    config_store.set_setting('custom_command', CUSTOM_COMMAND)
     await update.message.reply_text(get_translation('custom_command_set').format(command=CUSTOM_COMMAND))
 
 async def change_language(update: Update, context) -> None:
@@ -336,6 +364,7 @@ async def switch_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     # 切换模式
     TIME_MODE = "minute" if TIME_MODE == "hour" else "hour"
+    config_store.set_setting('time_mode', TIME_MODE)
     current_mode = get_translation('hour_mode') if TIME_MODE == "hour" else get_translation('minute_mode')
     
     # 删除所有现有任务
@@ -353,8 +382,7 @@ async def switch_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     interval = int(AUTO_CONNECT_INTERVAL)
     now = get_beijing_time()
     next_execute_time = calculate_next_execute_time(now, interval)
-    
-    scheduler.add_job(scheduled_execute_host, 'date', run_date=next_execute_time, args=[context.bot], id='main_execution')
+    schedule_main_execution(next_execute_time)
     
     # 准备并发送切换模式的消息
     mode_switched_message = get_translation('mode_switched').format(time_mode=current_mode)
@@ -374,9 +402,6 @@ async def switch_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # 自动执行 /listtasks 命令
     await list_tasks(update, context)
 
-    # 保存更新后的任务
-    save_tasks(current_tasks)
-
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
     if update and isinstance(update, Update) and update.effective_message:
@@ -391,69 +416,61 @@ async def websocket_handler(request):
     websocket_connections[host] = ws
 
     # 获取主机信息
-    host_info = next((h for h in get_accounts() if h['customhostname'] == host), None)
+    host_info = inventory.get_by_name(host)
     if not host_info:
         await ws.send_str("Host not found")
         await ws.close()
         return ws
 
-    # 创建 SSH 客户端
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    conn = None
+    terminal = None
+    metrics.WEBSOCKET_CLIENTS.labels('ssh').inc()
 
     try:
-        # 连接到 SSH 服务器
-        await asyncio.get_event_loop().run_in_executor(
-            None, 
-            lambda: ssh.connect(
-                host_info['sslhost'] or host_info['hostname'],
-                username=host_info['ssluser'] or host_info['username'],
-                password=host_info.get('password'),
-                key_filename=host_info.get('secretkey'),
-                timeout=10
-            )
+        # 从连接池借用 SSH 连接
+        conn = await asyncio.wait_for(
+            ssh_pool.pool.acquire(
+                host_info.get('sslhost') or host_info.get('hostname'),
+                int(host_info.get('port', 22)),
+                host_info.get('ssluser') or host_info.get('username'),
+                host_info.get('password'),
+                host_info.get('secretkey'),
+                backend=terminal_backend()
+            ),
+            timeout=10
         )
 
-        # 创建 SSH shell
-        channel = ssh.invoke_shell()
+        # 创建 SSH shell（占用共享连接上的一个通道名额）
+        terminal = await open_terminal(conn)
         
         # 发送初始提示符
         await ws.send_str(f"Connected to {host}\n")
 
-        async def read_ssh():
-            while True:
-                if channel.recv_ready():
-                    data = channel.recv(1024).decode('utf-8', errors='ignore')
-                    await ws.send_str(data)
-                await asyncio.sleep(0.1)
-
-        # 启动读取 SSH 输出的任务
-        read_task = asyncio.create_task(read_ssh())
-
-        try:
+        async def write_ssh():
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     if msg.data == 'close':
                         break
                     else:
                         # 执行 SSH 命令
-                        channel.send(msg.data + "\n")
+                        await terminal.write(msg.data + "\n")
                 elif msg.type == WSMsgType.ERROR:
                     print(f'WebSocket connection closed with exception {ws.exception()}')
                     break
-        finally:
-            read_task.cancel()
-            try:
-                await read_task
-            except asyncio.CancelledError:
-                pass
+
+        # SSH 输出到达时立即转发，WebSocket 发送完成后才继续读取（背压）
+        await run_until_first_done(pump_terminal(terminal, ws.send_str), write_ssh())
 
     except Exception as e:
         await ws.send_str(f"Error: {str(e)}")
     finally:
         if host in websocket_connections:
             del websocket_connections[host]
-        ssh.close()
+        if terminal:
+            terminal.close()
+        if conn:
+            ssh_pool.pool.release(conn)
+        metrics.WEBSOCKET_CLIENTS.labels('ssh').dec()
 
     await ws.close()
     return ws
@@ -494,6 +511,9 @@ async def setup_bot():
         application.add_handler(CommandHandler("pausetask", pause_task))
         application.add_handler(CommandHandler("resumetask", resume_task))
         application.add_handler(CommandHandler("switchmode", switch_mode))  # 新增：切换时间单位模式
+        application.add_handler(CommandHandler("history", show_history))
+        application.add_handler(CommandHandler("runs", show_runs))
+        application.add_handler(CommandHandler("cancelrun", cancel_run))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
         application.add_handler(MessageHandler(filters.COMMAND, handle_message))
         application.add_error_handler(error_handler)
@@ -506,52 +526,69 @@ async def setup_bot():
             webhook_url = f"{os.getenv('APP_URL')}/{os.getenv('TELEGRAM_BOT_TOKEN')}"
             await application.bot.set_webhook(webhook_url)
 
-        # 加载并调度所有保存的任务
-        tasks = load_tasks_from_config()
-        for task in tasks:
-            await schedule_task(task)
-
     return application  # 返回 application 对象
 
 async def log_and_send(bot, message):
     logger.info(message)
-    await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message)
+    await outbox.send_message(message, chat_id=TELEGRAM_CHAT_ID)
+
+async def run_batch(bot, command, target, source, send_messages=False, notify_telegram=True, priority=PRIORITY_INTERACTIVE,
+                    broadcast_result=False):
+    """
+    通过 run_manager 执行批量命令：与正在进行的执行没有相同主机时立即开始，否则排队并通知排队位置；
+    与排队中的执行完全相同时合并执行。broadcast_result 为 True 时执行结束后向控制面板广播一次结果，
+    合并的请求不会重复广播。手动触发的执行使用 PRIORITY_INTERACTIVE，定时任务使用 PRIORITY_BACKGROUND。
+    返回 (success_count, total_count, failed_hosts)；排队期间被取消时抛出 RunCancelled。
+    """
+    async def notify_queued(run, position, merged):
+        message = get_translation('run_merged' if merged else 'run_queued').format(id=run.id, position=position)
+        await broadcast_output(message)
+        if notify_telegram:
+            await log_and_send(bot, message)
+
+    async def job(run):
+        # 每台主机完成后立即释放它的锁，与本次执行重叠的排队执行不必等待整个执行结束
+        result = await host_execute_main(command=command, target=target, send_messages=send_messages, priority=run.priority,
+                                         on_host_done=lambda account: run_manager.host_done(run, account),
+                                         target_accounts=run.accounts)
+        if broadcast_result:
+            # 每次执行只广播一次，合并进来的请求共享这条结果
+            await broadcast_output(execution_result_message(*result))
+        return result
+
+    return await run_manager.run(
+        command, target, job,
+        source=source,
+        on_queued=notify_queued,
+        priority=priority,
+        delivery=(send_messages, notify_telegram, broadcast_result)
+    )
 
-async def execute_host(bot, command, target='all', send_telegram=True):
-    global is_executing_host
-    async with host_execute_lock:
-        if is_executing_host:
-            if send_telegram:
-                await log_and_send(bot, get_translation('executing_command'))
-            return None, None, None
-        is_executing_host = True
+def execution_result_message(success_count, total_count, failed_hosts):
+    execution_result = f"Command execution completed. Success: {success_count}/{total_count}"
+    if failed_hosts:
+        execution_result += "\n\nFailed hosts:\n" + "\n".join([f"{host['host']}: {host['reason']}" for host in failed_hosts])
+    return execution_result
 
+async def execute_host(bot, command, target='all', send_telegram=True):
     try:
-        success_count, total_count, failed_hosts = await host_execute_main(command=command, target=target, send_messages=send_telegram)
-        
-        # 构建失败主机的消息
-        failure_message = ""
-        if failed_hosts:
-            failure_message = "Failed hosts:\n" + "\n".join([f"{host['host']}: {host['reason']}" for host in failed_hosts])
-        
-        # 构建完整的执行结果消息
-        execution_result = f"Command execution completed. Success: {success_count}/{total_count}"
-        if failure_message:
-            execution_result += f"\n\n{failure_message}"
-        
-        # 通过WebSocket发送执行结果
-        await broadcast_output(execution_result)
-        
+        success_count, total_count, failed_hosts = await run_batch(
+            bot, command, target, 'telegram' if send_telegram else 'web',
+            send_messages=send_telegram, notify_telegram=send_telegram, broadcast_result=True
+        )
         return success_count, total_count, failed_hosts
+    except RunCancelled as e:
+        message = get_translation('run_cancelled').format(id=e.args[0])
+        await broadcast_output(message)
+        if send_telegram:
+            await log_and_send(bot, message)
+        return None
     except Exception as e:
         error_message = f"Error executing command: {str(e)}"
         await broadcast_output(error_message)
         if send_telegram:
             await log_and_send(bot, get_translation('command_error').format(error=str(e)))
         return 0, 0, []
-    finally:
-        async with host_execute_lock:
-            is_executing_host = False
 
 def calculate_next_execute_time(current_time, interval):
     if TIME_MODE == "hour":
@@ -563,18 +600,28 @@ def calculate_next_execute_time(current_time, interval):
         variation_seconds = random.uniform(-RESET_INTERVAL_VARIATION, RESET_INTERVAL_VARIATION)
         return base_time + datetime.timedelta(seconds=variation_seconds)
 
-async def scheduled_execute_host(bot):
+def schedule_main_execution(run_date):
+    # 错过执行时间（例如服务重启期间）时不跳过，启动后补跑一次
+    scheduler.add_job(scheduled_execute_host, 'date', run_date=run_date, id='main_execution',
+                      replace_existing=True, misfire_grace_time=None)
+
+async def scheduled_execute_host(bot=None):
     global next_execute_time
     current_time = get_beijing_time()
     await log_and_send(bot, get_translation('scheduled_execution_start').format(
         beijing_time=current_time.strftime("%Y-%m-%d %H:%M:%S"),
         utc_time=current_time.astimezone(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
     ))
-    success_count, total_count, failed_hosts = await host_execute_main(send_messages=False, command=CUSTOM_COMMAND)
+    try:
+        success_count, total_count, failed_hosts = await run_batch(bot, CUSTOM_COMMAND, 'all', 'scheduled', priority=PRIORITY_BACKGROUND)
+    except RunCancelled as e:
+        # 本次被取消，仍按间隔安排下一次执行
+        await log_and_send(bot, get_translation('run_cancelled').format(id=e.args[0]))
+        success_count, total_count, failed_hosts = None, None, None
     next_execute_time = calculate_next_execute_time(current_time, int(AUTO_CONNECT_INTERVAL))
-    
-    scheduler.remove_all_jobs()
-    scheduler.add_job(scheduled_execute_host, 'date', run_date=next_execute_time, args=[bot])
+    schedule_main_execution(next_execute_time)
+    if success_count is None:
+        return
     
     completion_message = get_translation('scheduled_execution_complete').format(
         success_count=success_count,
@@ -619,16 +666,11 @@ async def set_webhook():
                 return False
 
 def get_account_info(identifier):
-    accounts = json.loads(ACCOUNTS_JSON)
-    for account in accounts:
-        if account.get('customhostname', '').lower() == identifier.lower() or \
-           f"{account.get('ssluser', account.get('username'))}@{account.get('sslhost', account.get('hostname'))}".lower() == identifier.lower():
-            return account
-    return None
+    return inventory.get(identifier)
 
 @app.before_serving
 async def startup():
-    global application, next_execute_time, active_websockets, welcome_message_sent
+    global application, next_execute_time, welcome_message_sent
     
     # 设置应用程序
     application = await setup_bot()
@@ -639,22 +681,15 @@ async def startup():
         logger.error(get_translation('webhook_setup_failed'))
         return
 
-    # 设置定时任务
-    interval = int(AUTO_CONNECT_INTERVAL)
-    now = get_beijing_time()
-    next_execute_time = calculate_next_execute_time(now, interval)
-    scheduler.add_job(scheduled_execute_host, 'date', run_date=next_execute_time, args=[application.bot], id='main_execution')
-    
-    # 加载并调度所有任务
-    tasks = load_tasks()
-    for task in tasks['tasks']:
-        await schedule_task(task)
-    
+    # 启动调度器，已保存的任务按原有的执行时间恢复，只补充缺失或已修改的任务
     scheduler.start()
-    logger.info(f"定时执行命令已启用，间隔为 {interval} {'小时' if TIME_MODE == 'hour' else '分钟'}，下一次执行命令时间：北京时间 {next_execute_time.strftime('%Y-%m-%d %H:%M:%S')}(UTC时间：{next_execute_time.astimezone(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')})")
+    await restore_schedule()
+    interval = int(AUTO_CONNECT_INTERVAL)
+    if next_execute_time:
+        logger.info(f"定时执行命令已启用，间隔为 {interval} {'小时' if TIME_MODE == 'hour' else '分钟'}，下一次执行命令时间：北京时间 {next_execute_time.strftime('%Y-%m-%d %H:%M:%S')}(UTC时间：{next_execute_time.astimezone(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')})")
 
-    # 初始化 WebSocket 连接集合
-    active_websockets = set()
+    # 批量执行的实时输出推送到 /ws/output
+    group_run.set_output_callback(broadcast_chunk)
 
     # 只有在所有设置都完成后，才发送欢迎消息
     if not welcome_message_sent:
@@ -676,6 +711,12 @@ async def shutdown():
     if application:
         await application.stop()
     scheduler.shutdown()
+    await outbox.close()
+    ssh_pool.pool.close_all()
+    ssh_executor.shutdown()
+    output_capture.cleanup()
+    config_store.close()
+    run_history.close()
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_message or not update.effective_message.text:
@@ -699,7 +740,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         command = message_text.split()[0].lower()
         valid_commands = ['/start', '/grouprun', '/grouprundefault', '/setcron', '/setvartime', 
                           '/ssh', '/exit', '/setcommand', '/uploadkeys', '/language', '/addtask', 
-                          '/listtasks', '/removetask', '/pausetask', '/resumetask', '/switchmode']
+                          '/listtasks', '/removetask', '/pausetask', '/resumetask', '/switchmode', '/history',
+                          '/runs', '/cancelrun']
         
         if command not in valid_commands:
             await update.effective_message.reply_text(get_translation('unknown_command'))
@@ -715,48 +757,60 @@ async def send_welcome_message(update: Update, context) -> None:
     reply_markup = create_feedback_keyboard()
     await update.message.reply_text(welcome_message, reply_markup=reply_markup)
 
-async def schedule_task(task):
+async def run_scheduled_task(task_id):
+    # 模块级函数，任务参数只有 task_id，便于持久化保存；执行时从配置数据库读取最新的任务内容
+    task = config_store.get_task(task_id)
+    if task is None:
+        logger.warning(f"Scheduled task {task_id} no longer exists, removing its job")
+        if scheduler.get_job(f"task_{task_id}"):
+            scheduler.remove_job(f"task_{task_id}")
+        return
+    command = task['command']
+    target = task['target']
     interval = task['interval']
-    variation = task['variation']
-    
-    async def task_function():
-        task_id = task['id']
-        command = task['command']
-        target = task['target']
-        now = get_beijing_time()
-        await application.bot.send_message(
-            chat_id=TELEGRAM_CHAT_ID,
-            text=get_translation('task_execution_start').format(
-                task_id=task_id,
-                target=target,
-                command=command,
-                beijing_time=now.strftime("%Y-%m-%d %H:%M:%S"),
-                utc_time=now.astimezone(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
-            )
-        )
-        
-        success_count, total_count, failed_hosts = await host_execute_main(command=command, target=target, send_messages=False)
-        
-        next_run = calculate_next_execute_time(now, interval)
-        completion_message = get_translation('task_execution_complete').format(
+    now = get_beijing_time()
+    await outbox.send_message(
+        get_translation('task_execution_start').format(
             task_id=task_id,
             target=target,
             command=command,
-            success_count=success_count,
-            total_count=total_count,
-            next_run_beijing=next_run.strftime("%Y-%m-%d %H:%M:%S"),
-            next_run_utc=next_run.astimezone(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
-        )
-        
-        if failed_hosts:
-            failure_message = get_translation('failed_hosts') + "\n" + "\n".join([f"{host['host']}: {host['reason']}" for host in failed_hosts])
-            completion_message += "\n\n" + failure_message
-        
-        await application.bot.send_message(
-            chat_id=TELEGRAM_CHAT_ID,
-            text=completion_message
-        )
+            beijing_time=now.strftime("%Y-%m-%d %H:%M:%S"),
+            utc_time=now.astimezone(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+        ),
+        chat_id=TELEGRAM_CHAT_ID
+    )
+    
+    try:
+        success_count, total_count, failed_hosts = await run_batch(None, command, target, f"task {task_id}", priority=PRIORITY_BACKGROUND)
+    except RunCancelled as e:
+        await outbox.send_message(get_translation('run_cancelled').format(id=e.args[0]), chat_id=TELEGRAM_CHAT_ID)
+        return
+    
+    next_run = calculate_next_execute_time(now, interval)
+    completion_message = get_translation('task_execution_complete').format(
+        task_id=task_id,
+        target=target,
+        command=command,
+        success_count=success_count,
+        total_count=total_count,
+        next_run_beijing=next_run.strftime("%Y-%m-%d %H:%M:%S"),
+        next_run_utc=next_run.astimezone(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+    )
     
+    if failed_hosts:
+        failure_message = get_translation('failed_hosts') + "\n" + "\n".join([f"{host['host']}: {host['reason']}" for host in failed_hosts])
+        completion_message += "\n\n" + failure_message
+    
+    await outbox.send_message(completion_message, chat_id=TELEGRAM_CHAT_ID)
+
+def task_signature(task):
+    # 任务内容或时间单位模式变化后签名随之变化，启动时据此判断是否需要重新调度
+    return f"{task['command']}|{task['interval']}|{task['variation']}|{task['target']}|{TIME_MODE}"
+
+async def schedule_task(task):
+    interval = task['interval']
+    variation = task['variation']
+
     trigger = IntervalTrigger(
         hours=interval if TIME_MODE == "hour" else 0,
         minutes=interval if TIME_MODE == "minute" else 0,
@@ -764,55 +818,53 @@ async def schedule_task(task):
     )
     
     job = scheduler.add_job(
-        task_function,
+        run_scheduled_task,
         trigger=trigger,
+        args=[task['id']],
         id=f"task_{task['id']}",
+        name=task_signature(task),
         replace_existing=True
     )
     return job
 
-def load_accounts():
-    if ACCOUNTS_JSON:
-        try:
-            return json.loads(ACCOUNTS_JSON)
-        except json.JSONDecodeError:
-            logger.error("Failed to parse ACCOUNTS_JSON")
-    return []
+async def restore_schedule():
+    global next_execute_time
+    job_ids = set()
+    for task in load_tasks_from_config():
+        job_id = f"task_{task['id']}"
+        job_ids.add(job_id)
+        job = scheduler.get_job(job_id)
+        if job is None or job.name != task_signature(task):
+            paused = job is not None and job.next_run_time is None
+            job = await schedule_task(task)
+            if paused:
+                job.pause()
+    for job in scheduler.get_jobs():
+        if job.id.startswith('task_') and job.id not in job_ids:
+            job.remove()
 
-def load_host_groups():
-    if CRON_TASKS_JSON:
-        try:
-            cron_tasks = json.loads(CRON_TASKS_JSON)
-            return cron_tasks.get("host_groups", {})
-        except json.JSONDecodeError:
-            logger.error("Failed to parse CRON_TASKS_JSON")
-    return {}
+    main_job = scheduler.get_job('main_execution')
+    if main_job and main_job.next_run_time:
+        next_execute_time = get_beijing_time(main_job.next_run_time)
+    elif int(AUTO_CONNECT_INTERVAL) > 0:
+        next_execute_time = calculate_next_execute_time(get_beijing_time(), int(AUTO_CONNECT_INTERVAL))
+        schedule_main_execution(next_execute_time)
+    else:
+        next_execute_time = None
+    logger.info(f"已恢复 {len(scheduler.get_jobs())} 个定时任务")
+
+def load_accounts():
+    return inventory.accounts()
 
 def validate_target(target):
-    accounts = load_accounts()
-    host_groups = load_host_groups()
-    
-    valid_hosts = set(account.get('customhostname', '').lower() for account in accounts if 'customhostname' in account)
-    valid_hosts.update(f"{account.get('ssluser', account.get('username'))}@{account.get('sslhost', account.get('hostname'))}".lower() for account in accounts)
-    
-    targets = target.split(',')
-    for t in targets:
-        t = t.strip().lower()
-        if t == 'all':
-            continue
-        if t.startswith('+') or t.startswith('-'):
-            try:
-                int(t[1:])
-                continue
-            except ValueError:
-                return False
-        if t.startswith('group:'):
-            group_name = t[6:]
-            if group_name not in host_groups:
-                return False
-        elif t not in valid_hosts:
-            return False
-    return True
+    try:
+        unknown = target_resolver.unknown_terms(target)
+    except TargetError as e:
+        logger.warning(f"Invalid target expression '{target}': {e}")
+        return False
+    if unknown:
+        logger.warning(f"Unknown targets in '{target}': {', '.join(unknown)}")
+    return not unknown
 
 def validate_task(task):
     required_fields = ['id', 'command', 'interval', 'variation', 'target']
@@ -956,6 +1008,97 @@ async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     else:
         await update.message.reply_text(full_message)
 
+def format_host_record(host):
+    def seconds(value):
+        return f"{value:.2f}" if value is not None else "-"
+    return get_translation('history_host_line').format(
+        host=host['host'],
+        connect_time=seconds(host['connect_time']),
+        exec_time=seconds(host['exec_time']),
+        exit_status=host['exit_status'] if host['exit_status'] is not None else "-",
+        output_size=host['output_size'] if host['output_size'] is not None else "-"
+    )
+
+async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if str(update.message.chat_id) != TELEGRAM_CHAT_ID:
+        await update.message.reply_text(get_translation('no_permission'))
+        return
+
+    if not context.args:
+        runs = run_history.list_runs(limit=10)
+        if not runs:
+            await update.message.reply_text(get_translation('history_empty'))
+            return
+        lines = [get_translation('history_header')]
+        for run in runs:
+            lines.append(get_translation('history_run').format(
+                id=run['id'],
+                time=get_beijing_time(datetime.datetime.fromtimestamp(run['started_at'], pytz.UTC)).strftime('%Y-%m-%d %H:%M:%S'),
+                success=run['success'],
+                total=run['total'],
+                duration=f"{run['duration']:.1f}",
+                command=run['command'],
+                target=run['target']
+            ))
+        await outbox.send_message("\n\n".join(lines), chat_id=update.message.chat_id)
+        return
+
+    if not context.args[0].isdigit():
+        await update.message.reply_text(get_translation('history_usage'))
+        return
+
+    run = run_history.get_run(int(context.args[0]))
+    if run is None:
+        await update.message.reply_text(get_translation('history_run_not_found').format(id=context.args[0]))
+        return
+
+    message = get_translation('history_run_detail').format(
+        id=run['id'],
+        time=get_beijing_time(datetime.datetime.fromtimestamp(run['started_at'], pytz.UTC)).strftime('%Y-%m-%d %H:%M:%S'),
+        command=run['command'],
+        target=run['target'],
+        success=run['success'],
+        total=run['total'],
+        duration=f"{run['duration']:.1f}"
+    )
+    slowest = [host for host in run_history.list_hosts(run['id'], order='exec_time') if host['exec_time'] is not None][:10]
+    if slowest:
+        message += "\n\n" + get_translation('history_slowest_hosts') + "\n" + "\n".join(format_host_record(host) for host in slowest)
+    failed = run_history.list_hosts(run['id'], failed_only=True)
+    if failed:
+        message += "\n\n" + get_translation('history_failed_hosts') + "\n" + "\n".join(f"{host['host']}: {host['reason']}" for host in failed)
+    await outbox.send_message(message, chat_id=update.message.chat_id)
+
+async def show_runs(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if str(update.message.chat_id) != TELEGRAM_CHAT_ID:
+        await update.message.reply_text(get_translation('no_permission'))
+        return
+
+    runs = run_manager.snapshot()
+    if not runs:
+        await update.message.reply_text(get_translation('runs_empty'))
+        return
+    lines = [get_translation('runs_header')]
+    for run in runs:
+        key = 'runs_running' if run['state'] == 'running' else 'runs_queued'
+        lines.append(get_translation(key).format(**dict(run, priority=get_translation(f"priority_{run['priority']}"))))
+    await outbox.send_message("\n".join(lines), chat_id=update.message.chat_id)
+
+async def cancel_run(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if str(update.message.chat_id) != TELEGRAM_CHAT_ID:
+        await update.message.reply_text(get_translation('no_permission'))
+        return
+
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text(get_translation('cancelrun_usage'))
+        return
+
+    run = run_manager.cancel(int(context.args[0]))
+    if run is None:
+        await update.message.reply_text(get_translation('cancelrun_not_queued').format(id=context.args[0]))
+    else:
+        await update.message.reply_text(get_translation('run_cancelled').format(id=run.id))
+
 async def pause_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if str(update.message.chat_id) != TELEGRAM_CHAT_ID:
         await update.message.reply_text(get_translation('no_permission'))
@@ -1026,80 +1169,21 @@ async def remove_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     scheduler.remove_job(f"task_{task_id}")
     await update.message.reply_text(f"Task with ID {task_id} has been removed.")
 
+# 定时任务保存在配置数据库中，以下函数只做一层转发
 def load_tasks():
-    tasks = {"tasks": []}
-    
-    # 首先加载 CRON_TASKS_JSON 中的任务
-    if CRON_TASKS_JSON:
-        try:
-            cron_tasks = json.loads(CRON_TASKS_JSON)
-            tasks["tasks"] = cron_tasks.get("tasks", [])
-        except json.JSONDecodeError:
-            logger.error("Failed to parse CRON_TASKS_JSON")
-    
-    # 然后加载通过 /addtask 添加的任务
-    added_tasks_json = os.getenv('ADDED_TASKS_JSON', '{"tasks": []}')
-    try:
-        added_tasks = json.loads(added_tasks_json)
-        tasks["tasks"].extend(added_tasks.get("tasks", []))
-    except json.JSONDecodeError:
-        logger.error("Failed to parse ADDED_TASKS_JSON")
-    
-    return tasks
-
-def save_tasks(tasks):
-    # 只保存通过 /addtask 添加的任务
-    cron_tasks = json.loads(CRON_TASKS_JSON) if CRON_TASKS_JSON else {"tasks": []}
-    cron_task_ids = {task['id'] for task in cron_tasks.get('tasks', [])}
-    
-    added_tasks = {"tasks": [task for task in tasks['tasks'] if task['id'] not in cron_task_ids]}
-    
-    # 更新环境变量
-    os.environ['ADDED_TASKS_JSON'] = json.dumps(added_tasks)
-    
-    # 合并 CRON_TASKS_JSON 和 ADDED_TASKS_JSON
-    all_tasks = cron_tasks.copy()
-    all_tasks['tasks'].extend(added_tasks['tasks'])
-    
-    # 更新 CRON_TASKS_JSON 环境变量
-    os.environ['CRON_TASKS_JSON'] = json.dumps(all_tasks)
+    return {"tasks": config_store.list_tasks()}
 
 def load_tasks_from_config():
-    cron_tasks_json = os.getenv('CRON_TASKS_JSON', '{"tasks": [], "host_groups": {}}')
-    config = json.loads(cron_tasks_json)
-    tasks = config['tasks']
-    for task in tasks:
-        task['interval'] = int(task['interval'])
-        task['variation'] = int(task['variation'])
-    return tasks
-
-def save_tasks_to_config(tasks):
-    cron_tasks_json = os.getenv('CRON_TASKS_JSON', '{"tasks": [], "host_groups": {}}')
-    config = json.loads(cron_tasks_json)
-    config['tasks'] = tasks
-    os.environ['CRON_TASKS_JSON'] = json.dumps(config)
+    return config_store.list_tasks()
 
 def add_task_to_config(task):
-    tasks = load_tasks_from_config()
-    task['id'] = str(len(tasks) + 1)
-    task['interval'] = int(task['interval'])
-    task['variation'] = int(task['variation'])
-    tasks.append(task)
-    save_tasks_to_config(tasks)
-    return task
+    return config_store.add_task(task)
 
 def remove_task_from_config(task_id):
-    tasks = load_tasks_from_config()
-    tasks = [task for task in tasks if task['id'] != task_id]
-    save_tasks_to_config(tasks)
+    config_store.delete_task(task_id)
 
 def edit_task_in_config(task_id, updated_task):
-    tasks = load_tasks_from_config()
-    for i, task in enumerate(tasks):
-        if task['id'] == task_id:
-            tasks[i] = updated_task
-            break
-    save_tasks_to_config(tasks)
+    return config_store.update_task(task_id, updated_task)
 
 async def remove_webhook():
     bot = Bot(TELEGRAM_BOT_TOKEN)
@@ -1123,6 +1207,83 @@ async def health_check():
     
     return f"OK - Server is running. UTC time: {utc_str}, Beijing time: {beijing_str}", 200
 
+@app.route('/metrics')
+async def metrics_endpoint():
+    # 指标包含主机清单等信息：已登录控制面板或携带正确的 METRICS_TOKEN 才能访问，
+    # 未配置 METRICS_TOKEN 时对未登录的请求隐藏该地址
+    if not request.cookies.get('authenticated'):
+        if not metrics.METRICS_TOKEN:
+            return "Not Found", 404
+        token = request.args.get('token') or request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+        if not secrets.compare_digest(token.encode(), metrics.METRICS_TOKEN.encode()):
+            return "Unauthorized", 401
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/ssh_stats')
+@login_required
+async def ssh_stats():
+    return jsonify({
+        'executor': ssh_executor.stats(),
+        'pool': ssh_pool.pool.stats()
+    })
+
+@app.route('/api/runs')
+@login_required
+async def list_runs():
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    offset = request.args.get('offset', 0, type=int)
+    return jsonify({'runs': run_history.list_runs(limit=limit, offset=offset, command=request.args.get('command'))})
+
+@app.route('/api/runs/<int:run_id>')
+@login_required
+async def get_run(run_id):
+    run = run_history.get_run(run_id)
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+    return jsonify(run)
+
+@app.route('/api/runs/<int:run_id>/hosts')
+@login_required
+async def get_run_hosts(run_id):
+    if run_history.get_run(run_id) is None:
+        return jsonify({'error': 'Run not found'}), 404
+    hosts = run_history.list_hosts(
+        run_id,
+        order=request.args.get('order', 'exec_time'),
+        failed_only=request.args.get('failed', '').lower() in ('1', 'true')
+    )
+    return jsonify({'run_id': run_id, 'hosts': hosts})
+
+@app.route('/api/queue')
+@login_required
+async def list_run_queue():
+    # 正在进行和排队中的批量执行（排队的带有 position）
+    return jsonify({'runs': run_manager.snapshot()})
+
+@app.route('/api/queue/<int:run_id>/cancel', methods=['POST'])
+@login_required
+async def cancel_queued_run(run_id):
+    run = run_manager.cancel(run_id)
+    if run is None:
+        return jsonify({'error': 'Run is not queued'}), 404
+    return jsonify(run.to_dict())
+
+@app.route('/api/output/<capture_id>')
+@login_required
+async def download_output(capture_id):
+    capture = output_capture.get_capture(capture_id)
+    if capture is None:
+        return jsonify({'error': 'Output not found'}), 404
+
+    async def generate():
+        for chunk in capture.iter_text():
+            yield chunk.encode('utf-8')
+
+    filename = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', capture.host) or 'output'}.{capture.stream}.txt"
+    return Response(generate(), mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
 @app.route('/login', methods=['GET', 'POST'])
 async def login():
     if not LOGIN_PASSWORD or LOGIN_PASSWORD == DEFAULT_PASSWORD:
@@ -1191,7 +1352,7 @@ async def web_execute_default_command():
             
             result = await execute_host(application.bot, CUSTOM_COMMAND, 'all', send_telegram=False)
             if result is None:
-                return jsonify({"status": "error", "message": "Execute host returned None"})
+                return jsonify({"status": "error", "message": "Run was cancelled while queued"})
             
             success_count, total_count, failed_hosts = result
             
@@ -1226,7 +1387,7 @@ async def web_execute_group_run():
             
             result = await execute_host(application.bot, command, target, send_telegram=False)
             if result is None:
-                return jsonify({"status": "error", "message": "Execute host returned None"})
+                return jsonify({"status": "error", "message": "Run was cancelled while queued"})
             
             success_count, total_count, failed_hosts = result
             
@@ -1272,16 +1433,10 @@ async def web_remove_task():
 async def edit_task():
     data = await request.json
     task_id = data.get('id')
-    tasks = load_tasks_from_config()
-    for i, task in enumerate(tasks):
-        if task['id'] == task_id:
-            # 确保 interval 和 variation 是整数
-            data['interval'] = int(data['interval'])
-            data['variation'] = int(data['variation'])
-            tasks[i] = data
-            save_tasks_to_config(tasks)
-            await schedule_task(data)
-            return jsonify({"status": "success", "message": "Task updated successfully"})
+    task = edit_task_in_config(task_id, data)
+    if task:
+        await schedule_task(task)
+        return jsonify({"status": "success", "message": "Task updated successfully"})
     return jsonify({"status": "error", "message": "Task not found"})
 
 @app.route('/api/get_tasks')
@@ -1298,42 +1453,33 @@ async def config_page():
 @app.route('/api/get_config', methods=['GET'])
 @login_required
 async def get_config():
-    accounts_json = os.getenv('ACCOUNTS_JSON', '[]')
-    cron_tasks_json = os.getenv('CRON_TASKS_JSON', '{"tasks": [], "host_groups": {}}')
-    return jsonify({
-        'ACCOUNTS_JSON': json.loads(accounts_json),
-        'CRON_TASKS_JSON': json.loads(cron_tasks_json)
-    })
+    return jsonify(config_store.export())
 
 @app.route('/api/save_config', methods=['POST'])
 @login_required
 async def save_config():
     data = await request.json
-    os.environ['ACCOUNTS_JSON'] = json.dumps(data['ACCOUNTS_JSON'])
-    os.environ['CRON_TASKS_JSON'] = json.dumps(data['CRON_TASKS_JSON'])
+    cron_tasks = data['CRON_TASKS_JSON']
+    inventory.replace(data['ACCOUNTS_JSON'])
+    config_store.replace_groups(cron_tasks.get('host_groups', {}))
+    config_store.replace_tasks(cron_tasks.get('tasks', []))
     return jsonify({"status": "success", "message": "Configuration saved successfully"})
 
 @app.route('/api/download_config', methods=['GET'])
 @login_required
 async def download_config():
-    config = {
-        'ACCOUNTS_JSON': json.loads(os.getenv('ACCOUNTS_JSON', '[]')),
-        'CRON_TASKS_JSON': json.loads(os.getenv('CRON_TASKS_JSON', '{"tasks": [], "host_groups": {}}'))
-    }
-    return jsonify(config)
+    return jsonify(config_store.export())
 
 @app.route('/hosts')
 @login_required
 async def hosts_page():
-    accounts = json.loads(os.environ.get('ACCOUNTS_JSON', '[]'))
-    return await render_template('hosts.html', hosts=accounts)
+    return await render_template('hosts.html', hosts=inventory.accounts())
 
 @app.route('/api/get_hosts')
 @login_required
 async def get_hosts():
-    accounts = json.loads(os.environ.get('ACCOUNTS_JSON', '[]'))
     formatted_accounts = []
-    for account in accounts:
+    for account in inventory.accounts():
         formatted_account = {
             'customhostname': account.get('customhostname', ''),
             'username': account.get('ssluser') or account.get('username', ''),
@@ -1341,7 +1487,8 @@ async def get_hosts():
             'port': account.get('port', 22),  # 默认端口为 22
             'password': account.get('password', ''),
             'secretkey': account.get('secretkey', ''),
-            'publickey': account.get('publickey', '')
+            'publickey': account.get('publickey', ''),
+            'tags': account_tags(account)
         }
         formatted_accounts.append(formatted_account)
     return jsonify(formatted_accounts)
@@ -1350,9 +1497,7 @@ async def get_hosts():
 @login_required
 async def add_host():
     new_host = await request.json
-    accounts = json.loads(os.environ.get('ACCOUNTS_JSON', '[]'))
-    accounts.append(new_host)
-    os.environ['ACCOUNTS_JSON'] = json.dumps(accounts)
+    inventory.add(new_host)
     return jsonify({"status": "success", "message": "Host added successfully"})
 
 @app.route('/api/edit_host', methods=['POST'])
@@ -1360,94 +1505,103 @@ async def add_host():
 async def edit_host():
     updated_host = await request.json
     original_customhostname = updated_host.pop('originalCustomhostname', None)
-    accounts = json.loads(os.environ.get('ACCOUNTS_JSON', '[]'))
-    for i, host in enumerate(accounts):
-        if host['customhostname'] == original_customhostname:
-            accounts[i] = updated_host
-            break
-    os.environ['ACCOUNTS_JSON'] = json.dumps(accounts)
+    inventory.update(original_customhostname, updated_host)
     return jsonify({"status": "success", "message": "Host updated successfully"})
 
 @app.route('/api/delete_host', methods=['POST'])
 @login_required
 async def delete_host():
     host_to_delete = await request.json
-    accounts = json.loads(os.environ.get('ACCOUNTS_JSON', '[]'))
-    accounts = [host for host in accounts if host['customhostname'] != host_to_delete['customhostname']]
-    os.environ['ACCOUNTS_JSON'] = json.dumps(accounts)
+    inventory.delete(host_to_delete['customhostname'])
     return jsonify({"status": "success", "message": "Host deleted successfully"})
 
 @app.websocket('/ws/output')
 async def output_websocket():
-    ws = websocket._get_current_object()
-    active_websockets.add(ws)
-    try:
+    # 重连时带上 ?since=<最后收到的 seq>&epoch=<epoch>，只补发缺失的消息
+    subscriber = broadcaster.subscribe(
+        since=websocket.args.get('since', type=int),
+        epoch=websocket.args.get('epoch')
+    )
+
+    async def receive():
         while True:
             # 保持连接打开，但不期望接收任何消息
-            await ws.receive()
+            await websocket.receive()
+
+    try:
+        # 客户端断开或因接收过慢被广播器关闭时结束
+        await run_until_first_done(receive(), subscriber.run(websocket.send), subscriber.wait_closed())
     except asyncio.CancelledError:
         # 正常的断开连接情况
         pass
+    except Exception as e:
+        logger.debug(f"/ws/output 连接结束: {e}")
     finally:
-        active_websockets.remove(ws)
+        broadcaster.unsubscribe(subscriber)
 
 async def broadcast_output(message):
-    for ws in list(active_websockets):  # 创建副本以避免在迭代时修改集合
-        try:
-            await ws.send_json({
-                'type': 'output',
-                'message': message
-            })
-        except Exception:
-            # 如果发送失败，移除这个WebSocket连接
-            active_websockets.remove(ws)
+    # 只放入各客户端的发送队列，不等待发送完成
+    broadcaster.publish({
+        'type': 'output',
+        'message': message
+    })
+
+async def broadcast_chunk(host, stream, data):
+    # 批量执行时各主机的实时输出片段，按主机标记后推送到控制面板
+    broadcaster.publish({
+        'type': 'chunk',
+        'host': host,
+        'stream': stream,
+        'data': data
+    })
 
 @app.websocket('/ws/ssh/<string:host>')
 async def ssh_websocket(host):
+    metrics.WEBSOCKET_CLIENTS.labels('ssh').inc()
     try:
         # 获取主机信息
-        host_info = next((h for h in get_accounts() if h['customhostname'] == host), None)
+        host_info = inventory.get_by_name(host)
         if not host_info:
             await websocket.send(json.dumps({"error": "Host not found"}))
             return
 
-        # 创建 SSH 客户端
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        try:
-            # 连接到 SSH 服务器
-            ssh.connect(
+        # 从连接池借用 SSH 连接；默认使用 asyncssh，连接和握手都在事件循环上异步完成，
+        # 大量终端同时连接慢主机时也不会占满线程池或阻塞其他请求
+        conn = await asyncio.wait_for(
+            ssh_pool.pool.acquire(
                 host_info.get('sslhost') or host_info.get('hostname'),
-                username=host_info.get('ssluser') or host_info.get('username'),
-                password=host_info.get('password'),
-                key_filename=host_info.get('secretkey'),
-                port=int(host_info.get('port', 22)),
-                timeout=10
-            )
+                int(host_info.get('port', 22)),
+                host_info.get('ssluser') or host_info.get('username'),
+                host_info.get('password'),
+                host_info.get('secretkey'),
+                backend=terminal_backend()
+            ),
+            timeout=10
+        )
+        terminal = None
 
-            # 创建 SSH shell
-            channel = ssh.invoke_shell()
+        try:
+            # 创建 SSH shell（占用共享连接上的一个通道名额），初始尺寸取自 ?cols=&rows=
+            cols, rows = terminal_size(websocket.args.get('cols'), websocket.args.get('rows')) or (80, 24)
+            terminal = await open_terminal(conn, cols=cols, rows=rows)
 
             async def reader():
                 while True:
-                    if channel.recv_ready():
-                        data = channel.recv(1024).decode('utf-8', errors='ignore')
-                        await websocket.send(json.dumps({"data": data}))
-                    await asyncio.sleep(0.1)
+                    await handle_terminal_message(terminal, await websocket.receive())
 
-            async def writer():
-                while True:
-                    data = await websocket.receive()
-                    channel.send(data + "\n")
-
-            await asyncio.gather(reader(), writer())
+            # 终端协议：服务端以二进制帧发送合并后的 UTF-8 输出；客户端以二进制帧发送原始按键，
+            # 以 JSON 文本帧发送控制消息（resize）。WebSocket 发送完成后才继续读取 SSH 输出（背压）
+            await run_until_first_done(pump_terminal_frames(terminal, websocket.send), reader())
 
         finally:
-            ssh.close()
+            if terminal:
+                terminal.close()
+            ssh_pool.pool.release(conn)
 
     except Exception as e:
         await websocket.send(json.dumps({"error": str(e)}))
+    finally:
+        metrics.WEBSOCKET_CLIENTS.labels('ssh').dec()
 
 if __name__ == '__main__':
     asyncio.run(run_bot_and_server())
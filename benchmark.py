@@ -0,0 +1,532 @@
+"""
+本地性能测试：在本机启动一组模拟 SSH 主机（asyncssh 服务端），用它们驱动
+group_run.run_main、ssh.handle_ssh_output 和 /ws/ssh 网页终端桥接，输出吞吐量、
+p50/p99 延迟和内存峰值，并把结果追加到 JSON Lines 文件中，便于不同提交之间对比。
+
+完全离线运行，不需要 Telegram 或真实主机，例如：
+
+    python benchmark.py --hosts 50 --latency 0.05 --output-size 20000 --failure-rate 0.1
+    python benchmark.py --scenarios group_run --rounds 5 --compare
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import asyncssh
+
+RESULTS_FILE = 'benchmark_results.jsonl'
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench'
+PROMPT = '$ '
+
+# 模拟主机
+
+class _FleetServer(asyncssh.SSHServer):
+    def __init__(self, options):
+        self.options = options
+
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    async def validate_password(self, username, password):
+        if self.options['connect_latency']:
+            await asyncio.sleep(self.options['connect_latency'])
+        return password == BENCH_PASSWORD
+
+def _payload(size, newline='\n'):
+    # 以换行结尾，保证 group_run 追加的退出码单独占一行
+    line = 'x' * 79 + newline
+    return (line * (size // len(line) + 1))[:max(0, size - len(newline))] + newline
+
+async def _handle_process(process, options, rng):
+    delay = options['latency'] + rng.uniform(0, options['jitter'])
+    try:
+        if process.command is None:
+            await _handle_shell(process, options, delay)
+            return
+        await asyncio.sleep(delay)
+        failed = rng.random() < options['failure_rate']
+        payload = _payload(options['output_size'])
+        for start in range(0, len(payload), 32768):
+            process.stdout.write(payload[start:start + 32768])
+            await process.stdout.drain()
+        status = 0
+        if failed:
+            process.stderr.write('simulated failure\n')
+            status = 1
+        # group_run 会在命令后追加 "; echo $?" 并从最后一行读取退出码
+        if process.command.rstrip().endswith('echo $?'):
+            process.stdout.write(f'{status}\n')
+            status = 0
+        process.exit(status)
+    except (asyncssh.Error, BrokenPipeError, ConnectionError):
+        process.close()
+
+async def _handle_shell(process, options, delay):
+    payload = _payload(options['output_size'], '\r\n')
+    process.stdout.write('Welcome to the benchmark fleet\r\n' + PROMPT)
+    async for line in process.stdin:
+        if line.strip() == 'exit':
+            break
+        await asyncio.sleep(delay)
+        process.stdout.write(payload + PROMPT)
+    process.exit(0)
+
+async def _serve_fleet(count, options, ports):
+    key = asyncssh.generate_private_key('ssh-ed25519')
+    rng = random.Random(options['seed'])
+    servers = []
+    for _ in range(count):
+        server = await asyncssh.create_server(
+            lambda: _FleetServer(options), '127.0.0.1', 0,
+            server_host_keys=[key],
+            process_factory=lambda process: _handle_process(process, options, rng),
+            line_editor=False
+        )
+        servers.append(server)
+        ports.put(server.sockets[0].getsockname()[1])
+    await asyncio.Event().wait()
+
+def _fleet_worker(count, options, ports):
+    logging.getLogger('asyncssh').setLevel(logging.WARNING)
+    asyncio.run(_serve_fleet(count, options, ports))
+
+class Fleet:
+    """在独立进程中运行模拟主机，避免服务端的 CPU 开销计入被测进程。"""
+
+    def __init__(self, hosts, workers=1, **options):
+        self.hosts = hosts
+        self.workers = max(1, min(workers, hosts))
+        self.options = options
+        self.processes = []
+        self.ports = []
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        for index in range(self.workers):
+            count = self.hosts // self.workers + (1 if index < self.hosts % self.workers else 0)
+            options = dict(self.options, seed=self.options['seed'] + index)
+            process = context.Process(target=_fleet_worker, args=(count, options, queue), daemon=True)
+            process.start()
+            self.processes.append(process)
+        self.ports = sorted(queue.get(timeout=60) for _ in range(self.hosts))
+        return self
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    def accounts(self):
+        return [
+            {'customhostname': f'bench{index}', 'ssluser': BENCH_USER, 'sslhost': '127.0.0.1',
+             'port': port, 'password': BENCH_PASSWORD, 'tags': ['bench']}
+            for index, port in enumerate(self.ports)
+        ]
+
+# 统计
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位为 KB，表示进程启动以来的最高值
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def summarize(latencies, operations, elapsed, **extra):
+    result = {
+        'operations': operations,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(operations / elapsed, 2) if elapsed else None,
+        'p50': _ms(percentile(latencies, 50)),
+        'p99': _ms(percentile(latencies, 99)),
+        'max': _ms(max(latencies) if latencies else None),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    result.update(extra)
+    return result
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+# 测试场景
+
+class _FakeMessage:
+    def __init__(self):
+        self.replies = 0
+        self.reply_bytes = 0
+
+    async def reply_text(self, text, **kwargs):
+        self.replies += 1
+        self.reply_bytes += len(text)
+
+class _FakeUpdate:
+    def __init__(self):
+        self.message = _FakeMessage()
+
+async def bench_group_run(args, fleet):
+    """批量执行：每轮对全部主机执行一次命令，延迟为单台主机的连接加执行耗时。"""
+    import group_run
+    import ssh_pool
+    from run_history import history
+
+    latencies = []
+    failures = 0
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        if not args.warm:
+            ssh_pool.pool.close_all()
+        success, total, failed_hosts = await group_run.run_main(send_messages=False, command='bench', target='all')
+        failures += len(failed_hosts)
+        run = history.list_runs(limit=1)[0]
+        for host in history.list_hosts(run['id']):
+            if host['connect_time'] is not None and host['exec_time'] is not None:
+                latencies.append(host['connect_time'] + host['exec_time'])
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, args.hosts * args.rounds, elapsed, failures=failures, unit='hosts')
+
+async def bench_handle_ssh_output(args, fleet):
+    """Telegram 交互式 SSH：在多个 shell 会话中循环执行命令，直到 handle_ssh_output 识别到提示符。"""
+    import ssh
+    import ssh_pool
+
+    accounts = fleet.accounts()[:args.sessions]
+    latencies = []
+    update = _FakeUpdate()
+
+    async def session(account):
+        pooled = await ssh_pool.pool.acquire(account['sslhost'], account['port'], account['ssluser'],
+                                             account['password'], backend='asyncssh')
+        try:
+            stdin, stdout, stderr = await pooled.conn.open_session(term_type='xterm')
+            await ssh.handle_ssh_output(stdout, update)
+            for _ in range(args.commands):
+                start = time.perf_counter()
+                stdin.write('bench\n')
+                await ssh.handle_ssh_output(stdout, update)
+                latencies.append(time.perf_counter() - start)
+            stdin.write('exit\n')
+            stdin.channel.close()
+        finally:
+            ssh_pool.pool.release(pooled)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(account) for account in accounts))
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, len(latencies), elapsed, unit='commands',
+                     messages=update.message.replies, message_bytes=update.message.reply_bytes)
+
+async def bench_ws_bridge(args, fleet):
+    """网页终端：多个 /ws/ssh 客户端并发发送命令，测量从发送到收到提示符的往返时间。"""
+    import app
+
+    client = app.app.test_client()
+    accounts = fleet.accounts()[:args.sessions]
+    latencies = []
+    received = 0
+    frames = 0
+
+    async def read_until_prompt(ws):
+        nonlocal received, frames
+        buffer = b''
+        while not buffer.endswith(PROMPT.encode()):
+            buffer += await receive_terminal_frame(ws)
+            frames += 1
+        received += len(buffer)
+
+    async def session(account):
+        async with client.websocket(f"/ws/ssh/{account['customhostname']}") as ws:
+            await read_until_prompt(ws)
+            for _ in range(args.commands):
+                start = time.perf_counter()
+                await ws.send(b'bench\n')
+                await read_until_prompt(ws)
+                latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(account) for account in accounts))
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, len(latencies), elapsed, unit='commands', received_bytes=received, frames=frames)
+
+async def receive_terminal_frame(ws):
+    """读取 /ws/ssh 的一帧输出（二进制），文本帧是服务端发来的错误。"""
+    message = await ws.receive()
+    if isinstance(message, str):
+        raise RuntimeError(json.loads(message).get('error', message))
+    return message
+
+async def bench_terminal_storm(args, fleet):
+    """网页终端连接风暴：同时打开大量 /ws/ssh 终端，期间持续请求 Telegram webhook 路由并测量其响应延迟。"""
+    import app
+    import ssh_pool
+
+    # 从没有可复用连接的状态开始，每个终端都要完成一次完整的握手
+    ssh_pool.pool.close_all()
+    client = app.app.test_client()
+    accounts = fleet.accounts()
+    webhook = f"/{os.getenv('TELEGRAM_BOT_TOKEN')}"
+    open_latencies = []
+    webhook_latencies = []
+    stop = asyncio.Event()
+
+    async def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = await client.post(webhook, json={})
+            if response.status_code != 200:
+                raise RuntimeError(f"webhook returned {response.status_code}")
+            webhook_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    async def terminal(index):
+        account = accounts[index % len(accounts)]
+        start = time.perf_counter()
+        async with client.websocket(f"/ws/ssh/{account['customhostname']}") as ws:
+            buffer = b''
+            while not buffer.endswith(PROMPT.encode()):
+                buffer += await receive_terminal_frame(ws)
+            open_latencies.append(time.perf_counter() - start)
+
+    prober = asyncio.ensure_future(probe())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(terminal(index) for index in range(args.storm_terminals)))
+    finally:
+        stop.set()
+        await prober
+    elapsed = time.perf_counter() - started
+    return summarize(open_latencies, len(open_latencies), elapsed, unit='terminals',
+                     webhook_requests=len(webhook_latencies),
+                     webhook_p50=_ms(percentile(webhook_latencies, 50)),
+                     webhook_p99=_ms(percentile(webhook_latencies, 99)),
+                     webhook_max=_ms(max(webhook_latencies) if webhook_latencies else None))
+
+def _legacy_parse(chunks):
+    # 改用 LineAssembler 之前 handle_ssh_output 的解析方式，作为对比基准
+    output_buffer = ''
+    command_output = []
+    for chunk in chunks:
+        output_buffer += chunk
+        lines = output_buffer.split('\n')
+        output_buffer = lines[-1]
+        for line in lines[:-1]:
+            command_output.append(re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])').sub('', line))
+        last_line = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])').sub('', output_buffer)
+        if re.match(r'.*[$#]\s*$', last_line):
+            return command_output, last_line
+    return command_output, None
+
+def _assembler_parse(chunks):
+    from terminal_output import LineAssembler
+
+    assembler = LineAssembler()
+    command_output = []
+    for chunk in chunks:
+        command_output.extend(assembler.feed(chunk))
+        if assembler.at_prompt():
+            return command_output, assembler.partial_line
+    return command_output, None
+
+def _terminal_workloads(size):
+    colored = '\x1b[32mok\x1b[0m ' + 'y' * 70 + '\r\n'
+    # 进度条：同一行不断用 \r 覆盖，长时间没有换行
+    progress = ''.join(f'\r\x1b[2K[{"=" * (i % 50):<50}] {i % 100:3d}%' for i in range(size // 60 + 1))
+    return {
+        'lines': (colored * (size // len(colored) + 1))[:size] + '\r\nuser@host:~$ ',
+        'progress_bar': progress[:size] + '\r\nuser@host:~$ ',
+    }
+
+async def bench_line_assembler(args, fleet):
+    """交互式输出解析的微基准：按 4 KB 分段输入多 MB 输出，对比逐段重扫与增量解析的吞吐量。"""
+    size = int(args.terminal_mb * 1024 * 1024)
+    workloads = {}
+    total_elapsed = 0.0
+    for name, text in _terminal_workloads(size).items():
+        chunks = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+        timings = {}
+        results = {}
+        for label, parse in (('legacy', _legacy_parse), ('assembler', _assembler_parse)):
+            start = time.perf_counter()
+            results[label] = parse(chunks)
+            timings[label] = time.perf_counter() - start
+        if results['legacy'] != results['assembler']:
+            raise RuntimeError(f"line assembler output differs from the legacy parser on {name}")
+        total_elapsed += timings['assembler']
+        megabytes = len(text) / 1024 / 1024
+        workloads[name] = {
+            'legacy_mb_s': round(megabytes / timings['legacy'], 2),
+            'assembler_mb_s': round(megabytes / timings['assembler'], 2),
+            'speedup': round(timings['legacy'] / timings['assembler'], 1),
+        }
+    megabytes = size * len(workloads) / 1024 / 1024
+    return dict(summarize([], round(megabytes, 2), total_elapsed, unit='MB'), workloads=workloads)
+
+SCENARIOS = {
+    'group_run': bench_group_run,
+    'handle_ssh_output': bench_handle_ssh_output,
+    'ws_bridge': bench_ws_bridge,
+    'terminal_storm': bench_terminal_storm,
+    'line_assembler': bench_line_assembler,
+}
+# 不需要模拟主机的场景
+LOCAL_SCENARIOS = {'line_assembler'}
+
+# 结果保存与对比
+
+def git_revision():
+    try:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=cwd, stderr=subprocess.DEVNULL) != 0
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_previous(path, params):
+    previous = None
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('params') == params:
+                previous = record
+    return previous
+
+def print_report(record, previous=None):
+    print(f"commit {record['commit']}  python {record['python']}  {record['timestamp']}")
+    for name, result in record['scenarios'].items():
+        line = f"{name:<18} {result['throughput']:>9} {result['unit']}/s  "
+        if result['p50'] is not None:
+            line += f"p50 {result['p50']} ms  p99 {result['p99']} ms  "
+        line += f"peak RSS {result['peak_rss_mb']} MB"
+        before = (previous or {}).get('scenarios', {}).get(name)
+        if before and before.get('throughput'):
+            change = (result['throughput'] - before['throughput']) / before['throughput'] * 100
+            line += f"  ({change:+.1f}% vs {previous['commit']})"
+        print(line)
+        if 'webhook_p50' in result:
+            print(f"  {'webhook':<16} {result['webhook_requests']} requests  p50 {result['webhook_p50']} ms  "
+                  f"p99 {result['webhook_p99']} ms  max {result['webhook_max']} ms")
+        for workload, values in result.get('workloads', {}).items():
+            print(f"  {workload:<16} legacy {values['legacy_mb_s']} MB/s  assembler {values['assembler_mb_s']} MB/s  "
+                  f"x{values['speedup']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=20, help='模拟主机数量')
+    parser.add_argument('--fleet-workers', type=int, default=1, help='运行模拟主机的进程数')
+    parser.add_argument('--latency', type=float, default=0.02, help='每条命令的响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='在延迟上额外叠加的随机抖动上限（秒）')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='认证阶段的额外延迟（秒）')
+    parser.add_argument('--output-size', type=int, default=4096, help='每条命令输出的字节数')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='命令失败（退出码 1）的比例')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backend', choices=('asyncssh', 'paramiko'), default=None, help='批量执行使用的 SSH 后端')
+    parser.add_argument('--concurrency', type=int, default=None, help='批量执行的全局并发上限（GROUP_RUN_CONCURRENCY）')
+    parser.add_argument('--rounds', type=int, default=3, help='group_run 的执行轮数')
+    parser.add_argument('--warm', action='store_true', help='group_run 各轮之间保留连接池中的连接')
+    parser.add_argument('--sessions', type=int, default=5, help='交互式场景的并发会话数')
+    parser.add_argument('--commands', type=int, default=10, help='每个交互式会话执行的命令数')
+    parser.add_argument('--storm-terminals', type=int, default=50, help='terminal_storm 场景同时打开的网页终端数')
+    parser.add_argument('--terminal-backend', choices=('asyncssh', 'paramiko'), default=None,
+                        help='网页终端使用的 SSH 后端（WEB_TERMINAL_BACKEND）')
+    parser.add_argument('--terminal-mb', type=float, default=2, help='line_assembler 场景每种输出的大小（MB）')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='要运行的场景，逗号分隔')
+    parser.add_argument('--output', default=RESULTS_FILE, help='结果追加写入的 JSON Lines 文件')
+    parser.add_argument('--compare', action='store_true', help='与结果文件中参数相同的上一次结果对比')
+    parser.add_argument('--verbose', action='store_true', help='显示程序日志')
+    return parser.parse_args(argv)
+
+async def run(args, fleet, scenarios):
+    import ssh_pool
+
+    results = {}
+    try:
+        for name in scenarios:
+            results[name] = await SCENARIOS[name](args, fleet)
+    finally:
+        ssh_pool.pool.close_all()
+    return results
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')}
+
+    fleet = Fleet(args.hosts, args.fleet_workers, latency=args.latency, jitter=args.jitter,
+                  connect_latency=args.connect_latency, output_size=args.output_size,
+                  failure_rate=args.failure_rate, seed=args.seed)
+    if any(name not in LOCAL_SCENARIOS for name in scenarios):
+        fleet.start()
+    workdir = tempfile.mkdtemp(prefix='sshtgbot-bench-')
+    try:
+        # 程序模块在导入时读取环境变量，必须在设置之后再导入
+        os.environ['CONFIG_DB_PATH'] = os.path.join(workdir, 'bench.db')
+        os.environ['OUTPUT_SPILL_DIR'] = workdir
+        os.environ.pop('RUN_HISTORY_DB_PATH', None)
+        if args.backend:
+            os.environ['SSH_BACKEND'] = args.backend
+        if args.terminal_backend:
+            os.environ['WEB_TERMINAL_BACKEND'] = args.terminal_backend
+        if args.concurrency:
+            os.environ['GROUP_RUN_CONCURRENCY'] = str(args.concurrency)
+        from config_store import store
+        import output_capture
+
+        store.replace_hosts(fleet.accounts())
+        if not args.verbose:
+            # 模拟的命令失败会产生大量错误日志，默认不显示
+            logging.disable(logging.CRITICAL)
+        try:
+            results = asyncio.run(run(args, fleet, scenarios))
+        finally:
+            output_capture.cleanup()
+            store.close()
+    finally:
+        fleet.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    record = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_revision(),
+        'python': platform.python_version(),
+        'params': params,
+        'scenarios': results,
+    }
+    previous = load_previous(args.output, params) if args.compare else None
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print_report(record, previous)
+    return record
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 每个 /ws/output 客户端最多排队的消息数
+WS_OUTPUT_QUEUE_SIZE = int(os.getenv('WS_OUTPUT_QUEUE_SIZE', '1000'))
+# 队列已满时的处理方式：drop（丢弃该客户端最早的排队消息）或 disconnect（断开该客户端）
+WS_OUTPUT_SLOW_POLICY = os.getenv('WS_OUTPUT_SLOW_POLICY', 'drop').lower()
+# 保留最近多少条输出事件，供后连接或重连的客户端补发
+WS_OUTPUT_REPLAY_SIZE = int(os.getenv('WS_OUTPUT_REPLAY_SIZE', '1000'))
+# 补发缓冲区占用的最大字节数（按序列化后的消息长度计），超出时丢弃最早的消息
+WS_OUTPUT_REPLAY_BYTES = int(os.getenv('WS_OUTPUT_REPLAY_BYTES', str(4 * 1024 * 1024)))
+
+class Subscriber:
+    """
+    一个 /ws/output 客户端：有界的发送队列，由 run() 在该客户端自己的连接任务中逐条发送。
+    """
+
+    def __init__(self, max_queue, backlog=()):
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._closed = asyncio.Event()
+        self._backlog = list(backlog)  # 连接时需要补发的消息，先于队列中的消息发送
+        self.dropped = 0  # 尚未通知客户端的丢弃条数
+
+    def offer(self, item, policy):
+        """放入一条消息，不等待；队列已满时按 policy 处理，返回 False 表示客户端应被断开。"""
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if policy == 'disconnect':
+            metrics.WS_OUTPUT_DROPPED.labels('disconnect').inc(self._queue.qsize() + 1)
+            self.close()
+            return False
+        self._queue.get_nowait()
+        self._queue.put_nowait(item)
+        self.dropped += 1
+        metrics.WS_OUTPUT_DROPPED.labels('drop').inc()
+        return True
+
+    def close(self):
+        self._closed.set()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    async def run(self, send):
+        """
+        把排队的消息依次 await send(text)，不会自行结束；调用方应与 wait_closed()
+        一起运行，被断开时即使 send 正卡在慢客户端上也能立即取消。
+        """
+        backlog, self._backlog = self._backlog, []
+        for text in backlog:
+            await send(text)
+        while True:
+            published, text = await self._queue.get()
+            if self.dropped:
+                # 告知客户端中间有消息因发送过慢被丢弃
+                notice, self.dropped = self.dropped, 0
+                await send(json.dumps({'type': 'dropped', 'count': notice}))
+            await send(text)
+            metrics.WS_OUTPUT_DELIVERY_SECONDS.observe(time.monotonic() - published)
+
+class Broadcaster:
+    """
+    /ws/output 的发布/订阅广播。
+
+    publish() 只把消息序列化一次并放入每个客户端自己的有界队列，不等待任何发送；
+    每个客户端在自己的连接任务中发送，慢客户端只会积压自己的队列，不会拖慢
+    广播方（批量执行）或其他客户端。队列满时按 WS_OUTPUT_SLOW_POLICY 丢弃
+    最早的消息或断开该客户端。
+
+    每条消息带有递增的 seq，最近 replay_size 条（总长度不超过 replay_bytes）保存在缓冲区中。客户端连接时
+    先收到 {"type": "hello", "epoch", "seq"}，随后补发缓冲区中 seq 大于 since
+    的消息（新客户端补发全部）；epoch 在进程重启后变化，此时 since 无效，按新客户端处理。
+    """
+
+    def __init__(self, max_queue=WS_OUTPUT_QUEUE_SIZE, policy=WS_OUTPUT_SLOW_POLICY, replay_size=WS_OUTPUT_REPLAY_SIZE,
+                 replay_bytes=WS_OUTPUT_REPLAY_BYTES):
+        if policy not in ('drop', 'disconnect'):
+            logger.warning(f"未知的 WS_OUTPUT_SLOW_POLICY: {policy}，使用 drop")
+            policy = 'drop'
+        self.max_queue = max_queue
+        self.policy = policy
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.replay_size = max(replay_size, 0)
+        self.replay_bytes = max(replay_bytes, 0)
+        self._replay = collections.deque()
+        self._replay_used = 0
+        self._subscribers = set()
+
+    def subscribe(self, since=None, epoch=None):
+        """
+        注册一个客户端，since/epoch 为客户端上次收到的最后一条消息的 seq 和所属 epoch。
+        快照缓冲区与注册之间没有 await，之后发布的消息只会进入队列，不会重复或遗漏。
+        """
+        if since is None or epoch != self.epoch or since > self.seq:
+            since = 0
+        backlog = [json.dumps({'type': 'hello', 'epoch': self.epoch, 'seq': self.seq})]
+        # 缓冲区已不包含客户端缺失的最早几条消息时，先告知客户端缺失的条数
+        first = self._replay[0][0] if self._replay else self.seq + 1
+        if since and first - since > 1:
+            backlog.append(json.dumps({'type': 'dropped', 'count': first - since - 1}))
+        backlog += [text for seq, text in self._replay if seq > since]
+        subscriber = Subscriber(self.max_queue, backlog)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        self._subscribers.discard(subscriber)
+
+    def publish(self, message):
+        self.seq += 1
+        text = json.dumps(dict(message, seq=self.seq))
+        self._remember(text)
+        if not self._subscribers:
+            return
+        item = (time.monotonic(), text)
+        for subscriber in list(self._subscribers):
+            if not subscriber.offer(item, self.policy):
+                logger.warning("/ws/output 客户端接收过慢，已断开连接")
+                self._subscribers.discard(subscriber)
+
+    def _remember(self, text):
+        # 按条数和总字节数限制缓冲区，单条超过字节上限的消息不保留
+        self._replay.append((self.seq, text))
+        self._replay_used += len(text)
+        while self._replay and (len(self._replay) > self.replay_size or self._replay_used > self.replay_bytes):
+            _, dropped = self._replay.popleft()
+            self._replay_used -= len(dropped)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def queued(self):
+        return sum(subscriber.qsize() for subscriber in self._subscribers)
+
+broadcaster = Broadcaster()
+metrics.WS_OUTPUT_QUEUE_DEPTH.set_function(broadcaster.queued)
@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 配置数据库文件路径（主机、主机组、定时任务）
+CONFIG_DB_PATH = os.getenv('CONFIG_DB_PATH', 'sshtgbot.db')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    position INTEGER NOT NULL,
+    customhostname TEXT NOT NULL DEFAULT '',
+    ssluser TEXT,
+    sslhost TEXT,
+    port INTEGER NOT NULL DEFAULT 22,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_hosts_position ON hosts(position);
+CREATE INDEX IF NOT EXISTS idx_hosts_customhostname ON hosts(customhostname);
+CREATE INDEX IF NOT EXISTS idx_hosts_identity ON hosts(ssluser, sslhost, port);
+CREATE TABLE IF NOT EXISTS host_groups (
+    name TEXT PRIMARY KEY,
+    members TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    command TEXT NOT NULL,
+    interval INTEGER NOT NULL,
+    variation INTEGER NOT NULL,
+    target TEXT NOT NULL DEFAULT 'all',
+    data TEXT NOT NULL
+);
+"""
+
+def _normalize_task(task):
+    task = dict(task)
+    task['interval'] = int(task['interval'])
+    task['variation'] = int(task['variation'])
+    task.setdefault('target', 'all')
+    return task
+
+class ConfigStore:
+    """
+    基于 SQLite（WAL 模式）的配置存储，保存主机、主机组和定时任务。
+
+    每次修改只更新对应的行，重启后数据仍然保留。ACCOUNTS_JSON、CRON_TASKS_JSON
+    和 ADDED_TASKS_JSON 只在数据库首次创建时用于导入初始数据。
+    hosts_version / groups_version 在每次修改后递增，供主机清单和目标解析判断缓存是否失效。
+    """
+
+    def __init__(self, path=CONFIG_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+        self.hosts_version = 0
+        self.groups_version = 0
+
+    def _db(self):
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    directory = os.path.dirname(os.path.abspath(self.path))
+                    os.makedirs(directory, exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                    conn.row_factory = sqlite3.Row
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.executescript(_SCHEMA)
+                    self._conn = conn
+                    self._seed_from_env()
+        return self._conn
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _seed_from_env(self):
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone():
+            return
+
+        accounts, cron_tasks, added_tasks = [], {}, {}
+        for name, default in (('ACCOUNTS_JSON', '[]'), ('CRON_TASKS_JSON', '{}'), ('ADDED_TASKS_JSON', '{}')):
+            try:
+                value = json.loads(os.getenv(name) or default)
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse {name}")
+                value = json.loads(default)
+            if name == 'ACCOUNTS_JSON':
+                accounts = value
+            elif name == 'CRON_TASKS_JSON':
+                cron_tasks = value
+            else:
+                added_tasks = value
+
+        with self._transaction() as cur:
+            self._insert_hosts(cur, accounts)
+            for name, members in (cron_tasks.get('host_groups') or {}).items():
+                cur.execute("INSERT OR REPLACE INTO host_groups (name, members) VALUES (?, ?)", (name, json.dumps(members)))
+            for task in (cron_tasks.get('tasks') or []) + (added_tasks.get('tasks') or []):
+                self._upsert_task(cur, _normalize_task(task))
+            cur.execute("INSERT INTO meta (key, value) VALUES ('seeded', '1')")
+        logger.info(f"已从环境变量导入初始配置：{len(accounts)} 台主机，{len(cron_tasks.get('host_groups') or {})} 个主机组")
+
+    # 主机
+
+    def _insert_hosts(self, cur, hosts, start=0):
+        cur.executemany(
+            "INSERT INTO hosts (position, customhostname, ssluser, sslhost, port, data) VALUES (?, ?, ?, ?, ?, ?)",
+            [(start + i,) + self._host_row(host) + (json.dumps(host),) for i, host in enumerate(hosts)]
+        )
+
+    @staticmethod
+    def _host_row(host):
+        return (
+            host.get('customhostname', '') or '',
+            host.get('ssluser') or host.get('username'),
+            host.get('sslhost') or host.get('hostname'),
+            int(host.get('port', 22) or 22),
+        )
+
+    def list_hosts(self):
+        rows = self._db().execute("SELECT data FROM hosts ORDER BY position, id").fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def add_host(self, host):
+        with self._transaction() as cur:
+            position = cur.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM hosts").fetchone()[0]
+            self._insert_hosts(cur, [host], start=position)
+        self.hosts_version += 1
+
+    def update_host(self, customhostname, host):
+        """按 customhostname 更新第一台匹配的主机，返回是否找到。"""
+        name, user, address, port = self._host_row(host)
+        with self._transaction() as cur:
+            row = cur.execute("SELECT id FROM hosts WHERE customhostname = ? ORDER BY position, id LIMIT 1", (customhostname,)).fetchone()
+            if row is None:
+                return False
+            cur.execute(
+                "UPDATE hosts SET customhostname = ?, ssluser = ?, sslhost = ?, port = ?, data = ? WHERE id = ?",
+                (name, user, address, port, json.dumps(host), row['id'])
+            )
+        self.hosts_version += 1
+        return True
+
+    def delete_host(self, customhostname):
+        with self._transaction() as cur:
+            deleted = cur.execute("DELETE FROM hosts WHERE customhostname = ?", (customhostname,)).rowcount
+        self.hosts_version += 1
+        return deleted
+
+    def replace_hosts(self, hosts):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM hosts")
+            self._insert_hosts(cur, hosts)
+        self.hosts_version += 1
+
+    # 主机组
+
+    def list_groups(self):
+        rows = self._db().execute("SELECT name, members FROM host_groups ORDER BY name").fetchall()
+        return {row['name']: json.loads(row['members']) for row in rows}
+
+    def set_group(self, name, members):
+        with self._transaction() as cur:
+            cur.execute("INSERT OR REPLACE INTO host_groups (name, members) VALUES (?, ?)", (name, json.dumps(members)))
+        self.groups_version += 1
+
+    def delete_group(self, name):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM host_groups WHERE name = ?", (name,))
+        self.groups_version += 1
+
+    def replace_groups(self, groups):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM host_groups")
+            cur.executemany("INSERT INTO host_groups (name, members) VALUES (?, ?)",
+                            [(name, json.dumps(members)) for name, members in groups.items()])
+        self.groups_version += 1
+
+    # 定时任务
+
+    @staticmethod
+    def _upsert_task(cur, task):
+        cur.execute(
+            "INSERT OR REPLACE INTO tasks (id, command, interval, variation, target, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(task['id']), task['command'], task['interval'], task['variation'], task['target'], json.dumps(task))
+        )
+
+    def list_tasks(self):
+        rows = self._db().execute("SELECT data FROM tasks ORDER BY CAST(id AS INTEGER), id").fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def get_task(self, task_id):
+        row = self._db().execute("SELECT data FROM tasks WHERE id = ?", (str(task_id),)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def add_task(self, task):
+        """保存新任务并分配 ID（当前最大数字 ID + 1），返回保存后的任务。"""
+        task = dict(task)
+        with self._transaction() as cur:
+            next_id = cur.execute("SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) + 1 FROM tasks").fetchone()[0]
+            task['id'] = str(next_id)
+            task = _normalize_task(task)
+            self._upsert_task(cur, task)
+        return task
+
+    def update_task(self, task_id, task):
+        task = _normalize_task(dict(task, id=str(task_id)))
+        with self._transaction() as cur:
+            if cur.execute("SELECT 1 FROM tasks WHERE id = ?", (task['id'],)).fetchone() is None:
+                return None
+            self._upsert_task(cur, task)
+        return task
+
+    def delete_task(self, task_id):
+        with self._transaction() as cur:
+            return cur.execute("DELETE FROM tasks WHERE id = ?", (str(task_id),)).rowcount
+
+    def replace_tasks(self, tasks):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM tasks")
+            for task in tasks:
+                self._upsert_task(cur, _normalize_task(task))
+
+    # 运行时设置（/setcron、/setvartime、/switchmode 等修改的值）
+
+    def get_setting(self, key, default=None):
+        row = self._db().execute("SELECT value FROM meta WHERE key = ?", (f"setting:{key}",)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def set_setting(self, key, value):
+        with self._transaction() as cur:
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"setting:{key}", json.dumps(value)))
+
+    def export(self):
+        """导出为 ACCOUNTS_JSON / CRON_TASKS_JSON 的格式，供配置页面和下载使用。"""
+        return {
+            'ACCOUNTS_JSON': self.list_hosts(),
+            'CRON_TASKS_JSON': {'tasks': self.list_tasks(), 'host_groups': self.list_groups()}
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class _Transaction:
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        conn = self.store._db()
+        self.store._lock.acquire()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def __exit__(self, exc_type, exc, tb):
+        conn = self.store._conn
+        try:
+            conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.store._lock.release()
+        return False
+
+store = ConfigStore()
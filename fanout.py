@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 全局并发上限：所有同时进行的批量执行共享这一额度
+GROUP_RUN_CONCURRENCY = int(os.getenv('GROUP_RUN_CONCURRENCY', '20'))
+# 单台主机的总超时时间（秒），从真正开始处理该主机时计时
+HOST_TIMEOUT = float(os.getenv('HOST_TIMEOUT', '180'))
+# 优先级老化时间（秒）：低优先级的任务每等待这么久提升一级，避免一直被高优先级任务抢占
+JOB_PRIORITY_AGING = float(os.getenv('JOB_PRIORITY_AGING', '60'))
+
+# 优先级（数值越小越优先）：手动触发的执行优先于定时任务
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+def effective_priority(priority, waited, aging=None):
+    """等待 waited 秒后的有效优先级。"""
+    aging = JOB_PRIORITY_AGING if aging is None else aging
+    if aging <= 0:
+        return priority
+    return max(PRIORITY_INTERACTIVE, priority - int(waited / aging))
+
+class PrioritySlots:
+    """
+    按优先级分配的并发额度，用法与 asyncio.Semaphore 相同：async with slots.slot(priority)。
+
+    有空闲额度时直接占用；否则排队，额度释放后交给有效优先级最高（老化后）的等待者，
+    同一优先级内按先来后到。因此手动执行的主机会优先拿到下一个空闲的连接额度，
+    等待较久的定时任务也会逐步提升优先级，不会被饿死。
+    """
+
+    def __init__(self, value, aging=None):
+        self._value = value
+        self._aging = aging
+        self._waiters = []  # (priority, 序号, 开始等待的时间, future)
+        self._counter = itertools.count()
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        loop = asyncio.get_running_loop()
+        waiter = (priority, next(self._counter), loop.time(), loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            await waiter[3]
+        except asyncio.CancelledError:
+            if waiter[3].cancelled():
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            else:
+                # 额度已经分配给了这个等待者，但它已被取消，交给下一个等待者
+                self.release()
+            raise
+
+    def release(self):
+        self._value += 1
+        if not self._waiters:
+            return
+        now = asyncio.get_running_loop().time()
+        while self._value > 0 and self._waiters:
+            waiter = min(self._waiters, key=lambda w: (effective_priority(w[0], now - w[2], self._aging), w[1]))
+            self._waiters.remove(waiter)
+            if waiter[3].done():
+                # 已被取消、尚未来得及自行移除的等待者
+                continue
+            self._value -= 1
+            waiter[3].set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=PRIORITY_INTERACTIVE):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def waiting(self):
+        return len(self._waiters)
+
+_global_slots = None
+
+def get_global_slots():
+    global _global_slots
+    if _global_slots is None:
+        _global_slots = PrioritySlots(GROUP_RUN_CONCURRENCY)
+    return _global_slots
+
+async def _run_one(item, worker, timeout, on_timeout, priority):
+    async with get_global_slots().slot(priority):
+        try:
+            if timeout:
+                return await asyncio.wait_for(worker(item), timeout=timeout)
+            return await worker(item)
+        except asyncio.TimeoutError:
+            if on_timeout is None:
+                raise
+            return await on_timeout(item)
+
+async def fan_out(items, worker, concurrency=None, timeout=HOST_TIMEOUT, on_timeout=None, priority=PRIORITY_INTERACTIVE):
+    """
+    并发地对 items 中的每一项执行 worker(item)，按完成顺序产出 (item, result)。
+
+    - concurrency: 本次调用同时在途的任务数，默认等于全局上限；全局上限始终生效
+    - timeout: 单项超时时间（秒），不包含排队等待全局额度的时间
+    - on_timeout: 超时时调用的协程函数 on_timeout(item)，其返回值作为该项结果；
+      未提供时超时异常会直接抛出
+    - priority: 等待全局额度时的优先级（PRIORITY_INTERACTIVE 或 PRIORITY_BACKGROUND）
+    """
+    concurrency = max(1, concurrency or GROUP_RUN_CONCURRENCY)
+    pending_items = iter(items)
+    in_flight = {}
+
+    def schedule_next():
+        for item in pending_items:
+            task = asyncio.ensure_future(_run_one(item, worker, timeout, on_timeout, priority))
+            in_flight[task] = item
+            return True
+        return False
+
+    try:
+        while len(in_flight) < concurrency and schedule_next():
+            pass
+
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = in_flight.pop(task)
+                schedule_next()
+                yield item, task.result()
+    finally:
+        # 调用方提前退出或被取消时，回收仍在执行的任务
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
@@ -1,62 +1,80 @@
-import json
 import asyncio
 from datetime import datetime, timedelta
-import os
-import paramiko
-import aiohttp
+import json
 import logging
-import re
+import time
 from translations import get_translation
 from language_manager import language_manager
+from fanout import fan_out, HOST_TIMEOUT, PRIORITY_INTERACTIVE
+import ssh_pool
+from ssh_backends import TIMING_PHASES
+from output_capture import OutputCapture
+from terminal_output import clean_ansi
+from inventory import inventory
+from targets import resolve_targets, TargetError
+from config_store import store
+from telegram_client import outbox
+from run_history import history, host_record
+import metrics
+from progress import ProgressReporter, OutputDigest, use_progress_report, use_output_digest
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# 每台主机一条 JSON 格式的阶段耗时日志，可单独过滤或转发
+timing_logger = logging.getLogger('group_run.timing')
 
 # 默认命令
 DEFAULT_COMMAND = "source ~/.profile && pm2 resurrect"
 
 send_update = None
+send_output = None
 
 def set_update_callback(callback):
     global send_update
     send_update = callback
 
+def set_output_callback(callback):
+    # callback(host, stream, text)：命令输出的每个片段到达时调用
+    global send_output
+    send_output = callback
+
 def format_to_iso(date):
     return date.strftime('%Y-%m-%d %H:%M:%S')
 
-def clean_ansi(text):
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+def _output_ids(outputs):
+    # 完整输出可通过 /api/output/<id> 下载
+    return {stream: capture.id for stream, capture in outputs.items() if capture.size}
 
-async def execute_ssh_command(sslhost, ssluser, password, command, customhostname='', secret_key_path=None, port=22, send_messages=True):
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+async def execute_ssh_command(sslhost, ssluser, password, command, customhostname='', secret_key_path=None, port=22, send_messages=True, on_output=None, outputs=None, stats=None):
+    """
+    outputs: 可选的 dict，执行时会填入 'stdout'/'stderr' 两个 OutputCapture，
+    调用方可借此获取完整输出的下载 ID。
+    stats: 可选的 dict，执行过程中会填入连接耗时、执行耗时、退出码和输出大小，
+    以及 stats['spans']（各阶段耗时，见 ssh_backends.TIMING_PHASES）。
+    即使中途超时被取消，已完成阶段的数据也会保留。
+    """
+    client = None
+    execution = None
+    host_label = f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}"
+    if outputs is None:
+        outputs = {}
+    outputs['stdout'] = OutputCapture(host_label, 'stdout')
+    outputs['stderr'] = OutputCapture(host_label, 'stderr')
+    if stats is None:
+        stats = {}
+    spans = stats['spans'] = dict.fromkeys(TIMING_PHASES)
+    # 连接异常或命令超时时不再归还连接池，直接关闭
+    discard = False
     try:
         language = language_manager.get_language()
         logger.info(get_translation('processing_account', language).format(account=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}:{port}"))
         connection_start = asyncio.get_event_loop().time()
         
         try:
-            if secret_key_path:
-                private_key = paramiko.RSAKey.from_private_key_file(secret_key_path)
-                await asyncio.wait_for(
-                    asyncio.get_event_loop().run_in_executor(
-                        None, 
-                        lambda: client.connect(sslhost, port=port, username=ssluser, pkey=private_key)
-                    ),
-                    timeout=10
-                )
-            else:
-                await asyncio.wait_for(
-                    asyncio.get_event_loop().run_in_executor(
-                        None, 
-                        lambda: client.connect(sslhost, port=port, username=ssluser, password=password)
-                    ),
-                    timeout=10
-                )
+            client = await asyncio.wait_for(
+                ssh_pool.pool.acquire(sslhost, port, ssluser, password, secret_key_path, timings=spans),
+                timeout=10
+            )
         except asyncio.TimeoutError:
             connecting_message = get_translation('connecting_to_host', language).format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
             if send_messages:
@@ -64,22 +82,10 @@ async def execute_ssh_command(sslhost, ssluser, password, command, customhostnam
             if send_update:
                 await send_update(connecting_message)
             try:
-                if secret_key_path:
-                    await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(
-                            None, 
-                            lambda: client.connect(sslhost, username=ssluser, pkey=private_key)
-                        ),
-                        timeout=20
-                    )
-                else:
-                    await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(
-                            None, 
-                            lambda: client.connect(sslhost, username=ssluser, password=password)
-                        ),
-                        timeout=20
-                    )
+                client = await asyncio.wait_for(
+                    ssh_pool.pool.acquire(sslhost, port, ssluser, password, secret_key_path, timings=spans),
+                    timeout=20
+                )
             except asyncio.TimeoutError:
                 connection_failed_message = get_translation('connection_failed', language).format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
                 if send_messages:
@@ -88,20 +94,30 @@ async def execute_ssh_command(sslhost, ssluser, password, command, customhostnam
                     await send_update(connection_failed_message)
                 return None, None, "Connection Timeout", None, {'host': f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}", 'reason': "Connection Timeout"}
 
+        stats['connect_time'] = asyncio.get_event_loop().time() - connection_start
         logger.info(f"Executing command: {command}")
         command_start = asyncio.get_event_loop().time()
         
         async def execute_and_read():
             full_command = f"{command}; echo $?"
-            stdin, stdout, stderr = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: client.exec_command(full_command)
-            )
-            output = await asyncio.get_event_loop().run_in_executor(None, stdout.read)
-            error = await asyncio.get_event_loop().run_in_executor(None, stderr.read)
-            return output.decode().strip(), error.decode().strip()
 
+            async def on_chunk(stream, text):
+                await outputs[stream].write(text)
+                if send_output:
+                    await send_output(host_label, stream, text)
+                if on_output:
+                    await on_output(host_label, stream, text)
+
+            await client.stream(full_command, on_chunk, timings=spans)
+            for capture in outputs.values():
+                await capture.close()
+            # 超出内存上限的输出已写入临时文件，这里只取开头和结尾的摘录
+            return outputs['stdout'].excerpt().strip(), outputs['stderr'].excerpt().strip()
+
+        # 命令只执行一次：10 秒后提示仍在执行，但继续等待同一次执行的结果
+        execution = asyncio.ensure_future(execute_and_read())
         try:
-            output, error = await asyncio.wait_for(execute_and_read(), timeout=10)
+            output, error = await asyncio.wait_for(asyncio.shield(execution), timeout=10)
         except asyncio.TimeoutError:
             timeout_message = get_translation('command_execution_timeout', language).format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
             if send_messages:
@@ -109,36 +125,46 @@ async def execute_ssh_command(sslhost, ssluser, password, command, customhostnam
             if send_update:
                 await send_update(timeout_message)
             try:
-                output, error = await asyncio.wait_for(execute_and_read(), timeout=110)
+                output, error = await asyncio.wait_for(execution, timeout=110)
             except asyncio.TimeoutError:
                 execution_failed_message = get_translation('command_execution_failed', language).format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
                 if send_messages:
                     await send_telegram_message(execution_failed_message)
                 if send_update:
                     await send_update(execution_failed_message)
-                return None, None, f"Command Execution Timeout: {command}", command, {'host': f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}", 'reason': f"Command Execution Timeout: {command}"}
+                discard = True
+                stats['exec_time'] = asyncio.get_event_loop().time() - command_start
+                return None, None, f"Command Execution Timeout: {command}", command, {'host': f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}", 'reason': f"Command Execution Timeout: {command}", 'outputs': _output_ids(outputs)}
         
         command_time = asyncio.get_event_loop().time() - command_start
+        stats['exec_time'] = command_time
         if command_time > 10:
             logger.info(f"Command execution took {command_time:.2f} seconds")
         
         # 分割命令输出和退出状态
         output_lines = clean_ansi(output).splitlines()
         command_output = "\n".join(output_lines[:-1])
-        exit_status = output_lines[-1]
+        # 没有任何输出时（例如连接在命令结束前断开）拿不到 echo $? 的结果
+        exit_status = output_lines[-1] if output_lines else 'unknown'
+        stats['exit_status'] = int(exit_status) if exit_status.isdigit() else None
 
         # 创建失败信息变量
         failure_info = None
         if exit_status != '0' or error:
             failure_info = {
                 'host': f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}",
-                'reason': clean_ansi(f"Error: {error}\nExit Status: {exit_status}")
+                'reason': clean_ansi(f"Error: {error}\nExit Status: {exit_status}"),
+                'outputs': _output_ids(outputs)
             }
 
         if exit_status == '0' and not error:
             return client, command_output, None, command, failure_info
         return client, None, clean_ansi(f"Error: {error}\nExit Status: {exit_status}"), command, failure_info
+    except asyncio.CancelledError:
+        discard = True
+        raise
     except Exception as e:
+        discard = True
         # 处理异常情况下的失败信息
         failure_info = {
             'host': f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}",
@@ -146,10 +172,32 @@ async def execute_ssh_command(sslhost, ssluser, password, command, customhostnam
         }
         return None, None, clean_ansi(str(e)), None, failure_info
     finally:
+        if execution and not execution.done():
+            execution.cancel()
+        for capture in outputs.values():
+            await capture.close()
+        stats['output_size'] = sum(capture.size for capture in outputs.values())
+        stats['outputs'] = _output_ids(outputs)
         if client:
-            client.close()
+            ssh_pool.pool.release(client, discard=discard)
+        log_timing(host_label, port, stats)
+
+def log_timing(host, port, stats):
+    def rounded(value):
+        return round(value, 4) if value is not None else None
+    timing_logger.info(json.dumps({
+        'event': 'ssh_timing',
+        'host': host,
+        'port': int(port),
+        'reused_connection': stats.get('connect_time') is not None and stats['spans'].get('kex_auth') is None,
+        'connect_time': rounded(stats.get('connect_time')),
+        'exec_time': rounded(stats.get('exec_time')),
+        'exit_status': stats.get('exit_status'),
+        'output_size': stats.get('output_size'),
+        'spans': {phase: rounded(value) for phase, value in stats['spans'].items()},
+    }, ensure_ascii=False))
 
-async def process_account(account, send_messages, command):
+async def process_account(account, send_messages, command, on_output=None, stats=None):
     ssluser = account.get('ssluser') or account.get('username')
     password = account.get('password')
     sslhost = account.get('sslhost') or account.get('hostname')
@@ -163,18 +211,15 @@ async def process_account(account, send_messages, command):
     language = language_manager.get_language()
     logger.info(get_translation('processing_account', language).format(account=customhostname or ssluser))
     
-    try:
-        client, output, error, executed_command, failure_info = await asyncio.wait_for(
-            execute_ssh_command(sslhost, ssluser, password, command, customhostname, secret_key_path, port, send_messages),
-            timeout=180  # 总超时时间设置为180秒（3分钟）
-        )
-    except asyncio.TimeoutError:
-        timeout_message = get_translation('host_operation_timeout', language).format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
-        if send_messages:
-            await send_telegram_message(timeout_message)
-        if send_update:
-            await send_update(timeout_message)
-        return False, {'host': f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}", 'reason': "Operation Timeout"}
+    if stats is None:
+        stats = {}
+    stats['host'] = f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}"
+
+    # 总超时时间由 fanout 引擎统一控制（HOST_TIMEOUT，默认180秒）
+    client, output, error, executed_command, failure_info = await execute_ssh_command(
+        sslhost, ssluser, password, command, customhostname, secret_key_path, port, send_messages, on_output,
+        stats=stats
+    )
     
     if client:
         login_success_message = get_translation('host_login_success', language).format(
@@ -198,7 +243,7 @@ async def process_account(account, send_messages, command):
                 await send_telegram_message(ssh_success_message)
             if send_update:
                 await send_update(ssh_success_message)
-            return True, None
+            return True, None, stats
         else:
             ssh_error_message = get_translation('host_command_failed', language).format(
                 host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}",
@@ -223,22 +268,100 @@ async def process_account(account, send_messages, command):
         if send_update:
             await send_update(ssh_error_message)
     
-    return False, failure_info
+    return False, failure_info, stats
+
+async def handle_host_timeout(account, send_messages, stats=None):
+    ssluser = account.get('ssluser') or account.get('username')
+    sslhost = account.get('sslhost') or account.get('hostname')
+    customhostname = account.get('customhostname', '').lower()
+    language = language_manager.get_language()
+    timeout_message = get_translation('host_operation_timeout', language).format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
+    if send_messages:
+        await send_telegram_message(timeout_message)
+    if send_update:
+        await send_update(timeout_message)
+    stats = dict(stats or {}, host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}")
+    return False, {'host': stats['host'], 'reason': "Operation Timeout"}, stats
+
+async def iter_results(target_accounts, send_messages=True, command=DEFAULT_COMMAND, concurrency=None, on_output=None,
+                       priority=PRIORITY_INTERACTIVE):
+    """按主机完成顺序产出 (account, (success, failure_info, stats))，并发受 fanout 全局上限约束。"""
+    # 超时被取消的主机也保留已完成阶段的耗时数据
+    host_stats = {}
 
-async def main(accounts, send_messages=True, command=DEFAULT_COMMAND, target='all'):
-    target_accounts = get_target_accounts(accounts, target)
-    tasks = [process_account(account, send_messages, command) for account in target_accounts]
-    results = await asyncio.gather(*tasks)
+    def worker(account):
+        stats = host_stats[id(account)] = {}
+        return process_account(account, send_messages, command, on_output, stats)
+
+    async for account, result in fan_out(
+        target_accounts,
+        worker,
+        concurrency=concurrency,
+        timeout=HOST_TIMEOUT,
+        on_timeout=lambda account: handle_host_timeout(account, send_messages, host_stats.get(id(account))),
+        priority=priority
+    ):
+        yield account, result
+
+async def main(accounts, send_messages=True, command=DEFAULT_COMMAND, target='all', concurrency=None, priority=PRIORITY_INTERACTIVE,
+               on_host_done=None, target_accounts=None):
+    # target_accounts 为调用方已解析好的目标主机（例如 run_manager 提交时解析并加锁的列表），此时不再重新解析
+    if target_accounts is None:
+        target_accounts = get_target_accounts(accounts, target)
+
+    # progress 模式下不再逐台主机发送消息，改为维护一条进度消息
+    reporter = None
+    if send_messages and use_progress_report():
+        reporter = ProgressReporter(command, target, len(target_accounts))
+        await reporter.start()
+
+    digest = None
+    if send_messages and use_output_digest():
+        digest = OutputDigest()
+        digest.start()
+
+    started_at = time.time()
+    results = []
+    group = metrics_group(target)
+    try:
+        async for account, result in iter_results(target_accounts, send_messages and reporter is None, command, concurrency,
+                                            on_output=digest.add if digest else None, priority=priority):
+            results.append(result)
+            observe_host_result(result, group)
+            if reporter:
+                reporter.record(result[0])
+            if on_host_done:
+                # 该主机已完成（包括超时），通知调用方可以释放它
+                on_host_done(account)
+    finally:
+        # 执行出错或被取消时同样停止定时刷新，避免后台任务继续编辑或发送消息
+        if reporter:
+            reporter.stop()
+        if digest:
+            await digest.finish()
     success_count = sum(result[0] for result in results)
     total_count = len(target_accounts)
     
     # 收集失败信息
     failed_hosts = [result[1] for result in results if result[1] is not None]
+
+    metrics.GROUP_RUN_SECONDS.labels(group).observe(time.time() - started_at)
+
+    try:
+        run_id = history.record_run(command, target, started_at, time.time(), [host_record(*result) for result in results])
+        logger.info(f"执行记录已保存，ID: {run_id}")
+    except Exception as e:
+        logger.error(f"保存执行记录失败: {e}")
     
     language = language_manager.get_language()
     completion_message = get_translation('all_hosts_complete', language).format(success_count=success_count, total_count=total_count)
     logger.info(completion_message)
-    if send_messages:
+    if reporter:
+        summary = completion_message
+        if failed_hosts:
+            summary += "\n\nFailed hosts:\n" + "\n".join([f"{host['host']}: {clean_ansi(host['reason'])}" for host in failed_hosts])
+        await reporter.finish(summary)
+    elif send_messages:
         await send_telegram_message(completion_message)
         
         # 发送失败主机统计信息
@@ -248,56 +371,49 @@ async def main(accounts, send_messages=True, command=DEFAULT_COMMAND, target='al
     
     return success_count, total_count, failed_hosts
     
+def metrics_group(target):
+    """指标的 group 标签：单个已定义的主机组取组名，all 为 all，其他任意表达式统一为 adhoc，避免标签取值无限增长。"""
+    expression = (target or 'all').strip().lower()
+    if expression == 'all':
+        return 'all'
+    if expression.startswith('group:'):
+        name = expression[6:].strip()
+        for group in store.list_groups():
+            if group.lower() == name:
+                return group
+    return 'adhoc'
+
+def observe_host_result(result, group):
+    success, _, stats = result
+    host = metrics.host_label(stats.get('host', ''))
+    if stats.get('connect_time') is not None:
+        metrics.SSH_CONNECT_SECONDS.labels(host, group).observe(stats['connect_time'])
+    if stats.get('exec_time') is not None:
+        metrics.SSH_EXEC_SECONDS.labels(host, group).observe(stats['exec_time'])
+    metrics.SSH_HOST_RESULTS.labels(group, 'success' if success else 'failure').inc()
+    for phase, value in (stats.get('spans') or {}).items():
+        if value is not None:
+            metrics.SSH_PHASE_SECONDS.labels(phase).observe(value)
+
 async def send_telegram_message(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': TELEGRAM_CHAT_ID,
-        'text': message
-    }
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                if response.status != 200:
-                    logger.error(f"发送消息到Telegram失败: {await response.text()}")
-                else:
-                    logger.info(f"成功发送消息到Telegram: {message[:50]}...")
-    except Exception as e:
-        logger.error(f"发送消息到Telegram时发生错误: {str(e)}")
+    # 放入共享的 Telegram 发送队列，不阻塞批量执行
+    await outbox.send_message(message)
 
 def get_target_accounts(accounts, target):
     if target == 'all':
         return accounts
-    
-    cron_tasks = json.loads(os.getenv('CRON_TASKS_JSON', '{}'))
-    host_groups = cron_tasks.get('host_groups', {})
-    
-    target_accounts = []
-    targets = target.split(',')
-    
-    for t in targets:
-        t = t.strip()
-        if t.startswith('group:'):
-            group_name = t[6:]
-            if group_name in host_groups:
-                group_hosts = host_groups[group_name]
-                target_accounts.extend([account for account in accounts if account.get('customhostname', '').lower() in group_hosts])
-        elif t.startswith('+') or t.startswith('-'):
-            n = int(t[1:])
-            target_accounts.extend(accounts[:n] if t.startswith('+') else accounts[-n:])
-        else:
-            target_accounts.extend([account for account in accounts if account.get('customhostname', '').lower() == t.lower() or
-                                    f"{account.get('ssluser', account.get('username'))}@{account.get('sslhost', account.get('hostname'))}".lower() == t.lower()])
-    
-    return list({account['customhostname']: account for account in target_accounts}.values())  # Remove duplicates
+    # 目标表达式针对传入的主机列表求值；传入的是当前主机清单时结果按清单版本缓存，并按主机去重
+    try:
+        return resolve_targets(target, accounts)
+    except TargetError as e:
+        logger.error(f"Invalid target expression '{target}': {e}")
+        return []
 
-async def run_main(send_messages=True, command=DEFAULT_COMMAND, target='all'):
-    accounts_json = os.getenv('ACCOUNTS_JSON')
-    if accounts_json:
-        accounts = json.loads(accounts_json)
-        return await main(accounts, send_messages, command, target)
+async def run_main(send_messages=True, command=DEFAULT_COMMAND, target='all', concurrency=None, priority=PRIORITY_INTERACTIVE,
+                   on_host_done=None, target_accounts=None):
+    accounts = inventory.accounts()
+    if accounts:
+        return await main(accounts, send_messages, command, target, concurrency, priority, on_host_done, target_accounts)
     else:
         language = language_manager.get_language()
         logger.error(get_translation('no_accounts_json', language))
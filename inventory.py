@@ -0,0 +1,118 @@
+import logging
+import threading
+
+import config_store
+
+logger = logging.getLogger(__name__)
+
+def account_user(account):
+    return account.get('ssluser') or account.get('username')
+
+def account_host(account):
+    return account.get('sslhost') or account.get('hostname')
+
+def account_port(account):
+    return int(account.get('port', 22))
+
+def account_tags(account):
+    tags = account.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return [tag.strip().lower() for tag in tags if tag.strip()]
+
+def account_label(account):
+    customhostname = account.get('customhostname', '').lower()
+    return f"{customhostname + ': ' if customhostname else ''}{account_user(account)}@{account_host(account)}"
+
+class _Snapshot:
+    """某一版本主机列表及其索引，创建后不再修改。"""
+
+    __slots__ = ('version', 'accounts', 'by_name', 'by_identity', 'by_tag', 'positions')
+
+    def __init__(self, version, accounts):
+        self.version = version
+        self.accounts = accounts
+        self.by_name = {}
+        self.by_identity = {}
+        self.by_tag = {}
+        self.positions = {}  # id(account) -> 在列表中的位置
+
+        for position, account in enumerate(accounts):
+            self.positions[id(account)] = position
+            for tag in account_tags(account):
+                self.by_tag.setdefault(tag, []).append(account)
+            name = account.get('customhostname', '').lower()
+            if name:
+                self.by_name.setdefault(name, account)
+            identity = f"{account_user(account)}@{account_host(account)}".lower()
+            # 与原先的线性查找一致：同名时以列表中靠前的主机为准
+            self.by_identity.setdefault(identity, account)
+            self.by_identity.setdefault(f"{identity}:{account.get('port', 22)}", account)
+
+def snapshot_of(accounts):
+    """为任意主机列表建立索引（不属于任何清单版本），用于在指定的主机列表上解析目标。"""
+    return _Snapshot(None, list(accounts))
+
+class HostInventory:
+    """
+    进程内的主机清单。
+
+    主机列表从配置数据库读取，只在数据变化后重新加载一次，并建立按
+    customhostname、user@host 和 user@host:port 的索引。每次修改都会生成新的
+    快照并整体替换引用，读取方拿到的快照始终是完整一致的某一版本。
+    """
+
+    def __init__(self, store=config_store.store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot(0, [])
+        self._source_version = None
+
+    def snapshot(self):
+        if self._source_version == self.store.hosts_version:
+            return self._snapshot
+        with self._lock:
+            source_version = self.store.hosts_version
+            if self._source_version != source_version:
+                self._snapshot = _Snapshot(self._snapshot.version + 1, self.store.list_hosts())
+                self._source_version = source_version
+            return self._snapshot
+
+    @property
+    def version(self):
+        return self.snapshot().version
+
+    def accounts(self):
+        """返回当前的主机列表。列表为共享数据，调用方不要直接修改。"""
+        return self.snapshot().accounts
+
+    def get(self, identifier):
+        """按 customhostname、user@host 或 user@host:port 查找主机，不区分大小写。"""
+        if not identifier:
+            return None
+        snapshot = self.snapshot()
+        key = identifier.strip().lower()
+        return snapshot.by_name.get(key) or snapshot.by_identity.get(key)
+
+    def get_by_name(self, name):
+        return self.snapshot().by_name.get((name or '').lower())
+
+    def add(self, account):
+        self.store.add_host(account)
+
+    def update(self, customhostname, account):
+        return self.store.update_host(customhostname, account)
+
+    def delete(self, customhostname):
+        return self.store.delete_host(customhostname)
+
+    def replace(self, accounts):
+        """整体替换主机列表（配置页面保存时使用）。"""
+        self.store.replace_hosts(accounts)
+        logger.info(f"主机清单已更新，共 {len(accounts)} 台主机")
+
+    def invalidate(self):
+        with self._lock:
+            self._source_version = None
+
+inventory = HostInventory()
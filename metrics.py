@@ -0,0 +1,240 @@
+import bisect
+import math
+import os
+import threading
+
+# 是否按主机记录 SSH 耗时；标签中包含主机名和地址，默认关闭
+METRICS_PER_HOST = os.getenv('METRICS_PER_HOST', 'false').lower() in ('1', 'true', 'yes')
+# 设置后未登录控制面板也可以携带 Authorization: Bearer <token> 或 ?token=<token> 访问 /metrics
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """按 Prometheus 文本格式（0.0.4）输出所有指标。"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    """
+    最小化的 Prometheus 指标实现，不依赖 prometheus_client。
+
+    labels(...) 返回某一组标签值对应的子指标，没有标签的指标可直接调用
+    inc()/set()/observe()。所有操作都是线程安全的，可在 SSH 线程池中调用。
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            labels = list(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield suffix, labels + extra, value
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def samples(self):
+        yield '', [], self._value
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        # 采集时调用 function() 取当前值，适合队列长度、连接数等已有的状态
+        self._function = function
+
+    def samples(self):
+        yield '', [], self._function() if self._function else self._value
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), counts):
+            cumulative += count
+            yield '_bucket', [('le', _format_value(float(bound)))], cumulative
+        yield '_sum', [], total
+        yield '_count', [], cumulative
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+def host_label(host):
+    return host if METRICS_PER_HOST else ''
+
+def render():
+    return REGISTRY.render()
+
+# SSH
+SSH_CONNECT_SECONDS = Histogram(
+    'sshtgbot_ssh_connect_seconds', 'Time to obtain an SSH connection (pooled or new).', ('host', 'group'))
+SSH_EXEC_SECONDS = Histogram(
+    'sshtgbot_ssh_exec_seconds', 'Time from command start until all output was read.', ('host', 'group'))
+SSH_PHASE_SECONDS = Histogram(
+    'sshtgbot_ssh_phase_seconds', 'Per-host SSH phase durations (dns, tcp, kex_auth, channel_open, exec, first_byte, last_byte).',
+    ('phase',))
+SSH_HOST_RESULTS = Counter(
+    'sshtgbot_ssh_host_results_total', 'Per-host results of batch runs.', ('group', 'result'))
+
+# 批量执行与定时任务
+GROUP_RUN_SECONDS = Histogram(
+    'sshtgbot_group_run_duration_seconds', 'Wall time of a whole batch run.', ('group',), buckets=DURATION_BUCKETS)
+SCHEDULER_LAG_SECONDS = Histogram(
+    'sshtgbot_scheduler_lag_seconds', 'Delay between the planned and the actual start of a scheduled job.', ('job',),
+    buckets=LAG_BUCKETS)
+
+# Telegram
+TELEGRAM_SEND_SECONDS = Histogram(
+    'sshtgbot_telegram_send_seconds', 'Latency of Telegram Bot API calls, including retries.', ('method',))
+TELEGRAM_ERRORS = Counter(
+    'sshtgbot_telegram_errors_total', 'Failed Telegram Bot API attempts.', ('method', 'reason'))
+TELEGRAM_QUEUE_DEPTH = Gauge(
+    'sshtgbot_telegram_queue_depth', 'Messages waiting in the Telegram outbox.')
+
+# Web 控制面板与线程池
+WEBSOCKET_CLIENTS = Gauge(
+    'sshtgbot_websocket_clients', 'Connected websocket clients.', ('endpoint',))
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    'sshtgbot_executor_queue_depth', 'Blocking SSH calls waiting for an executor thread.')
+EXECUTOR_ACTIVE = Gauge(
+    'sshtgbot_executor_active_threads', 'Executor threads currently running a blocking SSH call.')
+WS_OUTPUT_QUEUE_DEPTH = Gauge(
+    'sshtgbot_ws_output_queue_depth', 'Messages queued for /ws/output clients, summed over all clients.')
+WS_OUTPUT_DELIVERY_SECONDS = Histogram(
+    'sshtgbot_ws_output_delivery_seconds', 'Time from publishing a /ws/output message until it was sent to a client.')
+WS_OUTPUT_DROPPED = Counter(
+    'sshtgbot_ws_output_dropped_total', 'Messages not delivered to slow /ws/output clients.', ('policy',))
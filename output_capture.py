@@ -0,0 +1,198 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+from ssh_executor import executor
+
+logger = logging.getLogger(__name__)
+
+# 单台主机单个输出流在内存中保留的字符数上限，超出后写入压缩临时文件
+STREAM_BUFFER_LIMIT = int(os.getenv('STREAM_BUFFER_LIMIT', str(256 * 1024)))
+# 通知中使用的开头/结尾摘录长度（字符）
+OUTPUT_EXCERPT_SIZE = int(os.getenv('OUTPUT_EXCERPT_SIZE', '1500'))
+# 最多保留多少份输出供下载，超出后删除最早的
+OUTPUT_MAX_CAPTURES = int(os.getenv('OUTPUT_MAX_CAPTURES', '1000'))
+# 溢出文件所在目录，默认为系统临时目录
+OUTPUT_SPILL_DIR = os.getenv('OUTPUT_SPILL_DIR') or tempfile.gettempdir()
+# 落盘后累积多少字符再交给线程池压缩写入，避免每个小片段都切换一次线程
+SPILL_WRITE_SIZE = 64 * 1024
+
+_spill_dir = None
+_captures = OrderedDict()
+
+def get_spill_dir():
+    global _spill_dir
+    if _spill_dir is None:
+        os.makedirs(OUTPUT_SPILL_DIR, exist_ok=True)
+        _spill_dir = tempfile.mkdtemp(prefix='sshtgbot-output-', dir=OUTPUT_SPILL_DIR)
+    return _spill_dir
+
+class OutputCapture:
+    """
+    单台主机单个输出流（stdout/stderr）的有界捕获。
+
+    不超过 memory_limit 时全部保存在内存中；超出后连同已有内容一起写入 gzip
+    临时文件，内存中只保留开头和结尾的摘录用于通知。close() 之后，超过摘录
+    长度的输出都会落盘，可通过 iter_text() 或 /api/output/<id> 下载完整内容。
+
+    write() 和 close() 在事件循环中调用：打开、压缩和写入文件都在 ssh_executor
+    线程池中进行，落盘后的输出先在内存中累积到 SPILL_WRITE_SIZE 再批量写入。
+    """
+
+    def __init__(self, host='', stream='stdout', memory_limit=STREAM_BUFFER_LIMIT, excerpt_size=OUTPUT_EXCERPT_SIZE):
+        self.id = uuid.uuid4().hex
+        self.host = host
+        self.stream = stream
+        self.memory_limit = memory_limit
+        self.excerpt_size = excerpt_size
+        self.size = 0
+        self.head = ''
+        self.tail = ''
+        self.path = None
+        self._parts = []
+        self._memory_size = 0
+        self._pending = []  # 已决定落盘、尚未写入文件的片段
+        self._pending_size = 0
+        self._file = None
+        self._file_closed = False
+        self._io_lock = threading.Lock()
+        self.closed = False
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    @property
+    def truncated(self):
+        return self.size > len(self.head) + len(self.tail)
+
+    async def write(self, text):
+        if not text:
+            return
+        self.size += len(text)
+        if len(self.head) < self.excerpt_size:
+            self.head += text[:self.excerpt_size - len(self.head)]
+        self.tail = (self.tail + text[-self.excerpt_size:])[-self.excerpt_size:]
+
+        if not self.spilled and self._memory_size + len(text) <= self.memory_limit:
+            self._parts.append(text)
+            self._memory_size += len(text)
+            return
+        if not self.spilled:
+            self._spill()
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._pending_size >= SPILL_WRITE_SIZE:
+            await executor.run(self._write_file, self._take_pending())
+
+    def _spill(self):
+        # 只在事件循环中切换状态，已有的内存内容转为待写入，文件由线程池打开
+        self.path = os.path.join(get_spill_dir(), f"{self.id}.txt.gz")
+        self._pending = self._parts + self._pending
+        self._pending_size += self._memory_size
+        self._parts = []
+        self._memory_size = 0
+
+    def _take_pending(self):
+        data = ''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        return data
+
+    def _write_file(self, data, close=False):
+        # 在线程池中执行；同一捕获的写入与关闭按加锁顺序进行
+        with self._io_lock:
+            if self._file_closed:
+                return
+            if self._file is None:
+                self._file = gzip.open(self.path, 'wt', encoding='utf-8', compresslevel=6)
+            if data:
+                self._file.write(data)
+            if close:
+                self._file.close()
+                self._file = None
+                self._file_closed = True
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # 摘录已能完整表示的小输出留在内存中，其余全部落盘并释放内存
+        if not self.spilled and self.truncated:
+            self._spill()
+        _register(self)
+        if self.spilled:
+            # 即使调用方被取消，也要写完剩余内容并关闭文件
+            await asyncio.shield(executor.run(self._write_file, self._take_pending(), True))
+
+    def getvalue(self):
+        """返回完整输出（仅在未落盘时可用），否则返回摘录。"""
+        if not self.spilled:
+            return ''.join(self._parts)
+        return self.excerpt()
+
+    def excerpt(self):
+        if not self.truncated:
+            # head 与 tail 可能重叠，拼接时只取 tail 中 head 之后的部分
+            return self.head + self.tail[len(self.tail) - (self.size - len(self.head)):]
+        omitted = self.size - len(self.head) - len(self.tail)
+        return f"{self.head}\n... ({omitted} chars omitted) ...\n{self.tail}"
+
+    def iter_text(self, chunk_size=65536):
+        if not self.spilled:
+            yield ''.join(self._parts)
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+
+    def discard(self):
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._file_closed = True
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self._parts = []
+
+    def info(self):
+        return {
+            'id': self.id,
+            'host': self.host,
+            'stream': self.stream,
+            'size': self.size,
+            'spilled': self.spilled,
+        }
+
+def _register(capture):
+    if not capture.size:
+        return
+    _captures[capture.id] = capture
+    while len(_captures) > OUTPUT_MAX_CAPTURES:
+        _, oldest = _captures.popitem(last=False)
+        oldest.discard()
+
+def get_capture(capture_id):
+    return _captures.get(capture_id)
+
+def cleanup():
+    global _spill_dir
+    for capture in _captures.values():
+        capture.discard()
+    _captures.clear()
+    if _spill_dir:
+        shutil.rmtree(_spill_dir, ignore_errors=True)
+        _spill_dir = None
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from translations import get_translation
+from language_manager import language_manager
+from telegram_client import outbox
+from terminal_output import clean_ansi
+
+logger = logging.getLogger(__name__)
+
+# Telegram 通知方式：host 为每台主机单独发送消息，progress 为每次执行只维护一条进度消息
+TELEGRAM_REPORT_MODE = os.getenv('TELEGRAM_REPORT_MODE', 'host').lower()
+# 进度消息的最短刷新间隔（秒）
+PROGRESS_UPDATE_INTERVAL = float(os.getenv('PROGRESS_UPDATE_INTERVAL', '5'))
+# 是否把批量执行的命令输出定时汇总发送到 Telegram
+TELEGRAM_OUTPUT_DIGEST = os.getenv('TELEGRAM_OUTPUT_DIGEST', 'false').lower() == 'true'
+# 输出汇总的发送间隔（秒）和每台主机保留的最新行数
+OUTPUT_DIGEST_INTERVAL = float(os.getenv('OUTPUT_DIGEST_INTERVAL', '10'))
+OUTPUT_DIGEST_LINES = int(os.getenv('OUTPUT_DIGEST_LINES', '5'))
+# 单行输出在汇总中保留的最大长度
+OUTPUT_DIGEST_LINE_LENGTH = 300
+
+def use_progress_report():
+    return TELEGRAM_REPORT_MODE == 'progress'
+
+def use_output_digest():
+    return TELEGRAM_OUTPUT_DIGEST
+
+class ProgressReporter:
+    """
+    一次批量执行只发送一条进度消息，并按固定间隔用 editMessageText 原地更新，
+    结束时再发送一条汇总消息，避免大批量主机时触发 Telegram 的限流。
+    """
+
+    def __init__(self, command, target, total, interval=PROGRESS_UPDATE_INTERVAL, chat_id=None):
+        self.command = command
+        self.target = target
+        self.total = total
+        self.interval = interval
+        self.chat_id = chat_id or outbox.chat_id
+        self.success = 0
+        self.failed = 0
+        self.message_id = None
+        self._dirty = False
+        self._last_text = None
+        self._timer = None
+        self._started_at = None
+
+    @property
+    def done(self):
+        return self.success + self.failed
+
+    def render(self):
+        return get_translation('run_progress', language_manager.get_language()).format(
+            command=self.command,
+            target=self.target,
+            done=self.done,
+            total=self.total,
+            success=self.success,
+            failed=self.failed,
+            pending=self.total - self.done
+        )
+
+    async def start(self):
+        self._started_at = asyncio.get_event_loop().time()
+        self._last_text = self.render()
+        message = await outbox.send_message(self._last_text, chat_id=self.chat_id, wait=True)
+        if message:
+            self.message_id = message.get('message_id')
+            self._timer = asyncio.ensure_future(self._refresh_periodically())
+        else:
+            logger.warning("进度消息发送失败，本次执行将只发送最终汇总")
+
+    def record(self, success):
+        if success:
+            self.success += 1
+        else:
+            self.failed += 1
+        self._dirty = True
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._dirty:
+                await self._refresh()
+
+    async def _refresh(self, suffix=''):
+        self._dirty = False
+        text = self.render() + suffix
+        # 内容未变化时 Telegram 会返回 "message is not modified"，直接跳过
+        if self.message_id is None or text == self._last_text:
+            return
+        self._last_text = text
+        await outbox.enqueue('editMessageText', {
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'text': text
+        })
+
+    def stop(self):
+        """停止定时刷新，可重复调用。"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    async def finish(self, summary):
+        self.stop()
+        elapsed = asyncio.get_event_loop().time() - self._started_at if self._started_at else 0
+        await self._refresh('\n' + get_translation('run_progress_finished', language_manager.get_language()).format(elapsed=f"{elapsed:.1f}"))
+        await outbox.send_message(summary, chat_id=self.chat_id)
+
+class OutputDigest:
+    """
+    批量执行时按主机收集命令输出，每隔 interval 秒把各主机最新的几行合并成
+    一条 Telegram 消息发送。每台主机只保留 max_lines 行，内存占用有上限。
+    """
+
+    def __init__(self, interval=OUTPUT_DIGEST_INTERVAL, max_lines=OUTPUT_DIGEST_LINES, chat_id=None):
+        self.interval = interval
+        self.max_lines = max_lines
+        self.chat_id = chat_id or outbox.chat_id
+        self._lines = {}
+        self._partial = {}
+        self._timer = None
+
+    def start(self):
+        self._timer = asyncio.ensure_future(self._flush_periodically())
+
+    async def add(self, host, stream, text):
+        lines = (self._partial.get(host, '') + clean_ansi(text)).split('\n')
+        self._partial[host] = lines.pop()[-OUTPUT_DIGEST_LINE_LENGTH:]
+        recent = self._lines.setdefault(host, deque(maxlen=self.max_lines))
+        recent.extend(line.rstrip('\r')[:OUTPUT_DIGEST_LINE_LENGTH] for line in lines[-self.max_lines:] if line.strip())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        sections = []
+        for host, recent in self._lines.items():
+            if recent:
+                sections.append(f"[{host}]\n" + "\n".join(recent))
+                recent.clear()
+        if sections:
+            await outbox.send_message("\n\n".join(sections), chat_id=self.chat_id)
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    async def finish(self):
+        self.stop()
+        for host, partial in self._partial.items():
+            if partial.strip():
+                self._lines.setdefault(host, deque(maxlen=self.max_lines)).append(partial)
+        self._partial.clear()
+        await self.flush()
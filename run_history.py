@@ -0,0 +1,169 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from config_store import CONFIG_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 执行历史数据库路径，默认与配置数据库共用同一个文件
+RUN_HISTORY_DB_PATH = os.getenv('RUN_HISTORY_DB_PATH') or CONFIG_DB_PATH
+# 最多保留的执行记录条数，超出后删除最早的记录
+RUN_HISTORY_MAX_RUNS = int(os.getenv('RUN_HISTORY_MAX_RUNS', '1000'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    command TEXT NOT NULL,
+    target TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    success INTEGER NOT NULL,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs(started_at);
+CREATE TABLE IF NOT EXISTS run_hosts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    host TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    connect_time REAL,
+    exec_time REAL,
+    exit_status INTEGER,
+    output_size INTEGER,
+    reason TEXT,
+    stdout_id TEXT,
+    stderr_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_run_hosts_run_id ON run_hosts(run_id);
+CREATE INDEX IF NOT EXISTS idx_run_hosts_host ON run_hosts(host, run_id);
+"""
+
+_HOST_COLUMNS = ('host', 'success', 'connect_time', 'exec_time', 'exit_status', 'output_size', 'reason', 'stdout_id', 'stderr_id')
+
+class RunHistory:
+    """
+    批量执行的历史记录（SQLite）。
+
+    每次执行保存一条 runs 记录，每台主机保存一条 run_hosts 记录，包含连接耗时、
+    执行耗时、退出码、输出大小和失败原因，可按执行 ID 或主机查询。
+    """
+
+    def __init__(self, path=RUN_HISTORY_DB_PATH, max_runs=RUN_HISTORY_MAX_RUNS):
+        self.path = path
+        self.max_runs = max_runs
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _db(self):
+        with self._lock:
+            if self._conn is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA foreign_keys=ON")
+                conn.executescript(_SCHEMA)
+                self._conn = conn
+            return self._conn
+
+    def record_run(self, command, target, started_at, finished_at, hosts):
+        """
+        保存一次执行，hosts 为 dict 列表（键见 _HOST_COLUMNS，缺失的视为 NULL），返回执行 ID。
+        """
+        success = sum(1 for host in hosts if host.get('success'))
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                run_id = conn.execute(
+                    "INSERT INTO runs (started_at, finished_at, command, target, total, success, failed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (started_at, finished_at, command, target, len(hosts), success, len(hosts) - success)
+                ).lastrowid
+                conn.executemany(
+                    f"INSERT INTO run_hosts (run_id, {', '.join(_HOST_COLUMNS)}) VALUES (?, {', '.join('?' * len(_HOST_COLUMNS))})",
+                    [(run_id,) + tuple(host.get(column) for column in _HOST_COLUMNS) for host in hosts]
+                )
+                if self.max_runs > 0:
+                    conn.execute("DELETE FROM runs WHERE id <= ?", (run_id - self.max_runs,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return run_id
+
+    def list_runs(self, limit=20, offset=0, command=None):
+        sql = "SELECT * FROM runs"
+        params = []
+        if command:
+            sql += " WHERE command = ?"
+            params.append(command)
+        sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._lock:
+            return [self._run_dict(row) for row in self._db().execute(sql, params).fetchall()]
+
+    def get_run(self, run_id):
+        with self._lock:
+            row = self._db().execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return self._run_dict(row) if row else None
+
+    def list_hosts(self, run_id, order='exec_time', failed_only=False):
+        """返回某次执行的主机记录，默认按执行耗时从长到短排序。"""
+        if order not in ('exec_time', 'connect_time', 'output_size', 'host'):
+            order = 'exec_time'
+        direction = 'ASC' if order == 'host' else 'DESC'
+        sql = "SELECT * FROM run_hosts WHERE run_id = ?"
+        if failed_only:
+            sql += " AND success = 0"
+        sql += f" ORDER BY {order} IS NULL, {order} {direction}"
+        with self._lock:
+            rows = self._db().execute(sql, (run_id,)).fetchall()
+        return [self._host_dict(row) for row in rows]
+
+    def host_history(self, host, limit=20):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT * FROM run_hosts WHERE host = ? ORDER BY run_id DESC LIMIT ?", (host, limit)
+            ).fetchall()
+        return [self._host_dict(row) for row in rows]
+
+    @staticmethod
+    def _run_dict(row):
+        run = dict(row)
+        run['duration'] = round(run['finished_at'] - run['started_at'], 3)
+        return run
+
+    @staticmethod
+    def _host_dict(row):
+        host = dict(row)
+        host['success'] = bool(host['success'])
+        return host
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def host_record(success, failure_info, stats):
+    """把 group_run 的单台主机结果转换为历史记录。"""
+    stats = stats or {}
+    failure_info = failure_info or {}
+    outputs = stats.get('outputs') or {}
+    return {
+        'host': stats.get('host') or failure_info.get('host', ''),
+        'success': bool(success),
+        'connect_time': stats.get('connect_time'),
+        'exec_time': stats.get('exec_time'),
+        'exit_status': stats.get('exit_status'),
+        'output_size': stats.get('output_size'),
+        'reason': None if success else failure_info.get('reason'),
+        'stdout_id': outputs.get('stdout'),
+        'stderr_id': outputs.get('stderr'),
+    }
+
+history = RunHistory()
@@ -0,0 +1,237 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+
+from inventory import inventory, account_user, account_host, account_port
+from group_run import get_target_accounts
+from fanout import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, effective_priority
+
+logger = logging.getLogger(__name__)
+
+class RunCancelled(Exception):
+    """排队中的批量执行被取消。"""
+
+def host_key(account):
+    # 按实际的 SSH 目标加锁：同一台主机即使以不同的名称出现在多个目标中也会互斥
+    return f"{account_user(account)}@{account_host(account)}:{account_port(account)}".lower()
+
+def host_keys(accounts):
+    return frozenset(host_key(account) for account in accounts)
+
+def target_accounts(target):
+    """目标表达式当前对应的主机列表。"""
+    return get_target_accounts(inventory.accounts(), target)
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+class Run:
+    def __init__(self, run_id, command, target, hosts, source, priority):
+        self.id = run_id
+        self.command = command
+        self.target = target
+        self.hosts = hosts
+        self.source = source
+        self.priority = priority
+        self.state = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.merged = 0  # 合并到这次执行的重复请求数
+        self.accounts = []  # 提交时解析出的目标主机，job 应只在这些主机上执行
+        self.delivery = None  # 结果的发送方式，只有发送方式相同的请求才会合并
+        self.waiters = 0  # 仍在等待结果的请求数（包括最初的请求）
+        self._job = None
+        self._pending = collections.Counter()  # 尚未完成、仍然占用的主机键及其条目数
+        self._task = None
+        loop = asyncio.get_running_loop()
+        self._started = loop.create_future()
+        self._result = loop.create_future()
+
+    def to_dict(self, position=0):
+        return {
+            'id': self.id,
+            'command': self.command,
+            'target': self.target,
+            'source': self.source,
+            'priority': PRIORITY_NAMES.get(self.priority, self.priority),
+            'state': self.state,
+            'hosts': len(self.hosts),
+            'position': position,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'merged': self.merged,
+        }
+
+class RunManager:
+    """
+    批量执行的调度：目标主机不重叠的执行同时进行，只有主机重叠的执行才排队。
+
+    每台主机同一时间只属于一个正在进行的执行（按主机加锁），执行中某台主机完成后
+    通过 host_done() 立即释放，排队的执行不必等待整个执行（例如定时的 all）结束。排队的执行按提交
+    顺序检查：所需主机都空闲、且没有更早排队的执行与它争用同一台主机时才开始，
+    因此冲突的执行按先后顺序依次进行，不会被后来的执行插队或饿死。
+    所有状态只在事件循环中修改，一次性检查并占用全部主机，不会出现互相等待的死锁。
+
+    通过 run() 提交的执行在开始时由管理器创建任务执行，与各个等待方相互独立：
+    合并进来的重复请求与最初的请求地位相同，任意一方离开都不影响其他等待方，
+    只有所有等待方都离开后才取消排队中的执行或中止正在进行的执行。
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._queued = []
+        self._running = {}
+        self._busy = set()
+
+    def submit(self, command, target, hosts, source='', priority=PRIORITY_INTERACTIVE, job=None):
+        """
+        登记一次执行，主机空闲时立即开始，否则进入队列（run.state == 'queued'）。
+        给出 job 时开始后由管理器执行 await job(run) 并在结束时释放主机，否则由调用方 wait_turn() 后自行执行并 finish()。
+        """
+        hosts = list(hosts)
+        run = Run(next(self._ids), command, target, frozenset(hosts), source, priority)
+        run._pending.update(hosts)
+        run._job = job
+        self._queued.append(run)
+        self._dispatch()
+        return run
+
+    def _order(self):
+        # 按有效优先级（等待越久优先级越高）排序，同一优先级按提交顺序
+        now = time.time()
+        return sorted(self._queued, key=lambda run: (effective_priority(run.priority, now - run.submitted_at), run.id))
+
+    def _dispatch(self):
+        blocked = set(self._busy)
+        for run in self._order():
+            if run.hosts & blocked:
+                # 与更早的执行冲突，保留顺序并阻止后面的执行抢占这些主机
+                blocked |= run.hosts
+                continue
+            self._queued.remove(run)
+            run.state = 'running'
+            run.started_at = time.time()
+            self._running[run.id] = run
+            self._busy |= run.hosts
+            blocked |= run.hosts
+            run._started.set_result(None)
+            if run._job is not None:
+                run._task = asyncio.ensure_future(self._execute(run))
+
+    async def _execute(self, run):
+        try:
+            result = await run._job(run)
+        except BaseException as e:
+            if run.waiters:
+                run._result.set_exception(e if isinstance(e, Exception) else RunCancelled(run.id))
+            else:
+                run._result.cancel()
+            if not isinstance(e, Exception):
+                raise
+        else:
+            run._result.set_result(result)
+        finally:
+            self.finish(run)
+
+    async def wait_turn(self, run):
+        """等待轮到该执行；排队期间被取消时抛出 RunCancelled。"""
+        try:
+            await asyncio.shield(run._started)
+        except asyncio.CancelledError:
+            if run._started.cancelled():
+                raise RunCancelled(run.id)
+            raise
+
+    def abandon(self, run):
+        """等待方不再执行该 Run（例如请求被取消）：仍在排队时移出队列，已经开始时中止执行并释放主机。"""
+        if self.cancel(run.id) is None:
+            if run._task is not None and not run._task.done():
+                run._task.cancel()
+            else:
+                self.finish(run)
+
+    def host_done(self, run, account):
+        """执行中的一台主机已完成：该主机在本次执行中的条目全部完成后释放，可能让排队的执行开始。"""
+        key = host_key(account)
+        if run._pending[key] > 1:
+            run._pending[key] -= 1
+            return
+        if run._pending.pop(key, None) and self._running.get(run.id) is run:
+            self._busy.discard(key)
+            self._dispatch()
+
+    def finish(self, run):
+        if self._running.pop(run.id, None) is not None:
+            self._busy -= set(run._pending)
+            run.state = 'finished'
+            self._dispatch()
+
+    def cancel(self, run_id):
+        """取消排队中的执行，返回被取消的 Run；执行不存在或已经开始时返回 None。"""
+        for run in self._queued:
+            if run.id == run_id:
+                self._queued.remove(run)
+                run.state = 'cancelled'
+                run._started.cancel()
+                # 被它阻塞的后续执行可能已经可以开始
+                self._dispatch()
+                return run
+        return None
+
+    def position(self, run):
+        """排队位置（从 1 开始，按当前的优先级顺序），正在执行或已结束时为 0。"""
+        try:
+            return self._order().index(run) + 1
+        except ValueError:
+            return 0
+
+    def find_queued(self, command, target, delivery=None):
+        for run in self._queued:
+            if run.command == command and run.target == target and run.delivery == delivery:
+                return run
+        return None
+
+    def snapshot(self):
+        running = [run.to_dict() for run in self._running.values()]
+        queued = [run.to_dict(position) for position, run in enumerate(self._order(), 1)]
+        return running + queued
+
+    async def run(self, command, target, job, source='', on_queued=None, priority=PRIORITY_INTERACTIVE, delivery=None):
+        """
+        按目标主机加锁执行 await job(run)，返回其结果。job 在执行开始时才调用，可以读取 run 上的最新状态（例如合并后提升的优先级）。
+
+        与排队中的执行命令、目标和 delivery（job 自身发送结果的方式，例如是否发送 Telegram 消息）
+        都相同时不再重复排队，而是合并到该执行并返回同一结果（优先级取两者中较高的）。需要排队或被合并时先调用 await on_queued(run, position, merged)；
+        排队期间被取消时抛出 RunCancelled。
+        """
+        run = self.find_queued(command, target, delivery)
+        if run is not None:
+            run.merged += 1
+            if priority < run.priority:
+                run.priority = priority
+                self._dispatch()
+            logger.info(f"与排队中的批量执行 #{run.id} 相同（命令 {run.command}，目标 {run.target}），合并执行")
+        else:
+            # 目标只在提交时解析一次：加锁的主机与 job 实际执行的主机始终一致，
+            # 排队期间新增或修改的主机不会在未加锁的情况下被执行
+            accounts = target_accounts(target)
+            run = self.submit(command, target, [host_key(account) for account in accounts], source, priority, job)
+            run.accounts = accounts
+            run.delivery = delivery
+        run.waiters += 1
+        try:
+            if run.state == 'queued':
+                if not run.merged:
+                    logger.info(f"批量执行 #{run.id} 与正在进行的执行存在相同主机，排队位置 {self.position(run)}")
+                if on_queued:
+                    await on_queued(run, self.position(run), bool(run.merged))
+            await self.wait_turn(run)
+            return await asyncio.shield(run._result)
+        except BaseException:
+            run.waiters -= 1
+            if not run.waiters:
+                self.abandon(run)
+            raise
+
+manager = RunManager()
@@ -0,0 +1,131 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from config_store import CONFIG_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 错过执行时间后仍允许补跑的宽限时间（秒）
+SCHEDULER_MISFIRE_GRACE_TIME = int(os.getenv('SCHEDULER_MISFIRE_GRACE_TIME', '600'))
+
+class SQLiteJobStore(BaseJobStore):
+    """
+    基于 SQLite 的 APScheduler 任务存储，与配置数据库共用同一个文件。
+
+    任务状态（触发器、下一次执行时间、暂停状态）以 pickle 形式保存，重启后
+    调度器直接从这里恢复，无需重新计算所有任务的执行时间。
+    任务函数和参数必须可以被 pickle，因此只能使用模块级函数和简单参数。
+    """
+
+    def __init__(self, path=CONFIG_DB_PATH, tablename='apscheduler_jobs', pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.path = path
+        self.tablename = tablename
+        self.pickle_protocol = pickle_protocol
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.tablename} ("
+            "id TEXT PRIMARY KEY, next_run_time REAL, job_state BLOB NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.tablename}_next_run_time ON {self.tablename}(next_run_time)")
+
+    def shutdown(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def lookup_job(self, job_id):
+        row = self._execute(f"SELECT job_state FROM {self.tablename} WHERE id = ?", (job_id,)).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs("WHERE next_run_time <= ?", (timestamp,))
+
+    def get_next_run_time(self):
+        row = self._execute(
+            f"SELECT next_run_time FROM {self.tablename} WHERE next_run_time IS NOT NULL ORDER BY next_run_time LIMIT 1"
+        ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        try:
+            self._execute(
+                f"INSERT INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)",
+                (job.id, datetime_to_utc_timestamp(job.next_run_time), self._serialize(job))
+            )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        cursor = self._execute(
+            f"UPDATE {self.tablename} SET next_run_time = ?, job_state = ? WHERE id = ?",
+            (datetime_to_utc_timestamp(job.next_run_time), self._serialize(job), job.id)
+        )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        cursor = self._execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        self._execute(f"DELETE FROM {self.tablename}")
+
+    def _serialize(self, job):
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state['jobstore'] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, condition='', params=()):
+        rows = self._execute(
+            f"SELECT id, job_state FROM {self.tablename} {condition} ORDER BY next_run_time", params
+        ).fetchall()
+        jobs = []
+        failed_job_ids = []
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                # 任务函数被删除或改名后无法恢复，直接丢弃该任务
+                logger.exception(f"无法恢复定时任务 {job_id}，已将其删除")
+                failed_job_ids.append(job_id)
+        for job_id in failed_job_ids:
+            self._execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+        return jobs
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} (path={self.path})>'
@@ -1,72 +1,75 @@
-import json
 import os
 import asyncio
 import asyncssh
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import time
-import re
 from translations import get_translation
 from language_manager import language_manager
+import ssh_pool
+from inventory import inventory
+import metrics
+from terminal_output import LineAssembler, clean_ansi
 
 # 存储 SSH 会话和超时任务
 ssh_sessions = {}
 ssh_timeouts = {}
 is_command_running = {}
 
+# 交互式会话单次读取的最大字符数
+READ_SIZE = 65536
+# 输出持续到达时，两次发送到 Telegram 之间的间隔（秒）
+FLUSH_INTERVAL = 2
+
 def get_accounts():
-    ACCOUNTS_JSON = os.getenv('ACCOUNTS_JSON')
-    return json.loads(ACCOUNTS_JSON) if ACCOUNTS_JSON else []
+    return inventory.accounts()
 
 def is_ssh_connected(chat_id):
     return chat_id in ssh_sessions and not ssh_sessions[chat_id]['conn']._transport.is_closing()
 
 async def handle_ssh_output(stdout, update, timeout=10):
-    output_buffer = ""
-    prompt_pattern = r'.*[$#]\s*$'  # 修改提示符模式以匹配更广泛的情况
-
-    start_time = time.time()
-    command_output = []
-    prompt = None
-    last_sent_index = 0
+    """
+    读取 shell 输出直到出现提示符，返回提示符所在行。
+
+    输出持续到达时每 2 秒发送一次已完成的行；输出暂停时，未发送的行在上次发送
+    timeout 秒后发送。没有待发送内容时直接等待数据，不做轮询。
+    """
+    assembler = LineAssembler()
+    unsent = []
+    last_flush = time.monotonic()
+
+    async def flush():
+        nonlocal last_flush
+        if unsent:
+            await update.message.reply_text('\n'.join(unsent))
+            unsent.clear()
+        last_flush = time.monotonic()
 
     while True:
-        current_time = time.time()
         try:
-            chunk = await asyncio.wait_for(stdout.read(4096), timeout=0.1)
-            output_buffer += chunk
-
-            lines = output_buffer.split('\n')
-            full_lines = lines[:-1]
-            output_buffer = lines[-1]
-
-            for line in full_lines:
-                clean_line = clean_ansi_escape_sequences(line)
-                command_output.append(clean_line)
-
-            last_line = clean_ansi_escape_sequences(output_buffer)
-            if re.match(prompt_pattern, last_line):
-                if command_output[last_sent_index:]:
-                    await update.message.reply_text('\n'.join(command_output[last_sent_index:]))
-                await update.message.reply_text(last_line)
-                prompt = last_line
-                break
-
-            if current_time - start_time > 2:  # 每2秒输出一次
-                if command_output[last_sent_index:]:
-                    await update.message.reply_text('\n'.join(command_output[last_sent_index:]))
-                    last_sent_index = len(command_output)
-                start_time = current_time
-
+            if unsent:
+                remaining = max(0, last_flush + timeout - time.monotonic())
+                chunk = await asyncio.wait_for(stdout.read(READ_SIZE), timeout=remaining)
+            else:
+                chunk = await stdout.read(READ_SIZE)
         except asyncio.TimeoutError:
-            if current_time - start_time > timeout:
-                if command_output[last_sent_index:]:
-                    await update.message.reply_text('\n'.join(command_output[last_sent_index:]))
-                    last_sent_index = len(command_output)
-                start_time = current_time
-            await asyncio.sleep(0.1)
+            await flush()
+            continue
+
+        if not chunk:
+            # 通道已关闭，不会再出现提示符
+            await flush()
+            return None
+
+        unsent.extend(assembler.feed(chunk))
+        if assembler.at_prompt():
+            await flush()
+            prompt = assembler.partial_line
+            await update.message.reply_text(prompt)
+            return prompt
 
-    return prompt
+        if time.monotonic() - last_flush > FLUSH_INTERVAL:
+            await flush()
 
 async def connect_to_host(update: Update, context: ContextTypes.DEFAULT_TYPE, host_info):
     chat_id = update.effective_chat.id
@@ -80,33 +83,48 @@ async def connect_to_host(update: Update, context: ContextTypes.DEFAULT_TYPE, ho
     try:
         await update.message.reply_text(get_translation('connecting_to_host').format(host=f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}:{port}"))
 
-        client_keys = [secret_key_path] if secret_key_path else None
-
-        conn = await asyncssh.connect(
-            sslhost, 
-            port=port,
-            username=ssluser, 
-            password=password,
-            client_keys=client_keys,
-            known_hosts=None  # 禁用主机密钥检查
-        )
-        stdin, stdout, stderr = await conn.open_session(term_type='xterm')
-
-        # 使用 50 秒超时逻辑
+        # 交互式会话需要 asyncssh 的原生连接，从连接池中借用
+        connect_start = time.monotonic()
+        pooled = await ssh_pool.pool.acquire(sslhost, port, ssluser, password, secret_key_path, backend='asyncssh')
+        metrics.SSH_CONNECT_SECONDS.labels(metrics.host_label(f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}"), 'interactive').observe(time.monotonic() - connect_start)
+        conn = pooled.conn
+        # 连接可能被其他任务共享，shell 会话同样占用一个通道名额
+        await pooled.channel_slots.acquire()
+        stdin = None
+        established = False
+        # 失败时连接可能已不可用，不再归还连接池；仅等待提示符超时时连接本身仍可复用
+        discard = True
         try:
-            prompt = await asyncio.wait_for(handle_ssh_output(stdout, update), timeout=50)
-        except asyncio.TimeoutError:
-            await update.message.reply_text(get_translation('SSH_CONNECTION_TIMEOUT'))
-            conn.close()
-            return
-
-        ssh_sessions[chat_id] = {
-            'conn': conn,
-            'stdin': stdin,
-            'stdout': stdout,
-            'stderr': stderr,
-            'prompt': prompt
-        }
+            stdin, stdout, stderr = await conn.open_session(term_type='xterm')
+
+            # 使用 50 秒超时逻辑
+            try:
+                prompt = await asyncio.wait_for(handle_ssh_output(stdout, update), timeout=50)
+            except asyncio.TimeoutError:
+                discard = False
+                await update.message.reply_text(get_translation('SSH_CONNECTION_TIMEOUT'))
+                return
+
+            if prompt is None:
+                # 出现提示符之前通道已关闭，按连接失败处理
+                await update.message.reply_text(get_translation('connection_failed').format(error='channel closed'))
+                return
+
+            ssh_sessions[chat_id] = {
+                'conn': conn,
+                'pooled': pooled,
+                'stdin': stdin,
+                'stdout': stdout,
+                'stderr': stderr,
+                'prompt': prompt
+            }
+            established = True
+        finally:
+            if not established:
+                if stdin is not None:
+                    stdin.channel.close()
+                pooled.channel_slots.release()
+                ssh_pool.pool.release(pooled, discard=discard)
         
         # 启动 SSH 超时任务
         ssh_timeouts[chat_id] = asyncio.create_task(timeout_ssh_session(context.bot, chat_id))
@@ -132,14 +150,9 @@ async def handle_ssh_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(message)
     elif len(context.args) == 1:
         host_identifier = context.args[0]
-        accounts = get_accounts()
 
-        # 检查是否是预定义主机
-        account = next((acc for acc in accounts if 
-                        acc.get('customhostname', '').lower() == host_identifier.lower() or 
-                        f"{acc.get('ssluser') or acc.get('username')}@{acc.get('sslhost') or acc.get('hostname')}".lower() == host_identifier.lower() or
-                        f"{acc.get('ssluser') or acc.get('username')}@{acc.get('sslhost') or acc.get('hostname')}:{acc.get('port', 22)}".lower() == host_identifier.lower()
-                        ), None)
+        # 检查是否是预定义主机（按 customhostname、user@host 或 user@host:port 索引查找）
+        account = inventory.get(host_identifier)
 
         if account:
             # 连接预定义主机
@@ -191,22 +204,28 @@ async def handle_exit_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     chat_id = update.effective_chat.id
     if chat_id in ssh_sessions:
         if chat_id in is_command_running and is_command_running[chat_id]:
-            # 如果有命令正在执行，我们需要强制关闭连接
-            ssh_sessions[chat_id]['conn'].close()
+            # 如果有命令正在执行，关闭 shell 通道即可强制终止该命令
+            end_ssh_session(chat_id)
             await update.message.reply_text(get_translation('ssh_force_disconnected'))
         else:
-            ssh_sessions[chat_id]['conn'].close()
+            end_ssh_session(chat_id)
             await update.message.reply_text(get_translation('ssh_disconnected'))
-
-        del ssh_sessions[chat_id]
-        if chat_id in ssh_timeouts:
-            ssh_timeouts[chat_id].cancel()
-            del ssh_timeouts[chat_id]
-        if chat_id in is_command_running:
-            del is_command_running[chat_id]
     else:
         await update.message.reply_text(get_translation('no_active_ssh'))
 
+def end_ssh_session(chat_id):
+    # 关闭会话并清理该聊天的超时任务和执行状态
+    close_ssh_session(ssh_sessions.pop(chat_id))
+    if chat_id in ssh_timeouts:
+        ssh_timeouts.pop(chat_id).cancel()
+    is_command_running.pop(chat_id, None)
+
+def close_ssh_session(session):
+    # 只关闭交互式 shell 通道，底层连接归还连接池供后续复用
+    session['stdin'].channel.close()
+    session['pooled'].channel_slots.release()
+    ssh_pool.pool.release(session['pooled'])
+
 async def start_ssh_timeout(bot, chat_id):
     if chat_id in ssh_timeouts:
         ssh_timeouts[chat_id].cancel()
@@ -216,7 +235,7 @@ async def timeout_ssh_session(bot, chat_id):
     await asyncio.sleep(900)  # 15 minutes timeout
     if chat_id in ssh_sessions:
         session = ssh_sessions[chat_id]
-        session['conn'].close()
+        close_ssh_session(session)
         del ssh_sessions[chat_id]
         if chat_id in ssh_timeouts:
             del ssh_timeouts[chat_id]
@@ -248,19 +267,24 @@ async def handle_ssh_command_execution(update: Update, context: ContextTypes.DEF
             stdin.write(command + '\n')
             await stdin.drain()
             prompt = await asyncio.wait_for(handle_ssh_output(stdout, update), timeout=50)
+            if prompt is None:
+                # 远端 shell 已退出（例如执行了 exit），会话不能再使用，关闭并归还连接
+                end_ssh_session(chat_id)
+                await update.message.reply_text(get_translation('ssh_channel_closed'))
+                return
             ssh_sessions[chat_id]['prompt'] = prompt
             is_command_running[chat_id] = False
 
             # 重启 SSH 超时任务
             await start_ssh_timeout(context.bot, chat_id)
         except (asyncssh.Error, OSError) as exc:
+            is_command_running[chat_id] = False
             await update.message.reply_text(get_translation('command_execution_failed').format(error=str(exc)))
     else:
         await update.message.reply_text(get_translation('no_active_ssh'))
 
 def clean_ansi_escape_sequences(text):
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+    return clean_ansi(text)
 
 def main() -> None:
     application = Application.builder().token(os.getenv('TELEGRAM_BOT_TOKEN')).build()
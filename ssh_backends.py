@@ -0,0 +1,275 @@
+import asyncio
+import codecs
+import logging
+import os
+import select
+import socket
+import time
+import paramiko
+
+from ssh_executor import executor
+
+try:
+    import asyncssh
+except ImportError:  # asyncssh 不可用时退回 paramiko
+    asyncssh = None
+
+logger = logging.getLogger(__name__)
+
+# 批量执行使用的 SSH 后端：asyncssh（默认，纯异步）或 paramiko（线程池）
+SSH_BACKEND = os.getenv('SSH_BACKEND', 'asyncssh').lower()
+
+# 单个连接上同时打开的会话通道上限（OpenSSH 默认 MaxSessions 为 10）
+SSH_MAX_CHANNELS = int(os.getenv('SSH_MAX_CHANNELS', '8'))
+# 流式读取时单次读取的最大字节数
+STREAM_CHUNK_SIZE = 32768
+
+# 单台主机的耗时阶段，按发生顺序排列，每项为该阶段本身的耗时（秒）：
+#   dns          解析主机名
+#   tcp          建立 TCP 连接
+#   kex_auth     SSH 密钥交换和认证
+#   channel_open 打开会话通道（asyncssh 在同一次往返中发送 exec 请求，因此包含 exec）
+#   exec         发送 exec 请求到服务端确认
+#   first_byte   从命令开始执行到收到第一段输出
+#   last_byte    从第一段输出到最后一段输出
+# 复用连接池中的连接时前三项为 None。
+TIMING_PHASES = ('dns', 'tcp', 'kex_auth', 'channel_open', 'exec', 'first_byte', 'last_byte')
+
+class PhaseTimer:
+    """依次记录各阶段耗时：mark(phase) 记录从上一次 mark（或创建时）到现在的时间。"""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.timings[phase] = now - self.last
+        self.last = now
+        return now
+
+async def _open_socket(host, port, timer):
+    # 单独完成 DNS 解析和 TCP 连接，以便分别计时；随后 SSH 握手复用这个套接字
+    loop = asyncio.get_running_loop()
+    addresses = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    timer.mark('dns')
+    error = OSError(f"Could not resolve {host}")
+    for family, type_, proto, _, address in addresses:
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+        except BaseException as e:
+            sock.close()
+            if not isinstance(e, OSError):
+                raise
+            error = e
+            continue
+        timer.mark('tcp')
+        return sock
+    raise error
+
+class _Connection:
+    """
+    同一连接可以被多个任务共享，每条命令或交互式 shell 占用一个会话通道。
+    channel_slots 限制同时打开的通道数，run() 会自动占用和释放；
+    直接打开 shell 的调用方需要自行 acquire()/release()。
+    """
+
+    def __init__(self):
+        self.channel_slots = asyncio.Semaphore(SSH_MAX_CHANNELS)
+        # 建立连接时的 dns / tcp / kex_auth 耗时
+        self.connect_timings = {}
+
+    async def run(self, command):
+        async with self.channel_slots:
+            return await self._run(command)
+
+    async def stream(self, command, on_chunk, timings=None):
+        """
+        执行命令，输出一到达就调用 await on_chunk(stream, text)（stream 为
+        'stdout' 或 'stderr'），不在内存中累积完整输出。返回命令的退出状态。
+        timings: 可选的 dict，填入 channel_open、exec、first_byte、last_byte 阶段耗时。
+        """
+        if timings is None:
+            timings = {}
+        async with self.channel_slots:
+            timer = PhaseTimer(timings)
+            first_byte = last_byte = None
+
+            async def timed_chunk(stream, text):
+                nonlocal first_byte, last_byte
+                if first_byte is None:
+                    first_byte = timer.mark('first_byte')
+                last_byte = time.perf_counter()
+                await on_chunk(stream, text)
+
+            try:
+                return await self._stream(command, timed_chunk, timer)
+            finally:
+                if first_byte is not None:
+                    timings['last_byte'] = last_byte - first_byte
+
+class ParamikoConnection(_Connection):
+    """paramiko 后端：阻塞调用放到专用的 SSH 线程池中执行，每台在途主机占用一个线程。"""
+    backend = 'paramiko'
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    @classmethod
+    async def connect(cls, host, port, username, password=None, key_path=None):
+        timings = {}
+        timer = PhaseTimer(timings)
+        sock = await _open_socket(host, port, timer)
+        sock.setblocking(True)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            if key_path:
+                # 读取和解析私钥同样放在线程池中，不阻塞事件循环
+                await executor.run(
+                    lambda: client.connect(host, port=port, username=username,
+                                           pkey=paramiko.RSAKey.from_private_key_file(key_path), sock=sock)
+                )
+            else:
+                await executor.run(
+                    lambda: client.connect(host, port=port, username=username, password=password, sock=sock)
+                )
+        except BaseException:
+            client.close()
+            sock.close()
+            raise
+        timer.mark('kex_auth')
+        conn = cls(client)
+        conn.connect_timings = timings
+        return conn
+
+    async def _run(self, command):
+        stdin, stdout, stderr = await executor.run(self.client.exec_command, command)
+        output = await executor.run(stdout.read)
+        error = await executor.run(stderr.read)
+        return output.decode().strip(), error.decode().strip()
+
+    async def _stream(self, command, on_chunk, timer):
+        channel = await executor.run(self.client.get_transport().open_session)
+        timer.mark('channel_open')
+        decoders = {
+            'stdout': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+            'stderr': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+        }
+        try:
+            await executor.run(channel.exec_command, command)
+            timer.mark('exec')
+            while True:
+                stream, data = await executor.run(_recv_chunk, channel)
+                if stream is None:
+                    break
+                text = decoders[stream].decode(data)
+                if text:
+                    await on_chunk(stream, text)
+            for stream, decoder in decoders.items():
+                tail = decoder.decode(b'', final=True)
+                if tail:
+                    await on_chunk(stream, tail)
+            return await executor.run(channel.recv_exit_status)
+        finally:
+            # 被取消时关闭通道，让仍在线程中等待数据的读取立即返回
+            channel.close()
+
+    def is_alive(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        self.client.close()
+
+class AsyncSSHConnection(_Connection):
+    """asyncssh 后端：连接和命令执行都在事件循环上完成，不占用线程。"""
+    backend = 'asyncssh'
+
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+
+    @classmethod
+    async def connect(cls, host, port, username, password=None, key_path=None):
+        timings = {}
+        timer = PhaseTimer(timings)
+        sock = await _open_socket(host, port, timer)
+        try:
+            conn = await asyncssh.connect(
+                host,
+                port=port,
+                sock=sock,
+                username=username,
+                password=password,
+                client_keys=[key_path] if key_path else None,
+                known_hosts=None  # 与 paramiko 的 AutoAddPolicy 保持一致
+            )
+        except BaseException:
+            sock.close()
+            raise
+        timer.mark('kex_auth')
+        connection = cls(conn)
+        connection.connect_timings = timings
+        return connection
+
+    async def _run(self, command):
+        result = await self.conn.run(command, check=False, errors='replace')
+        return (result.stdout or '').strip(), (result.stderr or '').strip()
+
+    async def _stream(self, command, on_chunk, timer):
+        process = await self.conn.create_process(command, errors='replace')
+        timer.mark('channel_open')
+        try:
+            async def pump(reader, stream):
+                while True:
+                    text = await reader.read(STREAM_CHUNK_SIZE)
+                    if not text:
+                        break
+                    await on_chunk(stream, text)
+
+            await asyncio.gather(pump(process.stdout, 'stdout'), pump(process.stderr, 'stderr'))
+            completed = await process.wait(check=False)
+            return completed.exit_status
+        finally:
+            process.close()
+
+    def is_alive(self):
+        return not self.conn._transport.is_closing()
+
+    def close(self):
+        self.conn.close()
+
+def _recv_chunk(channel):
+    """在 SSH 线程池中阻塞等待下一段输出，返回 (stream, data)；输出结束时返回 (None, b'')。"""
+    while True:
+        if channel.recv_stderr_ready():
+            return 'stderr', channel.recv_stderr(STREAM_CHUNK_SIZE)
+        if channel.recv_ready():
+            return 'stdout', channel.recv(STREAM_CHUNK_SIZE)
+        # EOF 之后远端不会再发送数据，缓冲区读空即结束
+        if channel.eof_received or channel.closed:
+            return None, b''
+        # channel 的文件描述符在 stdout/stderr 有数据或通道关闭时变为可读
+        select.select([channel], [], [], 1.0)
+
+BACKENDS = {
+    'paramiko': ParamikoConnection,
+    'asyncssh': AsyncSSHConnection,
+}
+
+def get_backend(name=None):
+    name = (name or SSH_BACKEND).lower()
+    if name == 'asyncssh' and asyncssh is None:
+        logger.warning("asyncssh 未安装，SSH 后端退回 paramiko")
+        name = 'paramiko'
+    if name not in BACKENDS:
+        logger.warning(f"未知的 SSH_BACKEND: {name}，使用 paramiko")
+        name = 'paramiko'
+    return BACKENDS[name]
+
+async def connect(host, port, username, password=None, key_path=None, backend=None):
+    return await get_backend(backend).connect(host, int(port), username, password, key_path)
@@ -0,0 +1,254 @@
+import asyncio
+import codecs
+import json
+import logging
+import os
+
+import ssh_backends
+from ssh_executor import executor
+
+logger = logging.getLogger(__name__)
+
+# 网页终端使用的 SSH 后端：asyncssh（默认，连接、握手和读写都在事件循环上完成）或 paramiko
+WEB_TERMINAL_BACKEND = os.getenv('WEB_TERMINAL_BACKEND', 'asyncssh').lower()
+# 单次从 SSH 通道读取的最大字节数
+READ_SIZE = 65536
+# 网页终端输出的合并窗口（毫秒）：收到输出后最多再等待这么久，把期间的输出合并成一个 WebSocket 帧
+WEB_TERMINAL_FLUSH_MS = float(os.getenv('WEB_TERMINAL_FLUSH_MS', '10'))
+# 单个输出帧的最大字节数，达到后立即发送
+WEB_TERMINAL_MAX_FRAME = 65536
+# 终端尺寸的合法范围
+MAX_TERMINAL_SIZE = 1000
+
+class ChannelReader:
+    """
+    paramiko 通道的事件驱动读取。
+
+    paramiko 在通道收到数据、EOF 或被关闭时会把 channel.fileno() 返回的管道
+    置为可读，这里只在缓冲区为空时向事件循环注册一次该描述符并等待，不占用
+    线程也不轮询。读到的数据交给调用方处理完之后才会再次读取，调用方发送得慢时
+    数据留在 paramiko 的接收窗口中，远端随之暂停发送（背压）。
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._loop = asyncio.get_running_loop()
+        self._fd = channel.fileno()
+
+    async def read(self, size=READ_SIZE):
+        """返回下一段输出（bytes），通道结束时返回 b''。"""
+        channel = self.channel
+        while True:
+            if channel.recv_ready():
+                return channel.recv(size)
+            if channel.recv_stderr_ready():
+                return channel.recv_stderr(size)
+            if channel.closed or channel.eof_received:
+                return b''
+            await self._wait_readable()
+
+    async def _wait_readable(self):
+        future = self._loop.create_future()
+
+        def wake():
+            if not future.done():
+                future.set_result(None)
+
+        self._loop.add_reader(self._fd, wake)
+        try:
+            await future
+        finally:
+            self._loop.remove_reader(self._fd)
+
+class _Terminal:
+    """
+    共享连接上的交互式 shell，打开时占用连接的一个通道名额，close() 时归还。
+    read() 返回解码后的文本，shell 结束时返回 ''。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._closed = False
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._close()
+            self.conn.channel_slots.release()
+
+class ParamikoTerminal(_Terminal):
+    def __init__(self, conn, channel):
+        super().__init__(conn)
+        self.channel = channel
+        self._reader = ChannelReader(channel)
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    @classmethod
+    async def open(cls, conn, term='xterm', cols=80, rows=24):
+        channel = await executor.run(conn.client.invoke_shell, term, cols, rows)
+        return cls(conn, channel)
+
+    async def read(self):
+        while True:
+            data = await self._reader.read()
+            if not data:
+                return self._decoder.decode(b'', final=True)
+            text = self._decoder.decode(data)
+            if text:
+                return text
+
+    async def write(self, data):
+        # sendall 在远端接收窗口已满时会阻塞，放到 SSH 线程池中执行
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        await executor.run(self.channel.sendall, data)
+
+    async def resize(self, cols, rows):
+        await executor.run(self.channel.resize_pty, cols, rows)
+
+    def _close(self):
+        self.channel.close()
+
+class AsyncSSHTerminal(_Terminal):
+    def __init__(self, conn, process):
+        super().__init__(conn)
+        self.process = process
+
+    @classmethod
+    async def open(cls, conn, term='xterm', cols=80, rows=24):
+        process = await conn.conn.create_process(
+            term_type=term, term_size=(cols, rows), stderr=ssh_backends.asyncssh.STDOUT, errors='replace'
+        )
+        return cls(conn, process)
+
+    async def read(self):
+        # asyncssh 按接收窗口做流量控制：这里不读取时远端会暂停发送
+        return await self.process.stdout.read(READ_SIZE)
+
+    async def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', errors='replace')
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def resize(self, cols, rows):
+        self.process.change_terminal_size(cols, rows)
+
+    def _close(self):
+        self.process.close()
+
+_TERMINALS = {
+    'paramiko': ParamikoTerminal,
+    'asyncssh': AsyncSSHTerminal,
+}
+
+def terminal_backend():
+    return ssh_backends.get_backend(WEB_TERMINAL_BACKEND).backend
+
+async def open_terminal(conn, term='xterm', cols=80, rows=24):
+    """在连接池借出的连接上打开交互式 shell。"""
+    await conn.channel_slots.acquire()
+    try:
+        return await _TERMINALS[conn.backend].open(conn, term, cols, rows)
+    except BaseException:
+        conn.channel_slots.release()
+        raise
+
+async def pump_terminal(terminal, send):
+    """把 shell 输出依次 await send(text)，直到 shell 结束；send 完成之前不会继续读取。"""
+    while True:
+        text = await terminal.read()
+        if not text:
+            break
+        await send(text)
+
+async def pump_terminal_frames(terminal, send, flush_ms=WEB_TERMINAL_FLUSH_MS, max_frame=WEB_TERMINAL_MAX_FRAME):
+    """
+    把 shell 输出按时间窗口合并为 UTF-8 字节帧并 await send(frame)，直到 shell 结束。
+
+    收到一段输出后最多再等待 flush_ms 毫秒（或累计到 max_frame 字节）再发送，
+    大量输出时帧数随之减少；始终只有一个未完成的读取，send 较慢时不会继续读取（背压）。
+    """
+    loop = asyncio.get_running_loop()
+    interval = max(flush_ms, 0) / 1000
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(terminal.read())
+            text = await pending
+            pending = None
+            if not text:
+                break
+            buffer = [text.encode('utf-8')]
+            size = len(buffer[0])
+            finished = False
+            deadline = loop.time() + interval
+            while size < max_frame:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                pending = asyncio.ensure_future(terminal.read())
+                done, _ = await asyncio.wait((pending,), timeout=remaining)
+                if not done:
+                    # 窗口结束时读取仍未完成，留到下一帧继续等待
+                    break
+                text = pending.result()
+                pending = None
+                if not text:
+                    finished = True
+                    break
+                data = text.encode('utf-8')
+                buffer.append(data)
+                size += len(data)
+            await send(b''.join(buffer))
+            if finished:
+                break
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+async def handle_terminal_message(terminal, message):
+    """
+    处理网页终端客户端发来的一帧：二进制帧是原样转发给 shell 的按键输入，
+    文本帧是 JSON 控制消息，目前支持 {"type": "resize", "cols": 列数, "rows": 行数}。
+    """
+    if isinstance(message, bytes):
+        if message:
+            await terminal.write(message)
+        return
+    try:
+        control = json.loads(message)
+    except ValueError:
+        logger.warning(f"忽略无法解析的终端控制消息: {message[:100]!r}")
+        return
+    if not isinstance(control, dict):
+        return
+    if control.get('type') == 'resize':
+        size = terminal_size(control.get('cols'), control.get('rows'))
+        if size:
+            await terminal.resize(*size)
+    else:
+        logger.warning(f"未知的终端控制消息类型: {control.get('type')!r}")
+
+def terminal_size(cols, rows):
+    """校验客户端提供的终端尺寸，返回 (cols, rows)，不合法时返回 None。"""
+    try:
+        cols, rows = int(cols), int(rows)
+    except (TypeError, ValueError):
+        return None
+    if not (0 < cols <= MAX_TERMINAL_SIZE and 0 < rows <= MAX_TERMINAL_SIZE):
+        return None
+    return cols, rows
+
+async def run_until_first_done(*coroutines):
+    """同时运行读写两端，任一端结束（shell 退出或客户端断开）时取消另一端。"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        task.result()
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# 专用于阻塞式 SSH I/O（paramiko）的线程数，与事件循环默认线程池相互隔离
+SSH_EXECUTOR_WORKERS = int(os.getenv('SSH_EXECUTOR_WORKERS', '32'))
+
+class SSHExecutor:
+    """
+    阻塞式 SSH 调用的专用线程池。
+
+    批量执行时大量 paramiko 调用只会占满这里的线程，不会挤占 Telegram 处理器
+    和 Web 请求所使用的默认线程池。stats() 提供排队深度和饱和度等运行数据。
+    """
+
+    def __init__(self, max_workers=SSH_EXECUTOR_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.peak_queued = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ssh-io')
+        return self._executor
+
+    def _call(self, func):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def run(self, func, *args, **kwargs):
+        if args or kwargs:
+            func = partial(func, *args, **kwargs)
+        with self._lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        future = self._get_executor().submit(self._call, func)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if future.cancel():
+                # 任务还在排队时被取消，线程池不会再执行它
+                with self._lock:
+                    self.queued -= 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'active': self.active,
+                'queued': self.queued,
+                'peak_queued': self.peak_queued,
+                'completed': self.completed,
+                'saturation': round(self.active / self.max_workers, 3),
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+executor = SSHExecutor()
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import ssh_backends
+
+logger = logging.getLogger(__name__)
+
+# 连接池最多保留的空闲连接数
+SSH_POOL_MAX_SIZE = int(os.getenv('SSH_POOL_MAX_SIZE', '50'))
+# 空闲连接的存活时间（秒），超时后关闭
+SSH_POOL_IDLE_TTL = float(os.getenv('SSH_POOL_IDLE_TTL', '300'))
+
+def make_key(host, port, username, password=None, key_path=None, backend=None):
+    # 凭据只保留摘要，避免密码出现在日志或调试输出中
+    credential = hashlib.sha256(f"{password or ''}\0{key_path or ''}".encode()).hexdigest()[:16]
+    backend = ssh_backends.get_backend(backend).backend
+    return (backend, username, host, int(port), credential)
+
+class _Entry:
+    __slots__ = ('key', 'conn', 'refs', 'idle_since', 'retired')
+
+    def __init__(self, key, conn):
+        self.key = key
+        self.conn = conn
+        self.refs = 0
+        self.idle_since = time.monotonic()
+        self.retired = False
+
+class SSHConnectionPool:
+    """
+    按 (后端, 用户, 主机, 端口, 凭据) 复用 SSH 连接。
+
+    同一主机在同一时间只保持一个连接：并发的 acquire() 共享该连接，各自在其上
+    打开独立的会话通道（受 ssh_backends.SSH_MAX_CHANNELS 限制）；正在建立中的
+    连接也会被后来者直接等待复用，因此同一时间窗口内的多个任务只握手一次。
+    每次 acquire() 都必须对应一次 release()；最后一个使用者归还后，连接在
+    idle_ttl 内保持空闲以供复用。
+    """
+
+    def __init__(self, max_size=SSH_POOL_MAX_SIZE, idle_ttl=SSH_POOL_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._entries = {}  # key -> 可复用的 _Entry
+        self._connecting = {}  # key -> 正在建立连接的 Task
+        self._leased = {}  # id(conn) -> _Entry，包含已退役但仍在使用的连接
+        self._reaper = None
+        self.hits = 0
+        self.misses = 0
+
+    async def acquire(self, host, port, username, password=None, key_path=None, backend=None, timings=None):
+        """
+        timings: 可选的 dict。本次调用等待了新连接建立时，填入该连接的
+        dns / tcp / kex_auth 耗时；直接复用已有连接时不做修改。
+        """
+        key = make_key(host, port, username, password, key_path, backend)
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expired = entry.refs == 0 and time.monotonic() - entry.idle_since > self.idle_ttl
+                if not expired and self._is_healthy(entry.conn):
+                    entry.refs += 1
+                    entry.idle_since = None
+                    self.hits += 1
+                    return entry.conn
+                self._retire(entry)
+                continue
+
+            task = self._connecting.get(key)
+            if task is None:
+                self.misses += 1
+                self._ensure_reaper()
+                task = asyncio.ensure_future(self._open(key, host, port, username, password, key_path))
+                self._connecting[key] = task
+            else:
+                self.hits += 1
+            # shield：单个等待者超时取消时，不影响其他等待同一连接的任务
+            conn = await asyncio.shield(task)
+            if timings is not None:
+                timings.update(conn.connect_timings)
+            entry = self._leased.get(id(conn))
+            if entry is not None and not entry.retired:
+                entry.refs += 1
+                entry.idle_since = None
+                return conn
+
+    def release(self, conn, discard=False):
+        entry = self._leased.get(id(conn))
+        if entry is None:
+            self._close(conn)
+            return
+
+        entry.refs -= 1
+        if discard or not self._is_healthy(conn):
+            # 连接可能仍被其他任务共享，只是不再分配给新的使用者
+            self._retire(entry)
+        if entry.refs > 0:
+            return
+        if entry.retired or self.max_size <= 0:
+            self._retire(entry)
+            return
+
+        entry.idle_since = time.monotonic()
+        idle = [e for e in self._entries.values() if e.refs == 0]
+        for oldest in sorted(idle, key=lambda e: e.idle_since)[:max(0, len(idle) - self.max_size)]:
+            self._retire(oldest)
+
+    @asynccontextmanager
+    async def connection(self, host, port, username, password=None, key_path=None, backend=None):
+        conn = await self.acquire(host, port, username, password, key_path, backend)
+        discard = False
+        try:
+            yield conn
+        except BaseException:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def stats(self):
+        return {
+            'connections': len(self._leased),
+            'idle': sum(1 for e in self._entries.values() if e.refs == 0),
+            'leases': sum(e.refs for e in self._leased.values()),
+            'connecting': len(self._connecting),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def close_all(self):
+        for task in self._connecting.values():
+            task.cancel()
+        self._connecting.clear()
+        for entry in list(self._leased.values()):
+            entry.refs = 0
+            self._retire(entry)
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+
+    async def _open(self, key, host, port, username, password, key_path):
+        try:
+            conn = await ssh_backends.connect(host, port, username, password, key_path, backend=key[0])
+        finally:
+            self._connecting.pop(key, None)
+        entry = _Entry(key, conn)
+        self._entries[key] = entry
+        self._leased[id(conn)] = entry
+        return conn
+
+    def _retire(self, entry):
+        entry.retired = True
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        if entry.refs <= 0:
+            self._leased.pop(id(entry.conn), None)
+            self._close(entry.conn)
+
+    def _is_healthy(self, conn):
+        try:
+            return conn.is_alive()
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"关闭 SSH 连接时出错: {e}")
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for entry in list(self._entries.values()):
+            if entry.refs == 0 and (now - entry.idle_since > self.idle_ttl or not self._is_healthy(entry.conn)):
+                self._retire(entry)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.ensure_future(self._reap())
+
+    async def _reap(self):
+        interval = max(1.0, min(self.idle_ttl, 30.0))
+        while True:
+            await asyncio.sleep(interval)
+            self._evict_expired()
+
+pool = SSHConnectionPool()
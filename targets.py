@@ -0,0 +1,185 @@
+import logging
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+from config_store import store
+from inventory import inventory, snapshot_of
+
+logger = logging.getLogger(__name__)
+
+# 最多缓存多少个目标表达式的解析结果
+TARGET_CACHE_SIZE = 256
+
+_COUNT = re.compile(r'^([+-])(\d+)$')
+
+class TargetError(ValueError):
+    pass
+
+@lru_cache(maxsize=TARGET_CACHE_SIZE)
+def compile_target(expression):
+    """
+    把目标表达式编译为不依赖主机清单的结构，结果按表达式缓存。
+
+    语法：
+      all                 所有主机
+      +N / -N             前 N 个 / 后 N 个主机
+      group:NAME          配置中定义的主机组
+      tag:NAME            tags 包含 NAME 的主机
+      NAME / user@host[:port]
+      A,B                 并集
+      A&B                 交集
+      !A                  排除（单独出现时从其余结果中去掉，出现在 & 中时表示补集）
+
+    返回 (clauses, exclusions)，二者都是由 ((negated, kind, value), ...) 组成的元组。
+    """
+    clauses = []
+    exclusions = []
+    for clause in (expression or 'all').split(','):
+        clause = clause.strip()
+        if not clause:
+            continue
+        terms = tuple(_compile_term(term) for term in clause.split('&'))
+        if len(terms) == 1 and terms[0][0]:
+            exclusions.append(((False,) + terms[0][1:],))
+        else:
+            clauses.append(terms)
+    return tuple(clauses), tuple(exclusions)
+
+def _compile_term(term):
+    term = term.strip()
+    negated = term.startswith('!')
+    if negated:
+        term = term[1:].strip()
+    if not term:
+        raise TargetError("empty target term")
+
+    lowered = term.lower()
+    match = _COUNT.match(lowered)
+    if lowered == 'all':
+        return negated, 'all', None
+    if match:
+        return negated, 'first' if match.group(1) == '+' else 'last', int(match.group(2))
+    if lowered.startswith('group:'):
+        # 主机组名与主机名、标签一样不区分大小写
+        return negated, 'group', lowered[6:].strip()
+    if lowered.startswith('tag:'):
+        return negated, 'tag', lowered[4:].strip()
+    if lowered[0] in '+-':
+        raise TargetError(f"invalid host count: {term}")
+    return negated, 'host', lowered
+
+class TargetResolver:
+    """
+    针对当前主机清单求值目标表达式。
+
+    结果按 (表达式, 清单版本, 主机组配置) 缓存，清单或主机组变化后自动失效，
+    定时任务反复执行同一目标时无需重新扫描全部主机。
+    """
+
+    def __init__(self, max_size=TARGET_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def resolve(self, expression, snapshot=None):
+        """在当前主机清单（或指定的 snapshot，不缓存）上求值目标表达式。"""
+        if snapshot is not None:
+            return list(self._evaluate(snapshot, expression or 'all'))
+        snapshot = inventory.snapshot()
+        key = (expression or 'all', snapshot.version, store.groups_version)
+        accounts = self._cache.get(key)
+        if accounts is not None:
+            self._cache.move_to_end(key)
+            return list(accounts)
+
+        accounts = self._evaluate(snapshot, key[0])
+        self._cache[key] = accounts
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return list(accounts)
+
+    @staticmethod
+    def _evaluate(snapshot, expression):
+        clauses, exclusions = compile_target(expression)
+        evaluator = _Evaluator(snapshot, store.list_groups())
+        selected = set()
+        for terms in clauses:
+            selected |= evaluator.intersect(terms)
+        if exclusions and not clauses:
+            selected = set(range(len(snapshot.accounts)))
+        for terms in exclusions:
+            selected -= evaluator.intersect(terms)
+
+        return tuple(snapshot.accounts[i] for i in sorted(selected))
+
+    def unknown_terms(self, expression):
+        """返回表达式中找不到对应主机、主机组或标签的项，表达式无效时抛出 TargetError。"""
+        snapshot = inventory.snapshot()
+        host_groups = _groups_by_name(store.list_groups())
+        clauses, exclusions = compile_target(expression or 'all')
+        unknown = []
+        for terms in clauses + exclusions:
+            for _, kind, value in terms:
+                if kind == 'group' and value not in host_groups:
+                    unknown.append(f"group:{value}")
+                elif kind == 'tag' and value not in snapshot.by_tag:
+                    unknown.append(f"tag:{value}")
+                elif kind == 'host' and inventory.get(value) is None:
+                    unknown.append(value)
+        return unknown
+
+    def clear(self):
+        self._cache.clear()
+
+class _Evaluator:
+    """在单个清单快照上把表达式项求值为主机位置集合。"""
+
+    def __init__(self, snapshot, host_groups):
+        self.snapshot = snapshot
+        self.host_groups = _groups_by_name(host_groups)
+        self.everything = frozenset(range(len(snapshot.accounts)))
+
+    def intersect(self, terms):
+        result = None
+        for negated, kind, value in terms:
+            positions = self.term(kind, value)
+            if negated:
+                positions = self.everything - positions
+            result = positions if result is None else result & positions
+        return result or set()
+
+    def term(self, kind, value):
+        snapshot = self.snapshot
+        total = len(snapshot.accounts)
+        if kind == 'all':
+            return set(self.everything)
+        if kind == 'first':
+            return set(range(min(value, total)))
+        if kind == 'last':
+            return set(range(max(0, total - value), total)) if value else set()
+        if kind == 'tag':
+            return {snapshot.positions[id(account)] for account in snapshot.by_tag.get(value, [])}
+        if kind == 'group':
+            members = self.host_groups.get(value, [])
+            return {position for position in (self.host(str(member).lower()) for member in members) if position is not None}
+        position = self.host(value)
+        return set() if position is None else {position}
+
+    def host(self, identifier):
+        account = self.snapshot.by_name.get(identifier) or self.snapshot.by_identity.get(identifier)
+        return None if account is None else self.snapshot.positions[id(account)]
+
+def _groups_by_name(host_groups):
+    # 按小写组名索引；仅大小写不同的组名以排序靠前的为准
+    groups = {}
+    for name, members in host_groups.items():
+        groups.setdefault(name.lower(), members)
+    return groups
+
+resolver = TargetResolver()
+
+def resolve_targets(expression, accounts=None):
+    """解析目标表达式；accounts 不是当前主机清单时在该列表上求值（不缓存）。"""
+    if accounts is None or accounts is inventory.accounts():
+        return resolver.resolve(expression)
+    return resolver.resolve(expression, snapshot_of(accounts))
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import time
+import aiohttp
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', "https://api.telegram.org")
+# Telegram 单条消息的最大长度
+MAX_MESSAGE_LENGTH = 4096
+# 发送队列长度上限，超出后丢弃新消息并记录日志
+TELEGRAM_QUEUE_SIZE = int(os.getenv('TELEGRAM_QUEUE_SIZE', '1000'))
+
+class TelegramOutbox:
+    """
+    长连接复用的 Telegram 发送客户端。
+
+    所有消息进入同一个异步队列，由单个后台任务按顺序发送，复用同一个
+    aiohttp 会话（TCP/TLS 连接保持复用）。遇到 429 时按 Telegram 返回的
+    retry_after 等待后重试。
+    """
+
+    def __init__(self, token=None, chat_id=None, max_queue=TELEGRAM_QUEUE_SIZE, max_retries=5):
+        self.token = token or os.getenv('TELEGRAM_BOT_TOKEN')
+        self.chat_id = chat_id or os.getenv('TELEGRAM_CHAT_ID')
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._loop = None
+        self._session = None
+        self._queue = None
+        self._worker = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环发生变化（例如测试中多次 asyncio.run），旧的队列和会话已不可用
+            self._loop = loop
+            self._session = None
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run_worker())
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=8, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    async def call(self, method, payload):
+        """直接调用 Bot API 方法，返回 result 字段；失败时返回 None。"""
+        url = f"{TELEGRAM_API_URL}/bot{self.token}/{method}"
+        started = time.monotonic()
+        try:
+            return await self._call(url, method, payload)
+        finally:
+            metrics.TELEGRAM_SEND_SECONDS.labels(method).observe(time.monotonic() - started)
+
+    async def _call(self, url, method, payload):
+        for attempt in range(self.max_retries):
+            try:
+                async with self._get_session().post(url, json=payload) as response:
+                    data = await response.json(content_type=None)
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error(f"调用 Telegram API {method} 时发生错误: {str(e)}")
+                metrics.TELEGRAM_ERRORS.labels(method, 'network').inc()
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+
+            if data.get('ok'):
+                return data.get('result')
+
+            retry_after = (data.get('parameters') or {}).get('retry_after')
+            if status == 429 and retry_after:
+                logger.warning(f"Telegram 限流，{retry_after} 秒后重试 {method}")
+                metrics.TELEGRAM_ERRORS.labels(method, 'rate_limited').inc()
+                await asyncio.sleep(retry_after)
+                continue
+
+            logger.error(f"调用 Telegram API {method} 失败: {data.get('description')}")
+            metrics.TELEGRAM_ERRORS.labels(method, 'api').inc()
+            return None
+        return None
+
+    async def _run_worker(self):
+        while True:
+            method, payload, future = await self._queue.get()
+            try:
+                result = await self.call(method, payload)
+                if result is None:
+                    self.failed += 1
+                else:
+                    self.sent += 1
+                    if method == 'sendMessage':
+                        logger.info(f"成功发送消息到Telegram: {payload['text'][:50]}...")
+            except Exception as e:
+                logger.error(f"发送消息到Telegram时发生错误: {str(e)}")
+                result = None
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+            if not future.done():
+                future.set_result(result)
+
+    def enqueue(self, method, payload):
+        self._ensure_started()
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((method, payload, future))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.TELEGRAM_ERRORS.labels(method, 'dropped').inc()
+            logger.error(f"Telegram 发送队列已满，丢弃 {method} 请求")
+            future.set_result(None)
+        return future
+
+    async def send_message(self, text, chat_id=None, wait=False, **params):
+        """
+        将消息放入发送队列，超长消息会按 4096 字符拆分。
+        wait=True 时等待发送完成并返回第一段消息的 Message 对象（dict）。
+        """
+        chat_id = chat_id or self.chat_id
+        chunks = [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)] or ['']
+        futures = [self.enqueue('sendMessage', dict(params, chat_id=chat_id, text=chunk)) for chunk in chunks]
+        if wait:
+            results = await asyncio.gather(*futures)
+            return results[0]
+        return None
+
+    async def flush(self, timeout=10):
+        if self._queue is None or self._loop is not asyncio.get_running_loop():
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Telegram 发送队列未能在 {timeout} 秒内清空，剩余 {self._queue.qsize()} 条")
+
+    async def close(self):
+        await self.flush()
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
+
+outbox = TelegramOutbox()
+metrics.TELEGRAM_QUEUE_DEPTH.set_function(lambda: outbox.stats()['queued'])
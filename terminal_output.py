@@ -0,0 +1,66 @@
+import re
+
+# ANSI 转义序列（颜色、光标移动等），模块加载时编译一次
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+# 位于末尾、可能被拆到下一段输出中的不完整转义序列
+_INCOMPLETE_ESCAPE = re.compile(r'\x1B(?:\[[0-?]*[ -/]*)?\Z')
+# 提示符以 $ 或 # 结尾（忽略末尾空白）
+PROMPT_CHARS = ('$', '#')
+
+def clean_ansi(text):
+    return ANSI_ESCAPE.sub('', text)
+
+class LineAssembler:
+    """
+    交互式 shell 输出的增量行拼接器。
+
+    feed() 每次只处理新到达的片段：完整的行去掉 ANSI 转义后返回，未结束的最后
+    一行分段保存，并记录其最后一个非空白字符，用于判断是否出现了提示符。
+    被拆在两段输出之间的转义序列会暂存到下一次 feed()，因此总的处理量与
+    输出长度成正比，不会因为长行或大量输出而反复扫描已处理的内容。
+    """
+
+    def __init__(self):
+        self._partial = []  # 当前未结束行中已清理的片段
+        self._pending = ''  # 末尾尚不完整的转义序列
+        self._last_char = ''
+
+    def feed(self, chunk):
+        """追加一段输出，返回其中新完成的行（已去除 ANSI 转义）。"""
+        text = self._pending + chunk
+        self._pending = ''
+        # 转义序列不会跨越换行，已完成的部分可以整体清理后再拆分
+        cut = text.rfind('\n')
+        lines = clean_ansi(text[:cut]).split('\n') if cut != -1 else []
+        tail = text[cut + 1:]
+
+        if lines and self._partial:
+            self._partial.append(lines[0])
+            lines[0] = ''.join(self._partial)
+        if lines:
+            self._partial = []
+            self._last_char = ''
+
+        index = tail.rfind('\x1b')
+        if index != -1 and _INCOMPLETE_ESCAPE.match(tail, index):
+            self._pending = tail[index:]
+            tail = tail[:index]
+        if tail:
+            cleaned = clean_ansi(tail)
+            self._partial.append(cleaned)
+            # 纯空白片段不改变是否以提示符结尾的判断
+            stripped = cleaned.rstrip()
+            if stripped:
+                self._last_char = stripped[-1]
+        return lines
+
+    @property
+    def partial_line(self):
+        """当前未结束的最后一行（已去除 ANSI 转义）。"""
+        if len(self._partial) > 1:
+            self._partial = [''.join(self._partial)]
+        return self._partial[0] if self._partial else ''
+
+    def at_prompt(self):
+        """未结束的最后一行是否以 $ 或 # 结尾，即远端 shell 正在等待输入。"""
+        return not self._pending and self._last_char in PROMPT_CHARS
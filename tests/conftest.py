@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# 测试使用临时的配置数据库，不影响工作目录中的 sshtgbot.db
+os.environ.setdefault('CONFIG_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='sshtgbot-test-'), 'sshtgbot.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import app as app_module
+import metrics
+
+def get(path, **kwargs):
+    async def request():
+        return await app_module.app.test_client().get(path, **kwargs)
+    return asyncio.run(request())
+
+@pytest.mark.parametrize('token, kwargs, status', [
+    (None, {}, 404),
+    (None, {'headers': {'Cookie': 'authenticated=1'}}, 200),
+    ('sécret', {}, 401),
+    ('sécret', {'query_string': {'token': 'wrong'}}, 401),
+    ('sécret', {'query_string': {'token': 'sécret'}}, 200),
+    ('secret', {'headers': {'Authorization': 'Bearer secret'}}, 200),
+    ('sécret', {'headers': {'Authorization': 'Bearer ünïcode'}}, 401),
+])
+def test_metrics_requires_login_or_token(monkeypatch, token, kwargs, status):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', token)
+    assert get('/metrics', **kwargs).status_code == status
+
+class FakeTerminal:
+    def __init__(self):
+        self._prompted = False
+        self._closed = asyncio.Event()
+
+    async def read(self):
+        if not self._prompted:
+            self._prompted = True
+            return '$ '
+        await self._closed.wait()
+        return ''
+
+    async def write(self, data):
+        pass
+
+    def close(self):
+        self._closed.set()
+
+def test_webhook_stays_responsive_during_terminal_storm(monkeypatch):
+    connect_delay = 0.5
+    terminals = 50
+
+    async def slow_acquire(*args, **kwargs):
+        # 模拟握手很慢的主机
+        await asyncio.sleep(connect_delay)
+        return object()
+
+    async def fake_open_terminal(conn, cols=80, rows=24):
+        return FakeTerminal()
+
+    monkeypatch.setattr(app_module.inventory, 'get_by_name', lambda host: {'hostname': host, 'username': 'root'})
+    monkeypatch.setattr(app_module.ssh_pool.pool, 'acquire', slow_acquire)
+    monkeypatch.setattr(app_module.ssh_pool.pool, 'release', lambda conn, discard=False: None)
+    monkeypatch.setattr(app_module, 'open_terminal', fake_open_terminal)
+
+    async def scenario():
+        client = app_module.app.test_client()
+        webhook = f"/{os.getenv('TELEGRAM_BOT_TOKEN')}"
+        latencies = []
+        opened = []
+        stop = asyncio.Event()
+
+        async def probe():
+            while not stop.is_set():
+                start = time.perf_counter()
+                response = await client.post(webhook, json={})
+                assert response.status_code == 200
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        async def terminal(index):
+            async with client.websocket(f"/ws/ssh/host{index}") as ws:
+                opened.append(await asyncio.wait_for(ws.receive(), 10))
+
+        prober = asyncio.ensure_future(probe())
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(terminal(index) for index in range(terminals)))
+        finally:
+            stop.set()
+            await prober
+        return time.perf_counter() - started, opened, latencies
+
+    elapsed, opened, latencies = asyncio.run(scenario())
+    assert opened == [b'$ '] * terminals
+    # 所有终端并发连接，而不是逐个等待握手
+    assert elapsed < connect_delay * 5
+    # 连接风暴期间 webhook 持续得到响应
+    assert len(latencies) >= 10
+    assert max(latencies) < 0.25
+
+def test_merged_requests_broadcast_the_result_once(monkeypatch):
+    monkeypatch.setattr(app_module.run_manager, 'host_done', lambda run, account: None)
+    monkeypatch.setattr('run_manager.target_accounts', lambda target: ['h1'])
+    monkeypatch.setattr('run_manager.host_key', lambda account: account)
+    broadcasts = []
+
+    async def record(message):
+        broadcasts.append(message)
+
+    monkeypatch.setattr(app_module, 'broadcast_output', record)
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def fake_main(command, **kwargs):
+            if command == 'blocker':
+                await gate.wait()
+            return 1, 1, []
+
+        monkeypatch.setattr(app_module, 'host_execute_main', fake_main)
+        blocker = asyncio.ensure_future(app_module.execute_host(None, 'blocker', 'h1', send_telegram=False))
+        await asyncio.sleep(0)
+        requests = [asyncio.ensure_future(app_module.execute_host(None, 'uptime', 'h1', send_telegram=False))
+                    for _ in range(3)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await blocker
+        return await asyncio.gather(*requests)
+
+    assert asyncio.run(scenario()) == [(1, 1, [])] * 3
+    assert broadcasts.count(app_module.execution_result_message(1, 1, [])) == 2
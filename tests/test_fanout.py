@@ -0,0 +1,50 @@
+import asyncio
+
+from fanout import PrioritySlots, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, effective_priority
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_priority_slots_prefer_interactive_then_fifo():
+    async def scenario():
+        slots = PrioritySlots(1, aging=0)
+        order = []
+
+        async def worker(name, priority):
+            async with slots.slot(priority):
+                order.append(name)
+
+        await slots.acquire()
+        tasks = [asyncio.ensure_future(worker(name, priority)) for name, priority in
+                 (('bg1', PRIORITY_BACKGROUND), ('bg2', PRIORITY_BACKGROUND), ('manual', PRIORITY_INTERACTIVE))]
+        await settle()
+        assert slots.waiting() == 3
+        slots.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario()) == ['manual', 'bg1', 'bg2']
+
+def test_priority_slots_skip_cancelled_waiter():
+    async def scenario():
+        slots = PrioritySlots(1, aging=0)
+        await slots.acquire()
+        cancelled = asyncio.ensure_future(slots.acquire(PRIORITY_INTERACTIVE))
+        waiting = asyncio.ensure_future(slots.acquire(PRIORITY_BACKGROUND))
+        await settle()
+        cancelled.cancel()
+        await settle()
+        slots.release()
+        await asyncio.wait_for(waiting, 1)
+        return cancelled.cancelled(), slots.waiting()
+
+    assert run(scenario()) == (True, 0)
+
+def test_effective_priority_ages_background_jobs():
+    assert effective_priority(PRIORITY_BACKGROUND, 59, aging=60) == PRIORITY_BACKGROUND
+    assert effective_priority(PRIORITY_BACKGROUND, 60, aging=60) == PRIORITY_INTERACTIVE
+    assert effective_priority(PRIORITY_BACKGROUND, 600, aging=0) == PRIORITY_BACKGROUND
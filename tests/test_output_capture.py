@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+import output_capture
+from output_capture import OutputCapture
+
+def test_spilled_output_is_compressed_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_capture, 'get_spill_dir', lambda: str(tmp_path))
+    opened_in = []
+    real_open = output_capture.gzip.open
+
+    def record_open(path, mode='rb', *args, **kwargs):
+        if 'w' in mode:
+            opened_in.append(threading.current_thread())
+        return real_open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(output_capture.gzip, 'open', record_open)
+
+    async def scenario():
+        capture = OutputCapture('host', memory_limit=100, excerpt_size=10)
+        chunks = [f"line {i}\n" for i in range(20000)]
+        for chunk in chunks:
+            await capture.write(chunk)
+        await capture.close()
+        return capture, ''.join(chunks)
+
+    capture, expected = asyncio.run(scenario())
+    assert capture.spilled and capture.size == len(expected)
+    assert ''.join(capture.iter_text()) == expected
+    assert opened_in and threading.main_thread() not in opened_in
+    assert capture.excerpt().startswith('line 0\nli') and capture.excerpt().endswith('line 19999\n'[-10:])
+    capture.discard()
+
+def test_small_output_stays_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_capture, 'get_spill_dir', lambda: str(tmp_path))
+
+    async def scenario():
+        capture = OutputCapture('host', excerpt_size=100)
+        await capture.write('hello\n')
+        await capture.close()
+        return capture
+
+    capture = asyncio.run(scenario())
+    assert not capture.spilled
+    assert capture.getvalue() == 'hello\n'
+    assert list(tmp_path.iterdir()) == []
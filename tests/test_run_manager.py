@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+import run_manager
+from fanout import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from run_manager import RunManager, RunCancelled
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+@pytest.fixture
+def hosts_by_name(monkeypatch):
+    # 目标表达式直接视为逗号分隔的主机，主机键即主机名，不依赖主机清单
+    monkeypatch.setattr(run_manager, 'target_accounts', lambda target: target.split(','))
+    monkeypatch.setattr(run_manager, 'host_key', lambda account: account)
+
+def test_run_manager_queues_only_overlapping_runs(hosts_by_name):
+    async def scenario():
+        manager = RunManager()
+        gate = asyncio.Event()
+        started = []
+
+        async def job(run):
+            started.append(run.target)
+            await gate.wait()
+            return run.target
+
+        first = asyncio.ensure_future(manager.run('uptime', 'h1,h2', job))
+        await settle()
+        other = asyncio.ensure_future(manager.run('uptime', 'h3', job))
+        overlapping = asyncio.ensure_future(manager.run('uptime', 'h2', job))
+        await settle()
+        states = [(run['target'], run['state']) for run in manager.snapshot()]
+        gate.set()
+        return states, started, await asyncio.gather(first, other, overlapping)
+
+    states, started, results = run(scenario())
+    assert states == [('h1,h2', 'running'), ('h3', 'running'), ('h2', 'queued')]
+    assert started[:2] == ['h1,h2', 'h3']
+    assert results == ['h1,h2', 'h3', 'h2']
+
+def test_run_manager_cancel_queued_run(hosts_by_name):
+    async def scenario():
+        manager = RunManager()
+        gate = asyncio.Event()
+
+        async def job(run):
+            await gate.wait()
+
+        blocker = asyncio.ensure_future(manager.run('blocker', 'h1', job))
+        await settle()
+        waiters = [asyncio.ensure_future(manager.run('uptime', 'h1', job)) for _ in range(2)]
+        await settle()
+        run_id = manager.snapshot()[1]['id']
+        cancelled = manager.cancel(run_id)
+        gate.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        await blocker
+        return cancelled.state, results, manager.cancel(run_id), manager.snapshot()
+
+    state, results, again, snapshot = run(scenario())
+    assert state == 'cancelled'
+    assert all(isinstance(result, RunCancelled) for result in results)
+    assert again is None
+    assert snapshot == []
+
+def test_run_manager_resolves_targets_once_at_submit(monkeypatch):
+    inventory = {'web': ['h1']}
+    monkeypatch.setattr(run_manager, 'target_accounts', lambda target: list(inventory[target]))
+    monkeypatch.setattr(run_manager, 'host_key', lambda account: account)
+
+    async def scenario():
+        manager = RunManager()
+        gate = asyncio.Event()
+
+        async def blocker(run):
+            await gate.wait()
+
+        async def job(run):
+            return run.accounts, set(manager._busy)
+
+        first = asyncio.ensure_future(manager.run('blocker', 'web', blocker))
+        await settle()
+        queued = asyncio.ensure_future(manager.run('uptime', 'web', job))
+        await settle()
+        # 排队期间目标新增的主机不属于这次执行，也没有被加锁
+        inventory['web'].append('h2')
+        gate.set()
+        await first
+        return await queued
+
+    assert run(scenario()) == (['h1'], {'h1'})
+
+def test_run_manager_dispatches_interactive_before_background(hosts_by_name):
+    async def scenario():
+        manager = RunManager()
+        gate = asyncio.Event()
+        order = []
+
+        async def job(run):
+            order.append(run.command)
+            await gate.wait()
+
+        blocker = asyncio.ensure_future(manager.run('blocker', 'h1', job))
+        await settle()
+        queued = [asyncio.ensure_future(manager.run('scheduled', 'h1', job, priority=PRIORITY_BACKGROUND)),
+                  asyncio.ensure_future(manager.run('manual', 'h1', job, priority=PRIORITY_INTERACTIVE))]
+        await settle()
+        gate.set()
+        await asyncio.gather(blocker, *queued)
+        return order
+
+    assert run(scenario()) == ['blocker', 'manual', 'scheduled']
+
+def test_run_manager_merges_identical_queued_runs(hosts_by_name):
+    async def scenario():
+        manager = RunManager()
+        gate = asyncio.Event()
+        calls = []
+
+        async def blocker(run):
+            await gate.wait()
+
+        async def job(run):
+            calls.append(run.priority)
+            return 'done'
+
+        first = asyncio.ensure_future(manager.run('blocker', 'h1', blocker))
+        await settle()
+        original = asyncio.ensure_future(manager.run('uptime', 'h1', job, priority=PRIORITY_BACKGROUND))
+        merged = asyncio.ensure_future(manager.run('uptime', 'h1', job, priority=PRIORITY_INTERACTIVE))
+        separate = asyncio.ensure_future(manager.run('uptime', 'h1', job, delivery='web'))
+        await settle()
+        queued = [(run['merged'], run['priority']) for run in manager.snapshot() if run['state'] == 'queued']
+        # 最初的请求离开后，合并进来的请求仍然得到结果
+        original.cancel()
+        await settle()
+        gate.set()
+        await first
+        return queued, await merged, await separate, original.cancelled(), calls
+
+    queued, merged, separate, cancelled, calls = run(scenario())
+    assert queued == [(1, 'interactive'), (0, 'interactive')]
+    assert (merged, separate, cancelled) == ('done', 'done', True)
+    assert calls == [PRIORITY_INTERACTIVE, PRIORITY_INTERACTIVE]
+
+def test_run_manager_releases_finished_hosts_early(hosts_by_name):
+    async def scenario():
+        manager = RunManager()
+        gate = asyncio.Event()
+        events = []
+
+        async def scheduled(run):
+            manager.host_done(run, 'h1')
+            await gate.wait()
+
+        async def manual(run):
+            events.append('manual')
+
+        background = asyncio.ensure_future(manager.run('all', 'h1,h2', scheduled, priority=PRIORITY_BACKGROUND))
+        await settle()
+        await asyncio.wait_for(manager.run('uptime', 'h1', manual), 1)
+        queued = asyncio.ensure_future(manager.run('uptime', 'h2', manual))
+        await settle()
+        state = manager.snapshot()[-1]['state']
+        gate.set()
+        await asyncio.gather(background, queued)
+        return events, state
+
+    assert run(scenario()) == (['manual', 'manual'], 'queued')
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import ssh
+from translations import get_translation
+
+class FakeChannel:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeStdin:
+    def __init__(self):
+        self.channel = FakeChannel()
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        pass
+
+class ClosedStdout:
+    async def read(self, size):
+        return ''
+
+def test_session_ends_when_remote_shell_exits(monkeypatch):
+    released = []
+    monkeypatch.setattr(ssh.ssh_pool.pool, 'release', lambda pooled, discard=False: released.append(pooled))
+    replies = []
+
+    async def reply_text(text):
+        replies.append(text)
+
+    async def scenario():
+        chat_id = 42
+        stdin = FakeStdin()
+        pooled = SimpleNamespace(channel_slots=asyncio.Semaphore(0))
+        ssh.ssh_sessions[chat_id] = {'conn': None, 'pooled': pooled, 'stdin': stdin, 'stdout': ClosedStdout(),
+                                     'stderr': None, 'prompt': '$'}
+        ssh.ssh_timeouts[chat_id] = asyncio.ensure_future(asyncio.sleep(900))
+        update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id),
+                                 message=SimpleNamespace(text='exit', reply_text=reply_text))
+        await ssh.handle_ssh_command_execution(update, SimpleNamespace(bot=None))
+        return stdin, pooled
+
+    stdin, pooled = asyncio.run(scenario())
+    assert stdin.written == ['exit\n'] and stdin.channel.closed
+    assert released == [pooled] and pooled.channel_slots._value == 1
+    assert 42 not in ssh.ssh_sessions and 42 not in ssh.ssh_timeouts and 42 not in ssh.is_command_running
+    assert replies == [get_translation('ssh_channel_closed')]
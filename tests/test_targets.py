@@ -0,0 +1,42 @@
+import pytest
+
+from targets import compile_target, resolve_targets, TargetError
+
+ACCOUNTS = [
+    {'customhostname': 'Web1', 'ssluser': 'root', 'sslhost': '10.0.0.1', 'tags': ['web', 'Prod']},
+    {'customhostname': 'web2', 'ssluser': 'root', 'sslhost': '10.0.0.2', 'tags': 'web'},
+    {'customhostname': 'db1', 'ssluser': 'admin', 'sslhost': '10.0.0.3', 'port': 2222, 'tags': ['prod']},
+]
+
+@pytest.fixture
+def host_groups(monkeypatch):
+    monkeypatch.setattr('targets.store.list_groups', lambda: {'Databases': ['DB1'], 'empty': []})
+
+def names(accounts):
+    return [account['customhostname'] for account in accounts]
+
+def test_compile_target_structure():
+    clauses, exclusions = compile_target('web1, tag:Web&!group:DB ,!+1')
+    assert clauses == (((False, 'host', 'web1'),), ((False, 'tag', 'web'), (True, 'group', 'db')))
+    assert exclusions == (((False, 'first', 1),),)
+    assert compile_target('') == compile_target('all') == ((((False, 'all', None),),), ())
+
+@pytest.mark.parametrize('expression', ['web1,,&db1', '+x', '!'])
+def test_compile_target_rejects_invalid_terms(expression):
+    with pytest.raises(TargetError):
+        compile_target(expression)
+
+@pytest.mark.parametrize('expression, expected', [
+    ('all', ['Web1', 'web2', 'db1']),
+    ('WEB2,web1', ['Web1', 'web2']),
+    ('tag:prod', ['Web1', 'db1']),
+    ('tag:web&tag:prod', ['Web1']),
+    ('all,!tag:web', ['db1']),
+    ('+1,-1', ['Web1', 'db1']),
+    ('admin@10.0.0.3:2222', ['db1']),
+    ('group:databases', ['db1']),
+    ('GROUP:Databases,group:empty', ['db1']),
+    ('missing', []),
+])
+def test_resolve_targets_on_given_accounts(host_groups, expression, expected):
+    assert names(resolve_targets(expression, ACCOUNTS)) == expected
@@ -0,0 +1,19 @@
+from terminal_output import LineAssembler
+
+def test_line_assembler_joins_partial_lines_and_split_escapes():
+    assembler = LineAssembler()
+    assert assembler.feed('hel') == []
+    assert assembler.feed('lo \x1b[3') == []
+    assert assembler.partial_line == 'hello '
+    assert assembler.feed('2mworld\x1b[0m\nsecond\r\nroot@host:~') == ['hello world', 'second\r']
+    assert assembler.partial_line == 'root@host:~'
+    assert not assembler.at_prompt()
+
+def test_line_assembler_detects_prompt():
+    assembler = LineAssembler()
+    assembler.feed('output\nroot@host:~# \x1b[')
+    assert not assembler.at_prompt()
+    assembler.feed('0m ')
+    assert assembler.at_prompt()
+    assembler.feed('\n')
+    assert not assembler.at_prompt()
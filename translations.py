@@ -23,6 +23,9 @@ translations = {
                        "/pausetask <任务ID 或 all> - 暂停指定任务或所有任务\n"
                        "/resumetask <任务ID 或 all> - 恢复指定任务或所有任务\n"      
                        "/switchmode - 切换时间单位模式（小时/分钟）\n"
+                       "/history [执行ID] - 查看批量执行记录和各主机耗时\n"
+                       "/runs - 查看正在进行和排队中的批量执行\n"
+                       "/cancelrun <ID> - 取消排队中的批量执行\n"
                        "/language - 切换语言 (Switch language)",
         'feedback_button': "问题反馈",
         'no_permission': "您没有权限使用此命令。",
@@ -61,7 +64,8 @@ translations = {
                           "- '+n' 或 '-n' 表示前n个或后n个主机\n"
                           "- 逗号分隔的主机名列表\n"
                           "- 逗号分隔的组名列表（以 'group:' 为前缀）\n"
-                          "- 以上类型的组合，用逗号分隔\n"
+                          "- 'tag:标签' 表示带有该标签的主机\n"
+                          "- 以上类型的组合，用逗号取并集，用 '&' 取交集，用 '!' 排除，例如 'tag:prod&!group:db'\n"
                           "如果不指定目标，默认为 'all'",
         'addtask_usage': "使用方法: /addtask <命令> <周期> <偏差> [目标]\n"
                          "目标可以是：\n"
@@ -69,7 +73,8 @@ translations = {
                          "- '+n' 或 '-n' 表示前n个或后n个主机\n"
                          "- 逗号分隔的主机名列表\n"
                          "- 逗号分隔的组名列表（以 'group:' 为前缀）\n"
-                         "- 以上类型的组合，用逗号分隔\n"
+                         "- 'tag:标签' 表示带有该标签的主机\n"
+                         "- 以上类型的组合，用逗号取并集，用 '&' 取交集，用 '!' 排除，例如 'tag:prod&!group:db'\n"
                          "如果不指定目标，默认为 'all'\n"
                          "当前模式为{time_mode}，周期单位为{interval_unit}，偏差单位为{variation_unit}",
         'task_added_detailed': "新任务已添加：\n"
@@ -130,6 +135,7 @@ translations = {
         'ssh_disconnected': "已断开 SSH 连接",
         'no_active_ssh': "当前没有活动的 SSH 连接",
         'ssh_session_timeout': "SSH 会话已超时，连接已断开",
+        'ssh_channel_closed': "远程 shell 已退出（例如执行了 exit），SSH 会话已结束",
         'command_execution_error': "执行命令时出错：{error}",
         'no_active_connection': "没有活动的 SSH 连接，请先使用 /ssh 连接到主机",
         'enter_password': "请输入密码（消息将在短时间后自动删除）：",
@@ -148,9 +154,35 @@ translations = {
         'host_login_failed': "{host}主机于北京时间 {beijing_time}（UTC时间 {utc_time}）登录失败。错误: {error}",
         'all_hosts_complete': "所有主机执行命令完成！成功执行命令的主机数量：{success_count}/{total_count}",
         'no_accounts_json': "未设置 ACCOUNTS_JSON 环境变量",
-        'command_execution_timeout': "{host}主机执行命令超时，正在重试...",
+        'command_execution_timeout': "{host}主机执行命令已超过10秒，仍在等待执行结果...",
         'command_execution_failed': "{host}主机执行命令失败。",
         'host_operation_timeout': "{host}主机操作总时间超过3分钟，已退出。",
+        'run_progress': "批量执行进度\n命令: {command}\n目标: {target}\n已完成: {done}/{total}  成功: {success}  失败: {failed}  等待中: {pending}",
+        'run_progress_finished': "批量执行已结束（用时 {elapsed} 秒）",
+
+        # Run history translations
+        'history_empty': "暂无执行记录。",
+        'history_header': "最近的批量执行记录（使用 /history <执行ID> 查看详情）：",
+        'history_run': "#{id} 北京时间 {time}  成功 {success}/{total}  用时 {duration}秒\n命令: {command}  目标: {target}",
+        'history_run_detail': "执行记录 #{id}（北京时间 {time}）\n命令: {command}\n目标: {target}\n成功: {success}/{total}  用时: {duration}秒",
+        'history_slowest_hosts': "最慢的主机：",
+        'history_failed_hosts': "失败的主机：",
+        'history_host_line': "{host}: 连接 {connect_time}秒 执行 {exec_time}秒 退出码 {exit_status} 输出 {output_size} 字符",
+        'history_run_not_found': "未找到执行记录 #{id}",
+        'history_usage': "使用方法: /history [执行ID]",
+
+        # Run queue translations
+        'run_queued': "批量执行 #{id} 的目标主机正在被其他执行使用，已排队（第 {position} 位），使用 /cancelrun {id} 可取消",
+        'run_merged': "与排队中的批量执行 #{id}（第 {position} 位）的命令和目标相同，已合并，将随其一起执行",
+        'run_cancelled': "排队中的批量执行 #{id} 已取消",
+        'runs_empty': "当前没有正在进行或排队中的批量执行。",
+        'runs_header': "批量执行队列（使用 /cancelrun <ID> 取消排队中的执行）：",
+        'runs_running': "#{id} 执行中  命令: {command}  目标: {target}  主机数: {hosts}",
+        'runs_queued': "#{id} 排队第 {position} 位（{priority}）  命令: {command}  目标: {target}  主机数: {hosts}",
+        'priority_interactive': "手动",
+        'priority_background': "定时",
+        'cancelrun_usage': "使用方法: /cancelrun <ID>",
+        'cancelrun_not_queued': "#{id} 不在队列中（可能已经开始执行或已结束）",
 
         # Upload_keys.py translations
         'accounts_json_not_set': 'ACCOUNTS_JSON 环境变量未设置。',
@@ -183,6 +215,9 @@ translations = {
                        "/pausetask <task ID or all> - Pause specified task or all tasks\n"
                        "/resumetask <task ID or all> - Resume specified task or all tasks\n"
                        "/switchmode - Switch time unit mode (Hour/Minute)\n"
+                       "/history [run ID] - Show batch run history and per-host timings\n"
+                       "/runs - Show running and queued batch runs\n"
+                       "/cancelrun <ID> - Cancel a queued batch run\n"
                        "/language - Switch language (切换语言)",
         'feedback_button': "Feedback",
         'no_permission': "You don't have permission to use this command.",
@@ -221,7 +256,8 @@ translations = {
                           "- '+n' or '-n' for the first or last n hosts\n"
                           "- Comma-separated list of hostnames\n"
                           "- Comma-separated list of group names (prefixed with 'group:')\n"
-                          "- Combination of the above, separated by commas\n"
+                          "- 'tag:name' for hosts carrying that tag\n"
+                          "- Combination of the above: commas for union, '&' for intersection, '!' to exclude, e.g. 'tag:prod&!group:db'\n"
                           "If no target is specified, 'all' is used by default",
         'addtask_usage': "Usage: /addtask <command> <interval> <variation> [target]\n"
                          "Target can be:\n"
@@ -229,7 +265,8 @@ translations = {
                          "- '+n' or '-n' for the first or last n hosts\n"
                          "- Comma-separated list of hostnames\n"
                          "- Comma-separated list of group names (prefixed with 'group:')\n"
-                         "- Combination of the above, separated by commas\n"
+                         "- 'tag:name' for hosts carrying that tag\n"
+                         "- Combination of the above: commas for union, '&' for intersection, '!' to exclude, e.g. 'tag:prod&!group:db'\n"
                          "If no target is specified, 'all' is used by default\n"
                          "Current mode is {time_mode}, interval unit is {interval_unit}, variation unit is {variation_unit}",
         'task_added': "Task added, ID: {task_id}",
@@ -292,6 +329,7 @@ translations = {
         'ssh_disconnected': "SSH connection disconnected",
         'no_active_ssh': "No active SSH connection",
         'ssh_session_timeout': "SSH session timed out, connection closed",
+        'ssh_channel_closed': "The remote shell has exited (for example after exit), the SSH session has ended",
         'command_execution_error': "Error executing command: {error}",
         'no_active_connection': "No active SSH connection. Please use /ssh to connect to a host first.",
         'enter_password': "Please enter the password (this message will be deleted shortly):",
@@ -310,9 +348,35 @@ translations = {
         'host_login_failed': "Failed to log in to {host} at Beijing time {beijing_time} (UTC time {utc_time}). Error: {error}",
         'all_hosts_complete': "Command execution completed on all hosts! Successfully executed on {success_count}/{total_count} hosts",
         'no_accounts_json': "ACCOUNTS_JSON environment variable not set",
-        'command_execution_timeout': "Command execution timeout for {host}, retrying...",
+        'command_execution_timeout': "Command on {host} is still running after 10 seconds, waiting for it to finish...",
         'command_execution_failed': "Command execution failed for {host}.",
         'host_operation_timeout': "Host operation for {host} exceeded 3 minutes, exiting.",
+        'run_progress': "Batch run progress\nCommand: {command}\nTarget: {target}\nDone: {done}/{total}  Success: {success}  Failed: {failed}  Pending: {pending}",
+        'run_progress_finished': "Batch run finished (took {elapsed} seconds)",
+
+        # Run history translations
+        'history_empty': "No runs recorded yet.",
+        'history_header': "Recent batch runs (use /history <run ID> for details):",
+        'history_run': "#{id} Beijing time {time}  Success {success}/{total}  Took {duration}s\nCommand: {command}  Target: {target}",
+        'history_run_detail': "Run #{id} (Beijing time {time})\nCommand: {command}\nTarget: {target}\nSuccess: {success}/{total}  Took: {duration}s",
+        'history_slowest_hosts': "Slowest hosts:",
+        'history_failed_hosts': "Failed hosts:",
+        'history_host_line': "{host}: connect {connect_time}s exec {exec_time}s exit status {exit_status} output {output_size} chars",
+        'history_run_not_found': "Run #{id} not found",
+        'history_usage': "Usage: /history [run ID]",
+
+        # Run queue translations
+        'run_queued': "The target hosts of batch run #{id} are in use by another run; queued at position {position}. Use /cancelrun {id} to cancel",
+        'run_merged': "Same command and target as queued batch run #{id} (position {position}); merged and will run with it",
+        'run_cancelled': "Queued batch run #{id} was cancelled",
+        'runs_empty': "No batch runs are running or queued.",
+        'runs_header': "Batch run queue (use /cancelrun <ID> to cancel a queued run):",
+        'runs_running': "#{id} running  Command: {command}  Target: {target}  Hosts: {hosts}",
+        'runs_queued': "#{id} queued at position {position} ({priority})  Command: {command}  Target: {target}  Hosts: {hosts}",
+        'priority_interactive': "manual",
+        'priority_background': "scheduled",
+        'cancelrun_usage': "Usage: /cancelrun <ID>",
+        'cancelrun_not_queued': "#{id} is not queued (it may have started or finished already)",
 
         # Upload_keys.py translations
         'accounts_json_not_set': 'ACCOUNTS_JSON environment variable is not set.',
@@ -1,10 +1,10 @@
-import json
-import paramiko
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
 from translations import get_translation
 from language_manager import language_manager
+import ssh_pool
+from inventory import inventory
 
 async def upload_public_keys(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
@@ -14,23 +14,18 @@ async def upload_public_keys(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(get_translation('no_permission', language))
         return
 
-    accounts_json = os.getenv('ACCOUNTS_JSON')
-    if not accounts_json:
+    accounts = inventory.accounts()
+    if not accounts:
         await update.message.reply_text(get_translation('accounts_json_not_set', language))
         return
 
-    try:
-        accounts = json.loads(accounts_json)
-    except json.JSONDecodeError:
-        await update.message.reply_text(get_translation('accounts_json_error', language))
-        return
-
     results = []
     for account in accounts:
         customhostname = account.get('customhostname', '').lower()
         sslhost = account.get('sslhost') or account.get('hostname')
         ssluser = account.get('ssluser') or account.get('username')
         password = account.get('password')
+        port = account.get('port', 22)
         public_key_path = account.get('publickey')
         host_identifier = f"{customhostname + ': ' if customhostname else ''}{ssluser}@{sslhost}"
 
@@ -46,11 +41,8 @@ async def upload_public_keys(update: Update, context: ContextTypes.DEFAULT_TYPE)
             with open(public_key_path, 'r') as f:
                 public_key = f.read().strip()
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(sslhost, username=ssluser, password=password)
-            ssh.exec_command(f'mkdir -p ~/.ssh && echo "{public_key}" >> ~/.ssh/authorized_keys')
-            ssh.close()
+            async with ssh_pool.pool.connection(sslhost, port, ssluser, password) as conn:
+                await conn.run(f'mkdir -p ~/.ssh && echo "{public_key}" >> ~/.ssh/authorized_keys')
 
             results.append(get_translation('public_key_upload_success', language).format(host=host_identifier))
         except Exception as e: